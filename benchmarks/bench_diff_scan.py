@@ -0,0 +1,101 @@
+"""
+Compare the per-file feature path that rebuilds and rescans the diff text for every metric
+with the single-pass code_features.scan_diff.
+
+    python benchmarks/bench_diff_scan.py [--lines N] [--files N] [--repeat N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+
+import code_features
+import risk_score_pipeline
+
+LINE_TEMPLATES = [
+    "def {snake}(self, {camel}, other_value):",
+    "    if {camel} is None:",
+    "        for item in range({number}):",
+    "            {snake} = {camel}.format(item)",
+    "    # TODO: handle the {snake} token",
+    "import {snake}",
+    "    while {snake} < {number}:",
+    "        try:",
+    "            password_hash = compute({camel})",
+    "",
+]
+
+
+def synthetic_diff(lines, seed):
+    rng = random.Random(seed)
+    out = [f"@@ -1,{lines} +1,{lines} @@ class Example:"]
+    for i in range(lines):
+        template = LINE_TEMPLATES[i % len(LINE_TEMPLATES)]
+        prefix = rng.choice(" +-")
+        out.append(prefix + template.format(
+            snake=f"value_{rng.randrange(1000)}_x".replace("0", "a").replace("1", "b"),
+            camel=f"someValue{'Ab' * rng.randrange(3)}",
+            number=rng.randrange(100),
+        ))
+        if i % 500 == 499:
+            out.append("\\ No newline at end of file")
+    return "\n".join(out) + "\n"
+
+
+def rescanning_metrics(files_changed):
+    """The previous implementation: rebuild the cleaned text and rescan it per metric."""
+    features = []
+    for file in files_changed:
+        file_content = code_features.get_total_diff([file])
+        features.append((
+            code_features.compute_avg_nesting_depth_without_ast(file_content),
+            code_features.compute_avg_indentation(file_content),
+            code_features.compute_naming_convention_ratios(file_content),
+        ))
+    total_diff = code_features.get_total_diff(files_changed)
+    risk = (
+        risk_score_pipeline.calculate_complexity_score(total_diff),
+        risk_score_pipeline.check_sensitive_data(total_diff),
+        risk_score_pipeline.count_external_dependencies(total_diff),
+    )
+    return features, risk
+
+
+def single_pass_metrics(files_changed):
+    scans = [code_features.scan_diff(file["diff"], risk_score_pipeline.COMPLEXITY_MATCHER,
+                                     risk_score_pipeline.SENSITIVE_MATCHER) for file in files_changed]
+    return [code_features.features_from_scan(scan) for scan in scans], scans
+
+
+def best_time(func, files_changed, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(files_changed)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=20000, help="lines per file diff")
+    parser.add_argument("--files", type=int, default=5, help="files per commit")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    files_changed = [{"file_path": f"module_{i}.py", "diff": synthetic_diff(args.lines, i)} for i in range(args.files)]
+    size_mb = sum(len(file["diff"]) for file in files_changed) / 1e6
+
+    rescanning = best_time(rescanning_metrics, files_changed, args.repeat)
+    single_pass = best_time(single_pass_metrics, files_changed, args.repeat)
+    print(f"{args.files} files x {args.lines} lines ({size_mb:.1f} MB of diff)")
+    print(f"  rescanning:  {rescanning * 1000:8.1f} ms")
+    print(f"  single pass: {single_pass * 1000:8.1f} ms")
+    print(f"  speedup:     {rescanning / single_pass:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Scan time of keyword_matcher.KeywordMatcher as the keyword list grows, next to one `in`
+check per keyword on the lowered text.
+
+    python benchmarks/bench_keyword_matcher.py [--lines N] [--repeat N]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+
+import keyword_matcher
+from bench_diff_scan import synthetic_diff
+
+
+def random_keywords(count, seed):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(string.ascii_lowercase + "_") for _ in range(rng.randint(5, 14)))
+            for _ in range(count)]
+
+
+def best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = synthetic_diff(args.lines, 0)
+    print(f"{len(text) / 1e6:.1f} MB of diff")
+    print(f"{'keywords':>10} {'matcher':>12} {'per-keyword in':>16}")
+    for count in (10, 100, 1000):
+        keywords = random_keywords(count, count)
+        matcher = keyword_matcher.KeywordMatcher(keywords, ignore_case=True)
+        matcher_time = best_time(lambda: matcher.count(text), args.repeat)
+        naive_time = best_time(lambda: [keyword for keyword in keywords if keyword in text.lower()], args.repeat)
+        print(f"{count:>10} {matcher_time * 1000:>10.1f}ms {naive_time * 1000:>14.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare k-nearest-neighbour lookups through the LSH index with the exhaustive scan, on clustered
+synthetic fingerprints: query latency, recall of the true neighbours and the error of the
+mean similarity the kNN mode scores with.
+
+    python benchmarks/bench_knn.py [--rows N] [--dims N] [--queries N] [--k N] [--tables N] [--bits N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+
+import neighbours
+
+ROWS_PER_CLUSTER = 500
+
+
+def clustered_vectors(rows, dims, queries, seed=0):
+    """
+    Rows scattered around random centres, like commits falling into kinds (docs, refactors,
+    features), plus queries drawn from the same clusters.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(rows // ROWS_PER_CLUSTER, 20), dims)).astype(np.float32)
+    noise = 0.6
+
+    def draw(count):
+        return centres[rng.integers(0, len(centres), count)] + noise * rng.standard_normal((count, dims)).astype(np.float32)
+    return draw(rows), draw(queries)
+
+
+def per_query(mode, index, queries, k):
+    start = time.perf_counter()
+    results = [neighbours.nearest(index, query, k, mode=mode) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=260, help="fingerprint width (4 features + 256 projected)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--tables", type=int, default=None)
+    parser.add_argument("--bits", type=int, default=None, help="defaults to neighbours.default_bits(rows)")
+    args = parser.parse_args()
+
+    vectors, queries = clustered_vectors(args.rows, args.dims, args.queries)
+    start = time.perf_counter()
+    index = neighbours.new_index(args.dims, args.tables, args.bits or neighbours.default_bits(args.rows))
+    neighbours.add(index, [f"{row:040x}" for row in range(args.rows)], vectors)
+    neighbours.sort_buckets(index)
+    build = time.perf_counter() - start
+
+    lsh, approximate = per_query("lsh", index, queries, args.k)
+    exact, reference = per_query("exact", index, queries, args.k)
+    recall = np.mean([len(set(found) & set(true)) / args.k for (found, _), (true, _) in zip(approximate, reference)])
+    error = np.mean([abs(np.mean(found) - np.mean(true)) for (_, found), (_, true) in zip(approximate, reference)])
+
+    print(f"{args.rows} rows x {args.dims} dims, {index['tables']} tables x {index['bits']} bits, k={args.k}")
+    print(f"  index build:     {build * 1000:8.1f} ms")
+    print(f"  lsh query:       {lsh * 1000:8.3f} ms")
+    print(f"  exact query:     {exact * 1000:8.3f} ms")
+    print(f"  recall@{args.k}:       {recall:8.3f}")
+    print(f"  mean sim error:  {error:8.5f}")
+
+
+if __name__ == "__main__":
+    main()
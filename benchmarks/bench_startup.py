@@ -0,0 +1,88 @@
+"""
+Import time of the pipeline entry points and wall time of the runs that exit early: HEAD
+marked #no_anomaly, HEAD without Python changes and a rerun on an already scored commit.
+
+    python benchmarks/bench_startup.py [--repeat N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline")
+ENTRY_POINTS = ["fingerprint_pipeline.py", "risk_score_pipeline.py", "analyze_commit.py"]
+
+
+def best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def git(repo, *args):
+    subprocess.run(["git", "-C", repo, "-c", "user.name=bench", "-c", "user.email=bench@example.com", *args],
+                   check=True, capture_output=True)
+
+
+def commit_file(repo, path, content, message):
+    with open(os.path.join(repo, path), "a") as f:
+        f.write(content)
+    git(repo, "add", path)
+    git(repo, "commit", "-q", "-m", message)
+
+
+def run_script(script, env):
+    subprocess.run([sys.executable, script], cwd=PIPELINE_DIR, env=env, capture_output=True)
+
+
+def import_check(module):
+    code = f"import {module}, sys; print('sklearn' in sys.modules)"
+    return subprocess.run([sys.executable, "-c", code], cwd=PIPELINE_DIR, capture_output=True, text=True).stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':>22} {'import':>10} {'loads sklearn':>14}")
+    baseline_time = best_time(lambda: subprocess.run([sys.executable, "-c", "pass"]), args.repeat)
+    print(f"{'(interpreter)':>22} {baseline_time * 1000:>8.0f}ms")
+    for module in ["fingerprint_pipeline", "risk_score_pipeline", "analyze_commit", "baseline"]:
+        elapsed = best_time(lambda: subprocess.run([sys.executable, "-c", f"import {module}"], cwd=PIPELINE_DIR),
+                            args.repeat)
+        print(f"{module:>22} {elapsed * 1000:>8.0f}ms {import_check(module):>14}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        repo = os.path.join(workdir, "repo")
+        os.makedirs(repo)
+        git(repo, "init", "-q")
+        for i in range(20):
+            commit_file(repo, f"module_{i % 4}.py", f"def func_{i}(value):\n    return value + {i}\n", f"add func {i}")
+        env = dict(os.environ, REPO_PATH=repo, REPO_URL=repo, PIPELINE_CACHE_DIR=os.path.join(workdir, "cache"))
+
+        cases = {}
+        for script in ENTRY_POINTS:
+            run_script(script, env)
+        cases["already scored"] = {script: best_time(lambda: run_script(script, env), args.repeat)
+                                   for script in ENTRY_POINTS}
+        commit_file(repo, "README.md", "docs\n", "update docs")
+        cases["no .py changes"] = {script: best_time(lambda: run_script(script, env), args.repeat)
+                                   for script in ENTRY_POINTS}
+        commit_file(repo, "module_0.py", "x = 1\n", "tweak #no_anomaly")
+        cases["#no_anomaly"] = {script: best_time(lambda: run_script(script, env), args.repeat)
+                                for script in ENTRY_POINTS}
+
+    print()
+    print(f"{'early exit':>16} " + " ".join(f"{script:>24}" for script in ENTRY_POINTS))
+    for case, timings in cases.items():
+        print(f"{case:>16} " + " ".join(f"{timings[script] * 1000:>22.0f}ms" for script in ENTRY_POINTS))
+
+
+if __name__ == "__main__":
+    main()
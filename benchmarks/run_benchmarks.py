@@ -0,0 +1,185 @@
+"""
+Time every pipeline stage on a generated repository, write the timings as JSON and compare them
+with a stored baseline run.
+
+    python benchmarks/run_benchmarks.py [--commits N] [--files-per-commit N] [--diff-lines N]
+        [--vocabulary N] [--repeat N] [--output PATH] [--baseline PATH] [--threshold F]
+        [--update-baseline]
+
+Exits 1 when a stage is slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from synthetic_repo import generate_repo
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Differences below this are timer noise, whatever the ratio.
+MIN_DELTA_SECONDS = 0.005
+
+
+def best_time(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run_stages(repo_path, repeat):
+    """
+    Best-of-`repeat` seconds per stage. Each stage gets the previous stages' outputs as input,
+    so only its own work is timed.
+    """
+    import git
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    import baseline
+    import churn_index
+    import code_features
+    import fingerprints
+    import history
+    import risk_score_pipeline
+
+    repo = git.Repo(repo_path)
+    commits = list(history.iter_commits(repo))
+    stages = {}
+
+    stages["history_extraction"], files_by_sha = best_time(
+        lambda: history.load_files_changed(commits, cache=None), repeat)
+    commit_data = history.commit_records(commits, files_by_sha)
+    messages = [commit["message"] for commit in commit_data]
+
+    stages["get_total_diff"], _ = best_time(
+        lambda: [code_features.get_total_diff(commit["files_changed"]) for commit in commit_data], repeat)
+    stages["calculate_features"], _ = best_time(
+        lambda: [code_features.calculate_features(commit) for commit in commit_data], repeat)
+    feature_vectors = baseline.commit_feature_vectors(commit_data, workers=1)
+
+    stages["vectorizer_fit_transform"], _ = best_time(lambda: TfidfVectorizer().fit_transform(messages), repeat)
+
+    def build_baseline():
+        state = baseline.new_state("tfidf")
+        for commit, feature_vector in zip(commit_data, feature_vectors):
+            baseline.fold_commit(state, commit, feature_vector=feature_vector)
+        return state
+    stages["baseline_build"], state = best_time(build_baseline, repeat)
+
+    def similarity():
+        matrix = fingerprints.fingerprint_commits(state, commit_data, feature_vectors)
+        contributions = fingerprints.baseline_rows(state, commit_data, feature_vectors)
+        return fingerprints.prefix_similarities(matrix, contributions)
+    stages["similarity"], similarities = best_time(similarity, repeat)
+
+    def risk_scoring():
+        churn = churn_index.open_index(":memory:")
+        with churn:
+            for commit in commit_data:
+                churn_index.add_commit(churn, commit["hash"], commit["date"],
+                                       [file["file_path"] for file in commit["files_changed"]])
+        return [risk_score_pipeline.risk_record(commit, commit["files_changed"],
+                                                risk_score_pipeline.calculate_diff_metrics(commit["files_changed"]),
+                                                churn, seq)
+                for seq, commit in enumerate(commit_data, start=1)]
+    stages["risk_scoring"], risk_records = best_time(risk_scoring, repeat)
+
+    checksums = {
+        "similarity_sum": float(np.nansum(similarities)),
+        "risk_score_sum": float(sum(record["risk_score"] for record in risk_records)),
+    }
+    return stages, checksums
+
+
+def compare(results, stored, threshold):
+    """
+    Print each stage next to the baseline and return the names of the regressed stages.
+    """
+    regressions = []
+    print(f"{'stage':>26} {'baseline':>10} {'current':>10} {'change':>8}")
+    for stage, seconds in results["stages"].items():
+        before = stored["stages"].get(stage)
+        if before is None:
+            print(f"{stage:>26} {'-':>10} {seconds * 1000:>8.1f}ms")
+            continue
+        change = seconds / before - 1 if before > 0 else 0.0
+        regressed = change > threshold and seconds - before > MIN_DELTA_SECONDS
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{stage:>26} {before * 1000:>8.1f}ms {seconds * 1000:>8.1f}ms {change:>+7.0%}{marker}")
+        if regressed:
+            regressions.append(stage)
+    if results["config"] != stored["config"]:
+        print("Note: the baseline was recorded with a different configuration.")
+    if results["checksums"] != stored["checksums"]:
+        print(f"Note: scores changed since the baseline ({stored['checksums']} -> {results['checksums']}).")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commits", type=int, default=300)
+    parser.add_argument("--files-per-commit", type=int, default=3)
+    parser.add_argument("--diff-lines", type=int, default=40)
+    parser.add_argument("--vocabulary", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"))
+    parser.add_argument("--baseline", default=os.path.join(RESULTS_DIR, "baseline.json"))
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown per stage, as a fraction")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    config = {
+        "commits": args.commits, "files_per_commit": args.files_per_commit, "diff_lines": args.diff_lines,
+        "vocabulary": args.vocabulary, "seed": args.seed, "repeat": args.repeat,
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        # Module-level settings are read at import, so point them at scratch space first.
+        os.environ["PIPELINE_CACHE_DIR"] = os.path.join(workdir, "cache")
+        os.environ["RISK_KEYWORDS_PATH"] = ""
+        sys.path.insert(0, PIPELINE_DIR)
+        repo_path = generate_repo(os.path.join(workdir, "repo"), args.commits, args.files_per_commit,
+                                  args.diff_lines, args.vocabulary, args.seed)
+        stages, checksums = run_stages(repo_path, args.repeat)
+
+    results = {
+        "config": config,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "stages": stages,
+        "checksums": checksums,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        for stage, seconds in stages.items():
+            print(f"{stage:>26} {seconds * 1000:>8.1f}ms")
+        print(f"Stored as the baseline in {args.baseline}.")
+        return 0
+
+    with open(args.baseline, "r") as f:
+        stored = json.load(f)
+    regressions = compare(results, stored, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stage(s) slower than the baseline by more than {args.threshold:.0%}: "
+              f"{', '.join(regressions)}")
+        return 1
+    print(f"No stage regressed by more than {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Generate a reproducible synthetic git repository for the benchmarks, with one `git fast-import`.
+
+    python benchmarks/synthetic_repo.py PATH [--commits N] [--files-per-commit N] [--diff-lines N]
+        [--vocabulary N] [--seed N]
+"""
+import argparse
+import os
+import random
+import subprocess
+
+LINE_TEMPLATES = [
+    "def {snake}(self, {camel}, other_value):",
+    "    if {camel} is None:",
+    "        for item in range({number}):",
+    "            {snake} = {camel}.format(item)",
+    "    # handle the {snake} case",
+    "import {module}",
+    "    while {snake} < {number}:",
+    "        try:",
+    "            {snake} = compute({camel})",
+    "        except ValueError:",
+    "            api_token = load_secret('{snake}')",
+    "    return {snake}",
+    "",
+]
+AUTHORS = ["Ada Lovelace", "Grace Hopper", "Alan Turing", "Edsger Dijkstra"]
+FIRST_TIMESTAMP = 1_600_000_000
+
+
+def vocabulary_words(size, rng):
+    syllables = ["ka", "ro", "mi", "te", "lu", "sa", "no", "vi", "de", "pa", "zu", "fe"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def code_line(index, rng):
+    template = LINE_TEMPLATES[index % len(LINE_TEMPLATES)]
+    return template.format(
+        snake=f"value_{rng.choice('abcdefgh')}_{rng.choice('xyz')}",
+        camel=f"someValue{'Ab' * rng.randrange(3)}",
+        module=rng.choice(["os", "json", "requests", "numpy"]),
+        number=rng.randrange(100),
+    )
+
+
+def fast_import_stream(commits, files_per_commit, diff_lines, vocabulary, seed):
+    """
+    The fast-import commands for the whole history, as bytes. Every commit rewrites a random
+    window of diff_lines lines in files_per_commit files of a fixed pool.
+    """
+    rng = random.Random(seed)
+    words = vocabulary_words(vocabulary, rng)
+    pool = [f"pkg_{i % 5}/module_{i}.py" for i in range(max(10, files_per_commit * 4))] + ["README.md"]
+    contents = {path: [] for path in pool}
+    out = []
+
+    def data(payload):
+        encoded = payload.encode("utf-8")
+        out.append(f"data {len(encoded)}\n".encode("ascii") + encoded + b"\n")
+
+    for number in range(1, commits + 1):
+        author = rng.choice(AUTHORS)
+        email = author.lower().replace(" ", ".") + "@example.com"
+        timestamp = FIRST_TIMESTAMP + number * 3600
+        message = " ".join(rng.choice(words) for _ in range(rng.randint(3, 9)))
+        out.append(f"commit refs/heads/main\nmark :{number}\n"
+                   f"author {author} <{email}> {timestamp} +0000\n"
+                   f"committer {author} <{email}> {timestamp} +0000\n".encode("utf-8"))
+        data(message + "\n")
+        if number > 1:
+            out.append(f"from :{number - 1}\n".encode("ascii"))
+
+        for path in rng.sample(pool, min(files_per_commit, len(pool))):
+            lines = contents[path]
+            start = rng.randrange(len(lines) + 1)
+            replaced = rng.randrange(min(diff_lines, len(lines) - start) + 1)
+            lines[start:start + replaced] = [code_line(start + i, rng) for i in range(diff_lines)]
+            out.append(f"M 100644 inline {path}\n".encode("utf-8"))
+            data("\n".join(lines) + "\n")
+    return b"".join(out)
+
+
+def generate_repo(path, commits=200, files_per_commit=3, diff_lines=40, vocabulary=200, seed=0):
+    """
+    Create the repository at `path` (which must not exist yet) and return its path. The same
+    arguments always produce the same commit SHAs.
+    """
+    os.makedirs(path)
+    subprocess.run(["git", "init", "-q", path], check=True)
+    subprocess.run(["git", "-C", path, "symbolic-ref", "HEAD", "refs/heads/main"], check=True)
+    subprocess.run(["git", "-C", path, "fast-import", "--quiet"], check=True,
+                   input=fast_import_stream(commits, files_per_commit, diff_lines, vocabulary, seed))
+    subprocess.run(["git", "-C", path, "reset", "-q", "--hard", "main"], check=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--files-per-commit", type=int, default=3)
+    parser.add_argument("--diff-lines", type=int, default=40, help="lines rewritten per file and commit")
+    parser.add_argument("--vocabulary", type=int, default=200, help="distinct words in commit messages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_repo(args.path, args.commits, args.files_per_commit, args.diff_lines, args.vocabulary, args.seed)
+    print(f"Generated {args.commits} commits in {args.path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+
+import churn_index
+import fast_path
+import fingerprint_pipeline
+import history
+import metrics
+import repo_manager
+import risk_score_pipeline
+
+repo_path = os.getenv('REPO_PATH', './repository')
+repo_url = os.getenv('REPO_URL', 'https://github.com/GabrielOprea/ValidatePyApp')
+
+
+def analyze(repo, workers=None):
+    """
+    Fingerprint and risk verdicts for HEAD. The history is walked as a stream of SHAs: only the
+    commits the baseline, the fingerprint store and the churn index have not seen are read, and
+    their diffs are loaded one history window at a time.
+
+    Returns a dict with the HEAD sha, the fingerprint result (latest folded commit and its
+    similarity, both None when there is nothing new) and the risk record of the newest commit,
+    or None when HEAD is marked #no_anomaly.
+    """
+    import baseline
+    import fingerprints
+
+    head = repo.head.commit
+    if '#no_anomaly' in head.message:
+        return None
+
+    state, new_commits = baseline.new_commits(repo.working_dir, baseline.load_state())
+    latest_commit, similarity = fingerprint_pipeline.score_new_commits(state, new_commits, workers)
+    if latest_commit is not None:
+        baseline.save_state(state)
+    if fingerprint_pipeline.store_enabled():
+        # Fills in history the store has not seen, e.g. when it was created after the baseline.
+        with metrics.stage("fingerprint_store"):
+            store = fingerprints.open_commit_store(state)
+            missing = (sha for sha in history.iter_shas(repo) if sha not in store["index"])
+            fingerprints.store_commits(store, state, history.records_for(repo, missing), workers=workers)
+    if latest_commit is not None and fingerprint_pipeline.fingerprint_scoring == "knn":
+        similarity = fingerprint_pipeline.knn_similarity(state, latest_commit["hash"])
+
+    return {
+        "head": head.hexsha,
+        "fingerprint_commit": latest_commit,
+        "similarity": similarity,
+        "risk": risk_score_pipeline.analyze_latest_commit(repo),
+    }
+
+
+def parse_range(value):
+    base, separator, head = value.partition("..")
+    if not separator or not base or not head or head.startswith("."):
+        raise argparse.ArgumentTypeError(f"expected BASE..HEAD, got {value!r}")
+    return base, head
+
+
+def baseline_at(repo, base, workers=None):
+    """
+    The fingerprint baseline with every commit up to `base` folded in. A stored baseline that
+    base descends from is brought up to base and saved, so the next range off the same base
+    starts there. One that is ahead of base (the usual pull request case) has the commits in
+    base..stored head taken back out in memory. One on other history is left alone and the
+    baseline is rebuilt in memory.
+    """
+    import baseline
+
+    stored = baseline.load_state()
+    if (stored["head"] and not stored["base"] and stored["head"] != base
+            and baseline.is_ancestor(repo, base, stored["head"])):
+        later = history.iter_commit_records(repo, f"{base}..{stored['head']}")
+        for commit, feature_vector in baseline.iter_feature_vectors(later, workers):
+            baseline.unfold_commit(stored, commit, feature_vector)
+        stored["head"] = base
+        return stored
+    state, commit_data = baseline.new_commits(repo.working_dir, stored, head=base)
+    latest_commit, _ = fingerprint_pipeline.score_new_commits(state, commit_data, workers)
+    if latest_commit is not None and (state is stored or not stored["head"]):
+        baseline.save_state(state)
+    return state
+
+
+def churn_at(repo, base):
+    """
+    The churn index and the position of `base` in it. When the stored index does not have base
+    yet, the history up to base is indexed into an in-memory copy, leaving the stored index
+    (which other runs extend) untouched.
+    """
+    churn = churn_index.open_index()
+    seq = churn_index.commit_seq(churn, base)
+    if seq is None:
+        in_memory = churn_index.open_index(":memory:")
+        churn.backup(in_memory)
+        churn.close()
+        churn = in_memory
+        seq = churn_index.index_commits(churn, repo, base)
+    return churn, seq
+
+
+def analyze_range(repo, base, head, workers=None):
+    """
+    Fingerprint and risk results for every commit in base..head, oldest first, each scored
+    against the history up to base plus the range commits before it, as if the range had been
+    pushed one commit at a time. Only the range is diffed: the baseline and churn counts up to
+    base come from the stored ones. The range commits are folded into an in-memory copy only,
+    never into the stored baseline, churn index or fingerprint store.
+
+    Returns a list of {"commit", "skipped", "similarity", "risk"}; skipped commits change no
+    Python files and are folded without being scored.
+    """
+    import baseline
+    import fingerprints
+    import neighbours
+
+    base, head = repo.commit(base).hexsha, repo.commit(head).hexsha
+    state = baseline_at(repo, base, workers)
+    churn, base_seq = churn_at(repo, base)
+    knn = None
+    if fingerprint_pipeline.fingerprint_scoring == "knn":
+        # The store may be ahead of base; only base's own history counts as neighbours.
+        knn = neighbours.index_store(fingerprints.open_commit_store(state), shas=set(repo.git.rev_list(base).split()))
+    range_churn = Counter()
+
+    results = []
+    for window in history.iter_windows(history.iter_commit_records(repo, f"{base}..{head}")):
+        feature_vectors = baseline.commit_feature_vectors(window, workers)
+        with metrics.stage("range_scoring"):
+            for commit, feature_vector in zip(window, feature_vectors):
+                skipped = fast_path.fast_path_enabled and not fast_path.changes_python(repo.commit(commit["hash"]))
+                similarity = baseline.fold_commit(state, commit, score=not skipped, feature_vector=feature_vector)
+                if knn is not None:
+                    vector = fingerprints.store_vectors(state, [commit], [feature_vector])[0]
+                    if not skipped:
+                        _, similarities = neighbours.nearest(knn, vector, exclude=commit["hash"])
+                        similarity = float(np.mean(similarities)) if len(similarities) else None
+                    neighbours.add(knn, [commit["hash"]], vector)
+
+                commit_files = [file["file_path"] for file in commit["files_changed"]]
+                range_churn.update(commit_files)
+                risk = None
+                if not skipped:
+                    counts = {path: count + range_churn[path]
+                              for path, count in churn_index.change_counts(churn, commit_files, base_seq).items()}
+                    risk = risk_score_pipeline.risk_from_counts(
+                        commit, commit_files, risk_score_pipeline.calculate_diff_metrics(commit["files_changed"]), counts)
+                metrics.count("commits_skipped" if skipped else "commits_range_scored")
+                results.append({"commit": commit, "skipped": skipped, "similarity": similarity, "risk": risk})
+                commit.drop_diff()
+    return results
+
+
+def report_range(results):
+    """
+    Print the verdicts of every commit in the range and return the aggregate exit code: 1 when
+    any commit was flagged by either check.
+    """
+    exit_code, flagged = 0, 0
+    for result in results:
+        commit = result["commit"]
+        if result["skipped"]:
+            print(f"Commit {commit['hash']} changes no Python files; nothing to score.")
+            continue
+        fingerprint_code = fingerprint_pipeline.report_fingerprint(commit["hash"], commit, result["similarity"])
+        commit_code = max(fingerprint_code, risk_score_pipeline.report_risk(result["risk"]))
+        flagged += commit_code
+        exit_code = max(exit_code, commit_code)
+    print(f"Scored {sum(not result['skipped'] for result in results)} of {len(results)} commits in the range; "
+          f"{flagged} flagged.")
+    return exit_code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the fingerprint and risk checks on the latest commit or a range.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--profile", action="store_true",
+                        help="dump cProfile and tracemalloc output to the metrics directory")
+    parser.add_argument("--range", type=parse_range, default=None, metavar="BASE..HEAD",
+                        help="score every commit in the range, e.g. a pull request, instead of HEAD")
+    args = parser.parse_args(argv)
+
+    # Blobs are prefetched only once the fast path below is ruled out.
+    repo = repo_manager.acquire(repo_url, repo_path, prefetch_history=False)
+    if args.range is not None:
+        repo_manager.prefetch(repo, args.range[1])
+        return report_range(analyze_range(repo, *args.range, workers=args.workers))
+    head = repo.head.commit
+    if fast_path.skip_commit(head):
+        return 0
+    fingerprint_verdict = fast_path.load_verdict(fingerprint_pipeline.fingerprint_check(), head.hexsha)
+    risk_verdict = fast_path.load_verdict("risk", head.hexsha)
+    if fingerprint_verdict is not None and risk_verdict is not None:
+        fingerprint_code = fingerprint_pipeline.report_fingerprint(
+            head.hexsha, {"hash": head.hexsha, "message": head.message}, fingerprint_verdict["score"])
+        return max(fingerprint_code, risk_score_pipeline.report_risk({"risk_score": risk_verdict["score"]}))
+
+    repo_manager.prefetch(repo)
+    result = analyze(repo, args.workers)
+    if result is None:
+        return 0
+    if result["fingerprint_commit"] is not None and result["fingerprint_commit"]["hash"] == head.hexsha:
+        fast_path.store_verdict(fingerprint_pipeline.fingerprint_check(), head.hexsha, result["similarity"])
+    if result["risk"] is not None:
+        fast_path.store_verdict("risk", head.hexsha, result["risk"]["risk_score"])
+    fingerprint_code = fingerprint_pipeline.report_fingerprint(
+        result["head"], result["fingerprint_commit"], result["similarity"])
+    risk_code = risk_score_pipeline.report_risk(result["risk"]) if result["risk"] is not None else 0
+    return max(fingerprint_code, risk_code)
+
+
+if __name__ == "__main__":
+    sys.exit(metrics.run_main("analyze_commit", main))
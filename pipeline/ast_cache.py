@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+
+import code_features
+import diff_budget
+import diff_cache
+import metrics
+import parallel
+import repo_manager
+
+# Adds full-file AST metrics of the changed .py files (pre- and post-image) to every commit's features.
+ast_features_enabled = os.getenv('AST_FEATURES', '0') == '1'
+# Metrics are keyed by blob SHA, so several repositories can share one database.
+ast_cache_path = os.getenv('AST_CACHE_PATH', '')
+# Larger files are not parsed (ast.parse needs about 200 times the file size in memory) and count
+# as unparsed.
+ast_max_bytes = int(os.getenv('AST_MAX_BYTES', str(1024 * 1024)))
+
+# Bump when the metrics computed per blob change.
+AST_METRICS_VERSION = "ast-v1"
+# Blobs read and parsed at a time; bounds the file contents held in memory.
+BLOB_BATCH = 2000
+NULL_BLOB = "0" * 40
+EMPTY_METRICS = {"parsed": True, "max_depth": 0, "names": 0, "snake_case": 0, "camel_case": 0}
+# Feature keys added to each commit; baseline.code_feature_vector uses the deltas.
+DELTA_KEYS = ["ast_max_depth_delta", "ast_snake_case_ratio_delta", "ast_camel_case_ratio_delta"]
+
+# Without -R: the old blob is the first parent's, the new one the commit's. Root commits are
+# listed against the empty tree.
+RAW_LOG_ARGS = [
+    "-c", "core.quotepath=off",
+    "log", "--stdin", "--no-walk=unsorted", "--raw", "--no-abbrev", "--root",
+    "--diff-merges=first-parent", "--format=%x1e%H",
+]
+
+
+def open_cache(path=None):
+    if path is None:
+        path = ast_cache_path or os.path.join(diff_cache.cache_dir, "ast.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    cache = sqlite3.connect(path, timeout=60)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS blob_metrics ("
+        "blob TEXT NOT NULL, version TEXT NOT NULL, metrics TEXT NOT NULL, "
+        "PRIMARY KEY (blob, version))"
+    )
+    # The (old blob, new blob) pairs of each commit's .py files, so warm runs need no git log.
+    # Versioned by the path selection and diff budget settings, which decide the files listed.
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS commit_blobs ("
+        "sha TEXT NOT NULL, version TEXT NOT NULL, blobs TEXT NOT NULL, "
+        "PRIMARY KEY (sha, version))"
+    )
+    return cache
+
+
+def get_many(cache, table, key, value, keys, version):
+    found = {}
+    keys = list(keys)
+    for start in range(0, len(keys), diff_cache.SQLITE_MAX_VARIABLES):
+        chunk = keys[start:start + diff_cache.SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        rows = cache.execute(f"SELECT {key}, {value} FROM {table} WHERE version = ? AND {key} IN ({placeholders})",
+                             [version] + chunk)
+        found.update((row_key, json.loads(row_value)) for row_key, row_value in rows)
+    return found
+
+
+def blob_metrics(source):
+    """
+    AST metrics of one file's content: the deepest node nesting and the identifier naming
+    counts, computed the same way as code_features does for changed lines.
+    """
+    tree = code_features.parse_source(source)
+    if tree is None:
+        return dict(EMPTY_METRICS, parsed=False)
+    max_depth, names, snake_case, camel_case = code_features.tree_metrics(tree)
+    return {"parsed": True, "max_depth": max_depth, "names": names, "snake_case": snake_case,
+            "camel_case": camel_case}
+
+
+def scored_path(path):
+    return path.endswith(".py") and repo_manager.selected_path(path) and not diff_budget.skipped_path(path)
+
+
+def parse_raw_log(stream):
+    """
+    Yields (sha, [[old_blob, new_blob], ...]) for `git log --raw` output, keeping regular files on
+    the selected paths (see repo_manager) outside the vendored and generated ones (see
+    diff_budget). Added files have a null old blob, deleted ones a null new blob; the side of a
+    rename that is not kept is nulled too.
+    """
+    sha, blobs = None, []
+    for line in stream:
+        line = line.rstrip("\n")
+        if line.startswith("\x1e"):
+            if sha is not None:
+                yield sha, blobs
+            sha, blobs = line[1:], []
+        elif line.startswith(":"):
+            meta, *paths = line.split("\t")
+            old_mode, new_mode, old_blob, new_blob = meta[1:].split()[:4]
+            old_py = old_mode.startswith("100") and scored_path(paths[0])
+            new_py = new_mode.startswith("100") and scored_path(paths[-1])
+            if old_py or new_py:
+                blobs.append([old_blob if old_py else NULL_BLOB, new_blob if new_py else NULL_BLOB])
+    if sha is not None:
+        yield sha, blobs
+
+
+def changed_blobs(git_dir, shas):
+    """
+    {sha: [[old_blob, new_blob], ...]} for the .py files each commit changes against its first
+    parent, from a single `git log --raw` process limited to the selected paths.
+    """
+    completed = subprocess.run(
+        ["git", "--git-dir", git_dir] + RAW_LOG_ARGS + repo_manager.rename_args() + ["--"] + repo_manager.DIFF_PATHSPEC,
+        input="".join(sha + "\n" for sha in shas), capture_output=True, text=True,
+        encoding="utf-8", errors="surrogateescape", check=True,
+    )
+    found = dict(parse_raw_log(completed.stdout.split("\n")))
+    return {sha: found.get(sha, []) for sha in shas}
+
+
+def read_blobs(git_dir, blobs, max_bytes=None):
+    """
+    Yields (blob, content) for every blob, streamed out of one `git cat-file --batch`. Blobs over
+    `max_bytes` are passed over without being held in memory and yield None.
+    """
+    process = subprocess.Popen(["git", "--git-dir", git_dir, "cat-file", "--batch"],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def write_requests():
+        # Written from a thread: git answers while it reads, so both pipes could fill up.
+        try:
+            process.stdin.write("".join(blob + "\n" for blob in blobs).encode("ascii"))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    writer = threading.Thread(target=write_requests, daemon=True)
+    writer.start()
+    try:
+        for blob in blobs:
+            header = process.stdout.readline().split()
+            if len(header) < 3:
+                # "<blob> missing", e.g. not fetched into a partial clone.
+                continue
+            size = int(header[2])
+            if max_bytes is not None and size > max_bytes:
+                while size > 0:
+                    size -= len(process.stdout.read(min(size, 1 << 20)))
+                process.stdout.read(1)
+                yield blob, None
+                continue
+            content = process.stdout.read(size)
+            process.stdout.read(1)
+            yield blob, content
+    finally:
+        process.stdout.close()
+        process.wait()
+        writer.join()
+
+
+def load_metrics(cache, git_dir, blobs, workers=None):
+    """
+    {blob: metrics} for the given blobs, parsing only those missing from the cache.
+    """
+    blobs = sorted(set(blobs) - {NULL_BLOB})
+    found = get_many(cache, "blob_metrics", "blob", "metrics", blobs, AST_METRICS_VERSION)
+    missing = [blob for blob in blobs if blob not in found]
+    metrics.cache_lookup("ast_cache", len(blobs) - len(missing), len(missing))
+    for start in range(0, len(missing), BLOB_BATCH):
+        contents = []
+        for blob, content in read_blobs(git_dir, missing[start:start + BLOB_BATCH], ast_max_bytes):
+            if content is None:
+                # Not cached: whether a blob is too large depends on AST_MAX_BYTES.
+                found[blob] = dict(EMPTY_METRICS, parsed=False)
+                metrics.count("blobs_oversized")
+            else:
+                contents.append((blob, content))
+        computed = parallel.map_ordered(blob_metrics, [content for _, content in contents], workers)
+        items = [(blob, result) for (blob, _), result in zip(contents, computed)]
+        with cache:
+            cache.executemany(
+                "INSERT OR REPLACE INTO blob_metrics (blob, version, metrics) VALUES (?, ?, ?)",
+                ((blob, AST_METRICS_VERSION, json.dumps(result)) for blob, result in items),
+            )
+        found.update(items)
+        metrics.count("blobs_parsed", len(items))
+    return found
+
+
+def combine(file_metrics):
+    """
+    Commit-level metrics over several files: the deepest nesting and the naming ratios over all
+    their identifiers. Files that failed to parse are left out.
+    """
+    parsed = [entry for entry in file_metrics if entry is not None and entry["parsed"]]
+    names = sum(entry["names"] for entry in parsed)
+    return {
+        "max_depth": max((entry["max_depth"] for entry in parsed), default=0),
+        "names": names,
+        "snake_case_ratio": sum(entry["snake_case"] for entry in parsed) / names if names else 0,
+        "camel_case_ratio": sum(entry["camel_case"] for entry in parsed) / names if names else 0,
+    }
+
+
+def commit_deltas(git_dir, shas, cache=None, workers=None):
+    """
+    {sha: ast features} for every commit: the post-image AST metrics of its changed .py files
+    and their change against the pre-image.
+    """
+    with metrics.stage("ast_features"):
+        if cache is None:
+            cache = open_cache()
+        version = f"{repo_manager.selection_tag()}-{diff_budget.config_tag()}"
+        blobs_by_sha = get_many(cache, "commit_blobs", "sha", "blobs", shas, version)
+        missing = [sha for sha in shas if sha not in blobs_by_sha]
+        if missing:
+            listed = changed_blobs(git_dir, missing)
+            with cache:
+                cache.executemany("INSERT OR REPLACE INTO commit_blobs (sha, version, blobs) VALUES (?, ?, ?)",
+                                  ((sha, version, json.dumps(blobs)) for sha, blobs in listed.items()))
+            blobs_by_sha.update(listed)
+
+        metrics_by_blob = load_metrics(cache, git_dir, (blob for sha in shas for pair in blobs_by_sha[sha]
+                                                        for blob in pair), workers)
+        metrics_by_blob[NULL_BLOB] = None
+        features = {}
+        for sha in shas:
+            pairs = blobs_by_sha[sha]
+            before = combine([metrics_by_blob.get(old) for old, _ in pairs])
+            after = combine([metrics_by_blob.get(new) for _, new in pairs])
+            features[sha] = {
+                "ast_max_depth": after["max_depth"],
+                "ast_max_depth_delta": after["max_depth"] - before["max_depth"],
+                "ast_snake_case_ratio_delta": after["snake_case_ratio"] - before["snake_case_ratio"],
+                "ast_camel_case_ratio_delta": after["camel_case_ratio"] - before["camel_case_ratio"],
+                "ast_names_delta": after["names"] - before["names"],
+                "ast_unparsed_files": sum(1 for pair in pairs for blob in pair
+                                          if metrics_by_blob.get(blob) is not None
+                                          and not metrics_by_blob[blob]["parsed"]),
+            }
+        return features
+
+
+if __name__ == "__main__":
+    import git
+
+    parser = argparse.ArgumentParser(description="Compute (and cache) the AST features of a range of commits.")
+    parser.add_argument("rev", nargs="?", default="HEAD")
+    parser.add_argument("--repo", default=os.getenv('REPO_PATH', './repository'))
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    repo = git.Repo(args.repo)
+    shas = [commit.hexsha for commit in repo.iter_commits(args.rev, reverse=True)]
+    for sha, features in commit_deltas(repo.git_dir, shas, workers=args.workers).items():
+        print(sha[:12], json.dumps(features))
+    metrics.print_breakdown(metrics.summary("ast_cache"))
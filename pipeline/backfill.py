@@ -0,0 +1,137 @@
+import argparse
+import csv
+import json
+import os
+
+import git
+import numpy as np
+
+import baseline
+import fingerprint_pipeline
+import fingerprints
+import history
+import neighbours
+import risk_score_pipeline
+import risk_table
+
+repo_path = os.getenv('REPO_PATH', './repository')
+
+REPORT_FIELDS = [
+    "hash", "author", "date", "message", "similarity", "fingerprint_anomaly",
+    "complexity_score", "frequency_score", "sensitive_data", "dependency_score", "risk_score", "risk_exceeded",
+]
+PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+
+
+def fingerprint_similarities(commit_data, workers=None):
+    """
+    Similarity of every commit with the mean of the commits before it, in one linear pass.
+    Every commit is weighted with the IDF of the full history, where the incremental pipeline
+    uses the IDF as of each commit. commit_data is read once, as a stream; each message is kept
+    only as its term counts. Returns (similarities, state, commits).
+    """
+    state = baseline.new_state()
+    commits, term_counts, feature_vectors = [], [], []
+    for commit, feature_vector in baseline.iter_feature_vectors(commit_data, workers):
+        term_counts.append(baseline.term_frequencies(state, commit["message"]))
+        baseline.fold_commit(state, commit, feature_vector=feature_vector)
+        commits.append(commit)
+        feature_vectors.append(feature_vector)
+    counts = baseline.count_rows(state, term_counts)
+
+    if fingerprint_pipeline.fingerprint_scoring == "knn":
+        return knn_prefix_similarities(state, commits, feature_vectors, counts), state, commits
+    matrix = fingerprints.fingerprint_commits(state, commits, feature_vectors, counts=counts)
+    contributions = fingerprints.baseline_rows(state, commits, feature_vectors, counts=counts)
+    return fingerprints.prefix_similarities(matrix, contributions), state, commits
+
+
+def knn_prefix_similarities(state, commits, feature_vectors, counts=None):
+    """
+    Similarity of every commit with its k nearest earlier commits (see neighbours), adding each
+    commit to the index after it is scored. With KNN_INDEX=exact every earlier commit is
+    compared, for checking the LSH results. The first commit gets NaN.
+    """
+    vectors = fingerprints.store_vectors(state, commits, feature_vectors, counts=counts)
+    index = neighbours.new_index(vectors.shape[1], bits=neighbours.lsh_bits or neighbours.default_bits(len(commits)))
+    similarities = np.full(len(commits), np.nan)
+    for row, (commit, vector) in enumerate(zip(commits, vectors)):
+        if row > 0:
+            similarities[row] = float(np.mean(neighbours.nearest(index, vector)[1]))
+        neighbours.add(index, [commit["hash"]], vector)
+    return similarities
+
+
+def build_report(repo_path, workers=None):
+    repo = git.Repo(repo_path)
+    # Each pass streams the history and loads the diffs a window at a time; only metadata,
+    # subject lines, feature vectors, term counts and scores are kept for the whole history.
+    similarities, state, commits = fingerprint_similarities(history.iter_commit_records(repo), workers)
+    table = risk_score_pipeline.analyze_commits(repo, workers)
+    commit_scores = risk_table.scores(table)
+    exceeded = commit_scores >= risk_score_pipeline.risk_threshold
+
+    rows = []
+    for index, (commit, similarity) in enumerate(zip(commits, similarities)):
+        risk = risk_table.row(table, index, commit_scores)
+        rows.append({
+            "hash": commit["hash"],
+            "author": commit["author"],
+            "date": commit["date"],
+            "message": commit["subject"],
+            "similarity": None if np.isnan(similarity) else float(similarity),
+            "fingerprint_anomaly": bool(similarity < fingerprint_pipeline.similarity_threshold()),
+            "complexity_score": risk["complexity_score"],
+            "frequency_score": risk["frequency_score"],
+            "sensitive_data": risk["sensitive_data"],
+            "dependency_score": risk["dependency_score"],
+            "risk_score": risk["risk_score"],
+            "risk_exceeded": bool(exceeded[index]),
+        })
+    return rows, state, table
+
+
+def write_report(rows, output_path, report_format):
+    with open(output_path, "w", newline="") as f:
+        if report_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+
+def print_distribution(name, values):
+    values = np.array([value for value in values if value is not None], dtype=float)
+    if len(values) == 0:
+        return
+    quantiles = np.percentile(values, PERCENTILES)
+    print(f"{name}: " + ", ".join(f"p{p}={q:.4f}" for p, q in zip(PERCENTILES, quantiles)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every commit in the history against its prefix baseline.")
+    parser.add_argument("--output", default="backfill_report.jsonl")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None,
+                        help="defaults to the output file extension")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="also store the full-history baseline for the incremental pipeline")
+    parser.add_argument("--save-risk-table", action="store_true",
+                        help="also store the risk components of every commit for risk_table.py queries")
+    args = parser.parse_args()
+
+    report_format = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+    rows, state, table = build_report(repo_path, args.workers)
+    write_report(rows, args.output, report_format)
+    if args.save_baseline:
+        baseline.save_state(state)
+    if args.save_risk_table:
+        print(f"Risk table stored in {risk_table.save_table(table)}.")
+
+    print(f"Scored {len(rows)} commits into {args.output}.")
+    print_distribution("similarity", [row["similarity"] for row in rows])
+    print_distribution("risk_score", [row["risk_score"] for row in rows])
+    print(f"Fingerprint anomalies at threshold {fingerprint_pipeline.similarity_threshold()}: {sum(row['fingerprint_anomaly'] for row in rows)}")
+    print(f"Risk threshold {risk_score_pipeline.risk_threshold} exceeded: {sum(row['risk_exceeded'] for row in rows)}")
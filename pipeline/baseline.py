@@ -0,0 +1,438 @@
+import argparse
+import json
+import os
+from collections import Counter
+
+import git
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+import ast_cache
+import code_features
+import diff_cache
+import history
+import metrics
+import parallel
+
+scaling_factor = float(os.getenv('SCALING_FACTOR', '0.2'))
+repo_path = os.getenv('REPO_PATH', './repository')
+baseline_path = os.getenv('BASELINE_PATH', os.path.join(diff_cache.cache_dir, 'fingerprint_baseline.json'))
+# "tfidf" grows a vocabulary from the history; "hashing" uses a fixed-size hashed feature space,
+# so per-commit vectors from different runs or machines are directly comparable.
+fingerprint_mode = os.getenv('FINGERPRINT_MODE', 'tfidf')
+hashing_n_features = int(os.getenv('HASHING_N_FEATURES', str(2 ** 12)))
+hashing_idf_path = os.getenv('HASHING_IDF_PATH', os.path.join(diff_cache.cache_dir, 'hashing_idf.npy'))
+
+BASELINE_VERSION = 2
+FEATURE_MIN = np.array([0, 0, 0, 0])
+FEATURE_MAX = np.array([6, 21, 1, 1])
+if ast_cache.ast_features_enabled:
+    # Change in max AST depth and in the snake/camel case ratios of the changed files.
+    FEATURE_MIN = np.concatenate([FEATURE_MIN, [-10, -1, -1]])
+    FEATURE_MAX = np.concatenate([FEATURE_MAX, [10, 1, 1]])
+
+# Same tokenisation as the TfidfVectorizer the pipelines used to refit on every run.
+analyzer = TfidfVectorizer().build_analyzer()
+
+
+def new_state(mode=None, n_features=None):
+    mode = mode or fingerprint_mode
+    if mode not in ("tfidf", "hashing"):
+        raise ValueError(f"Unknown fingerprint mode: {mode}")
+    n_features = (n_features or hashing_n_features) if mode == "hashing" else None
+    return {
+        "version": BASELINE_VERSION,
+        "mode": mode,
+        "n_features": n_features,
+        # The commit the state was started after (None: the root), and the last commit folded.
+        "base": None,
+        "head": None,
+        "count": 0,
+        "vocabulary": {},
+        "document_frequency": np.zeros(n_features or 0),
+        "message_sum": np.zeros(n_features or 0),
+        "feature_sum": np.zeros(len(FEATURE_MIN)),
+    }
+
+
+def stale_reason(stored):
+    """
+    Why a stored baseline cannot be used with the current settings, or None when it can.
+    """
+    if stored.get("version") != BASELINE_VERSION or stored["mode"] != fingerprint_mode:
+        return f"version {stored.get('version')} / mode {stored['mode']!r}, expected {BASELINE_VERSION} / {fingerprint_mode!r}"
+    if stored["mode"] == "hashing" and stored["n_features"] != hashing_n_features:
+        return f"{stored['n_features']} hashed features, expected {hashing_n_features}"
+    if len(stored["feature_sum"]) != len(FEATURE_MIN):
+        # Built with AST_FEATURES switched the other way.
+        return f"{len(stored['feature_sum'])} code features, expected {len(FEATURE_MIN)}"
+    if stored.get("diff_variant") != history.diff_variant():
+        # Built from other files (path globs, rename detection, diff budgets).
+        return f"diff variant {stored.get('diff_variant')!r}, expected {history.diff_variant()!r}"
+    return None
+
+
+def load_state(path=None, strict=False):
+    """
+    The stored baseline, or a fresh state when there is none or it was built with other settings
+    (with strict=True those cases raise ValueError instead).
+    """
+    path = path or baseline_path
+    if not os.path.exists(path):
+        if strict:
+            raise ValueError(f"No baseline at {path}")
+        return new_state()
+    with open(path, "r") as f:
+        stored = json.load(f)
+    reason = stale_reason(stored)
+    if reason:
+        if strict:
+            raise ValueError(f"Baseline {path} was built with other settings: {reason}")
+        return new_state()
+    return {
+        "version": BASELINE_VERSION,
+        "mode": stored["mode"],
+        "n_features": stored["n_features"],
+        "base": stored.get("base"),
+        "head": stored["head"],
+        "count": stored["count"],
+        "vocabulary": stored["vocabulary"],
+        "document_frequency": np.array(stored["document_frequency"], dtype=float),
+        "message_sum": np.array(stored["message_sum"], dtype=float),
+        "feature_sum": np.array(stored["feature_sum"], dtype=float),
+    }
+
+
+def save_state(state, path=None):
+    path = path or baseline_path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    stored = {
+        "version": BASELINE_VERSION,
+        "mode": state["mode"],
+        "n_features": state["n_features"],
+        "base": state["base"],
+        "head": state["head"],
+        "count": state["count"],
+        "vocabulary": state["vocabulary"],
+        "document_frequency": state["document_frequency"][:message_dimension(state)].tolist(),
+        "message_sum": state["message_sum"][:message_dimension(state)].tolist(),
+        "feature_sum": state["feature_sum"].tolist(),
+        "diff_variant": history.diff_variant(),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stored, f)
+    os.replace(tmp_path, path)
+
+
+def code_feature_vector(commit):
+    features = code_features.calculate_features(commit)
+    feature_values = np.array([
+        features["avg_nesting_depth"],
+        features["avg_indentation"],
+        features["snake_case_ratio"],
+        features["camel_case_ratio"]
+    ] + ([features.get(key, 0) for key in ast_cache.DELTA_KEYS] if ast_cache.ast_features_enabled else []))
+    return scaling_factor * (feature_values - FEATURE_MIN) / (FEATURE_MAX - FEATURE_MIN)
+
+
+def message_dimension(state):
+    if state["mode"] == "hashing":
+        return state["n_features"]
+    return len(state["vocabulary"])
+
+
+def hashing_vectorizer(n_features):
+    # Raw counts; weighting and normalisation happen here so the stored sums stay idf-free.
+    return HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+
+
+def add_terms(state, term_counts):
+    """
+    Grow the vocabulary with unseen terms.
+    """
+    vocabulary = state["vocabulary"]
+    for term in term_counts:
+        if term not in vocabulary:
+            vocabulary[term] = len(vocabulary)
+    if len(vocabulary) > len(state["document_frequency"]):
+        # Grow geometrically so a growing vocabulary costs amortised O(1) per new term.
+        capacity = max(len(vocabulary), 2 * len(state["document_frequency"]))
+        for key in ("document_frequency", "message_sum"):
+            grown = np.zeros(capacity)
+            grown[:len(state[key])] = state[key]
+            state[key] = grown
+
+
+def term_frequencies(state, message):
+    """
+    Sparse term-frequency vector of one message, as (indices, values). In tfidf mode unseen
+    terms are added to the vocabulary.
+    """
+    if state["mode"] == "hashing":
+        counts = hashing_vectorizer(state["n_features"]).transform([message])
+        return counts.indices.astype(np.intp), counts.data.astype(float)
+    term_counts = Counter(analyzer(message))
+    add_terms(state, term_counts)
+    vocabulary = state["vocabulary"]
+    indices = np.fromiter((vocabulary[term] for term in term_counts), dtype=np.intp, count=len(term_counts))
+    values = np.fromiter(term_counts.values(), dtype=float, count=len(term_counts))
+    return indices, values
+
+
+def idf(state, n_docs=None):
+    # Smoothed IDF, as computed by TfidfVectorizer.
+    n_docs = state["count"] if n_docs is None else n_docs
+    return np.log((1 + n_docs) / (1 + state["document_frequency"][:message_dimension(state)])) + 1
+
+
+def load_hashing_idf(n_features, path=None):
+    """
+    The frozen IDF vector for hashing mode, or None to leave hashed term frequencies unweighted.
+    """
+    path = path or hashing_idf_path
+    if not os.path.exists(path):
+        return None
+    weights = np.load(path)
+    if weights.shape != (n_features,):
+        raise ValueError(f"{path} holds {weights.shape[0]} weights, expected {n_features}")
+    return weights
+
+
+def term_weights(state, n_docs=None):
+    """
+    Per-column message weights: the running IDF in tfidf mode, the frozen IDF (or ones) in
+    hashing mode so fingerprints do not depend on how much history a run has seen.
+    """
+    if state["mode"] == "hashing":
+        weights = load_hashing_idf(state["n_features"])
+        return weights if weights is not None else np.ones(state["n_features"])
+    return idf(state, n_docs)
+
+
+def baseline_parts(state, weights):
+    """
+    The running mean of every folded commit, as (message part, code-feature part). Message parts
+    are kept as L2-normalised term frequencies and re-weighted with the current IDF, so the
+    vocabulary can grow without touching history.
+    """
+    message_mean = state["message_sum"][:message_dimension(state)] * weights / state["count"]
+    return message_mean, state["feature_sum"] / state["count"]
+
+
+def transform(state, messages):
+    """
+    TF-IDF rows for several messages in one call, as a CSR matrix over the baseline's message
+    columns. In tfidf mode terms outside the vocabulary are ignored, like TfidfVectorizer.transform.
+    """
+    return weight_counts(state, count_matrix(state, messages))
+
+
+def weight_counts(state, counts):
+    """
+    The TF-IDF rows of transform, for a count_matrix already taken.
+    """
+    return normalize(counts.multiply(term_weights(state)).tocsr(), norm="l2")
+
+
+def count_matrix(state, messages):
+    """
+    Raw term counts of several messages, as CSR over the baseline's message columns.
+    """
+    if state["mode"] == "hashing":
+        return hashing_vectorizer(state["n_features"]).transform(messages)
+    return CountVectorizer(vocabulary=state["vocabulary"]).transform(messages)
+
+
+def count_rows(state, rows):
+    """
+    The count_matrix of messages whose term frequencies were taken one at a time, as
+    (indices, values) pairs from term_frequencies, so the messages need not be kept.
+    """
+    indptr = np.cumsum([0] + [len(indices) for indices, _ in rows])
+    indices = np.concatenate([indices for indices, _ in rows]) if rows else np.zeros(0, dtype=np.intp)
+    values = np.concatenate([values for _, values in rows]) if rows else np.zeros(0)
+    matrix = sparse.csr_matrix((values, indices, indptr), shape=(len(rows), message_dimension(state)))
+    matrix.sort_indices()
+    return matrix
+
+
+def commit_feature_vectors(commits, workers=None):
+    with metrics.stage("code_features"):
+        metrics.count("commits_featurized", len(commits))
+        metrics.count("diff_bytes_parsed", sum(metrics.diff_bytes(commit["files_changed"]) for commit in commits))
+        return parallel.map_ordered(code_feature_vector, commits, workers)
+
+
+def iter_feature_vectors(commits, workers=None):
+    """
+    (commit, feature vector) for every commit record, oldest first, computed one history window
+    at a time. Each commit's diff and message are dropped once the caller moves on to the next
+    commit (see history.iter_windows).
+    """
+    for window in history.iter_windows(commits):
+        feature_vectors = commit_feature_vectors(window, workers)
+        for commit, feature_vector in zip(window, feature_vectors):
+            yield commit, feature_vector
+            commit.drop_diff()
+
+
+def fold_commit(state, commit, score=False, feature_vector=None):
+    """
+    Add one commit to the baseline. With score=True the commit is first compared against the
+    commits folded before it and the cosine similarity is returned (None for the first commit).
+    Only the message's own terms are touched, so folding costs O(terms in the message).
+    """
+    if feature_vector is None:
+        feature_vector = code_feature_vector(commit)
+    indices, values = term_frequencies(state, commit["message"])
+    state["document_frequency"][indices] += 1
+    values_norm = np.sqrt(np.dot(values, values))
+
+    similarity = None
+    if score and state["count"] > 0:
+        # The message being scored already counts as a document, as when the vectorizer was
+        # fitted on the full history including it.
+        weights = term_weights(state, state["count"] + 1)
+        message_mean, feature_mean = baseline_parts(state, weights)
+        commit_message = values * weights[indices]
+        message_norm = np.sqrt(np.dot(commit_message, commit_message))
+        if message_norm > 0:
+            commit_message /= message_norm
+        dot = np.dot(message_mean[indices], commit_message) + np.dot(feature_mean, feature_vector)
+        denominator = (np.sqrt(np.dot(message_mean, message_mean) + np.dot(feature_mean, feature_mean))
+                       * np.sqrt(np.dot(commit_message, commit_message) + np.dot(feature_vector, feature_vector)))
+        similarity = float(dot / denominator) if denominator > 0 else 0.0
+
+    if values_norm > 0:
+        state["message_sum"][indices] += values / values_norm
+    state["feature_sum"] += feature_vector
+    state["count"] += 1
+    state["head"] = commit["hash"]
+    return similarity
+
+
+def unfold_commit(state, commit, feature_vector=None):
+    """
+    Take a folded commit back out of the baseline, the inverse of fold_commit (the sums and
+    counts simply subtract). In tfidf mode its terms stay in the vocabulary, which does not
+    change any similarity. The caller moves the head.
+    """
+    if feature_vector is None:
+        feature_vector = code_feature_vector(commit)
+    indices, values = term_frequencies(state, commit["message"])
+    state["document_frequency"][indices] -= 1
+    values_norm = np.sqrt(np.dot(values, values))
+    if values_norm > 0:
+        state["message_sum"][indices] -= values / values_norm
+    state["feature_sum"] -= feature_vector
+    state["count"] -= 1
+
+
+def merge_states(first, second):
+    """
+    Combine two baselines over consecutive stretches of one history (shards, machines, earlier
+    runs): `second` must start where `first` ends, so the merged state runs from first's base to
+    second's head and later runs can extend it. Sums and counts simply add; tfidf vocabularies
+    are remapped term by term.
+    """
+    if first["mode"] != second["mode"] or first["n_features"] != second["n_features"]:
+        raise ValueError("Only baselines with the same fingerprint mode and dimension can be merged")
+    if first["count"] and second["count"] and second["base"] != first["head"]:
+        raise ValueError(f"Baselines do not tile one history: the second starts after {second['base']}, "
+                         f"the first ends at {first['head']}")
+    merged = new_state(first["mode"], first["n_features"])
+    merged["base"] = first["base"] if first["count"] else second["base"]
+    merged["head"] = second["head"] if second["count"] else first["head"]
+    for state in (first, second):
+        size = message_dimension(state)
+        if state["mode"] == "hashing":
+            indices = np.arange(size)
+        else:
+            add_terms(merged, state["vocabulary"])
+            indices = np.fromiter((merged["vocabulary"][term] for term in state["vocabulary"]), dtype=np.intp, count=size)
+        merged["document_frequency"][indices] += state["document_frequency"][:size]
+        merged["message_sum"][indices] += state["message_sum"][:size]
+        merged["feature_sum"] += state["feature_sum"]
+        merged["count"] += state["count"]
+    return merged
+
+
+def store_hashing_idf(state, path=None):
+    """
+    Freeze the IDF of a hashing baseline so later runs weight terms identically.
+    """
+    if state["mode"] != "hashing":
+        raise ValueError("Only hashing baselines have a fixed-size IDF vector")
+    path = path or hashing_idf_path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.save(path, idf(state))
+    return path
+
+
+def is_ancestor(repo, ancestor, descendant='HEAD'):
+    try:
+        return repo.is_ancestor(ancestor, descendant)
+    except (git.GitCommandError, ValueError):
+        return False
+
+
+def new_commits(repo_path, state, head='HEAD'):
+    """
+    Commits added between the baseline head and `head`, oldest first, as a stream of records
+    whose diffs load on demand. Falls back to the whole history up to `head` (and a fresh state)
+    when the baseline head is missing, was rewritten or is not an ancestor of `head`, or the
+    baseline is a shard that does not start at the root.
+    """
+    repo = git.Repo(repo_path)
+    if state["head"] and not state["base"] and is_ancestor(repo, state["head"], head):
+        return state, history.iter_commit_records(repo, rev=f"{state['head']}..{head}")
+    return new_state(), history.iter_commit_records(repo, rev=head)
+
+
+def rebuild(repo_path, path=None, workers=None, base=None, head='HEAD'):
+    """
+    Recompute the baseline from scratch over the whole history up to `head`, streamed one window
+    at a time. With `base` only the commits in base..head are folded, as a shard for merge_states.
+    """
+    repo = git.Repo(repo_path)
+    state = new_state()
+    rev = head
+    if base:
+        state["base"] = repo.commit(base).hexsha
+        rev = f"{state['base']}..{head}"
+    for commit, feature_vector in iter_feature_vectors(history.iter_commit_records(repo, rev=rev), workers):
+        fold_commit(state, commit, feature_vector=feature_vector)
+    save_state(state, path)
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the stored fingerprint baseline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="recompute the baseline from the full history")
+    rebuild_parser.add_argument("--workers", type=int, default=None)
+    rebuild_parser.add_argument("--base", default=None, help="only fold BASE..HEAD, as a shard for merge")
+    rebuild_parser.add_argument("--head", default="HEAD")
+    rebuild_parser.add_argument("--output", default=None)
+    commands.add_parser("store-idf", help="freeze the IDF of a hashing baseline to HASHING_IDF_PATH")
+    merge_parser = commands.add_parser("merge", help="merge shards built with rebuild --base, oldest first")
+    merge_parser.add_argument("inputs", nargs="+")
+    merge_parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        if args.base and not args.output:
+            parser.error("rebuild --base writes a shard; give it an --output path")
+        state = rebuild(repo_path, args.output, args.workers, args.base, args.head)
+        print(f"Baseline rebuilt from {state['count']} commits (head {state['head']}, {message_dimension(state)} message columns).")
+    elif args.command == "store-idf":
+        print(f"IDF stored in {store_hashing_idf(load_state())}.")
+    else:
+        state = load_state(args.inputs[0], strict=True)
+        for path in args.inputs[1:]:
+            state = merge_states(state, load_state(path, strict=True))
+        save_state(state, args.output)
+        print(f"Merged {len(args.inputs)} baselines ({state['count']} commits, head {state['head']}).")
@@ -0,0 +1,180 @@
+import argparse
+import itertools
+import os
+import sqlite3
+import time
+
+import diff_cache
+import history
+import metrics
+
+churn_index_enabled = os.getenv('CHURN_INDEX', '1') != '0'
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def open_index(path=None):
+    """
+    Open (or create) the persisted file-churn index. Falls back to an in-memory index when
+    persistence is disabled.
+    """
+    if path is None:
+        path = os.path.join(diff_cache.cache_dir, "churn.sqlite") if churn_index_enabled else ":memory:"
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    index = sqlite3.connect(path, timeout=60)
+    index.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "CREATE TABLE IF NOT EXISTS commits (seq INTEGER PRIMARY KEY, sha TEXT NOT NULL UNIQUE, ts INTEGER NOT NULL);"
+        # cumulative = how many times the path had changed up to and including this commit, so
+        # a count as of any commit is one index lookup instead of a scan.
+        "CREATE TABLE IF NOT EXISTS changes (path TEXT NOT NULL, seq INTEGER NOT NULL, ts INTEGER NOT NULL, "
+        "cumulative INTEGER NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS changes_by_path ON changes (path, seq);"
+        "CREATE INDEX IF NOT EXISTS changes_by_path_time ON changes (path, ts);"
+        "CREATE INDEX IF NOT EXISTS changes_by_seq ON changes (seq);"
+        "CREATE INDEX IF NOT EXISTS changes_by_time ON changes (ts);"
+    )
+    return index
+
+
+def reset(index):
+    truncate(index, 0)
+
+
+def truncate(index, seq):
+    """
+    Drop the commits after `seq`. The cumulative counts of the ones before stay valid.
+    """
+    with index:
+        index.execute("DELETE FROM commits WHERE seq > ?", (seq,))
+        index.execute("DELETE FROM changes WHERE seq > ?", (seq,))
+
+
+def commit_count(index):
+    return index.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+
+
+def commit_seq(index, sha):
+    row = index.execute("SELECT seq FROM commits WHERE sha = ?", (sha,)).fetchone()
+    return row[0] if row else None
+
+
+def commit_sha(index, seq):
+    row = index.execute("SELECT sha FROM commits WHERE seq = ?", (seq,)).fetchone()
+    return row[0] if row else None
+
+
+def sync_history(index, shas):
+    """
+    Match the indexed commits against `shas` (oldest first, any iterable, read once) and return
+    an iterator over the SHAs still to index. Indexed commits past the first mismatch, or past
+    the end of `shas`, were rewritten away and are dropped (see truncate).
+    """
+    shas = iter(shas)
+    indexed = index.execute("SELECT sha FROM commits ORDER BY seq")
+    matched, diverged = 0, None
+    for (indexed_sha,) in indexed:
+        sha = next(shas, None)
+        if sha != indexed_sha:
+            diverged = sha
+            break
+        matched += 1
+    else:
+        return shas
+    indexed.close()
+    truncate(index, matched)
+    return shas if diverged is None else itertools.chain([diverged], shas)
+
+
+def count_as_of(index, path, seq):
+    row = index.execute(
+        "SELECT cumulative FROM changes WHERE path = ? AND seq <= ? ORDER BY seq DESC LIMIT 1",
+        (path, seq),
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def add_commit(index, sha, timestamp, paths):
+    """
+    Append one commit. Costs O(files in the commit), independent of history length. Runs in the
+    caller's transaction (`with index:`), so a batch of commits is committed once.
+    """
+    seq = commit_count(index) + 1
+    index.execute("INSERT INTO commits (seq, sha, ts) VALUES (?, ?, ?)", (seq, sha, timestamp))
+    for path in paths:
+        cumulative = count_as_of(index, path, seq) + 1
+        index.execute(
+            "INSERT INTO changes (path, seq, ts, cumulative) VALUES (?, ?, ?, ?)",
+            (path, seq, timestamp, cumulative),
+        )
+    return seq
+
+
+def index_commits(index, repo, rev='HEAD', cache=None):
+    """
+    Bring the index up to date with the commits of rev (see history.iter_shas), appending the
+    ones an earlier run has not indexed yet. The history is matched as a stream of SHAs; only the
+    new commits are read, their diffs a window at a time. Returns the seq of rev's newest commit.
+    """
+    with metrics.stage("churn_index"):
+        pending = sync_history(index, history.iter_shas(repo, rev))
+        indexed = commit_count(index)
+        for window in history.iter_windows(history.records_for(repo, pending, cache)):
+            # One transaction (and fsync) per window rather than per commit.
+            with index:
+                for commit in window:
+                    add_commit(index, commit["hash"], commit["date"], [file["file_path"] for file in commit["files_changed"]])
+                    commit.drop_diff()
+        total = commit_count(index)
+        metrics.cache_lookup("churn_index", indexed, total - indexed)
+        return total
+
+
+def change_counts(index, paths, seq=None, last_commits=None, since=None):
+    """
+    How often each path changed: over the whole history up to commit `seq` (default: all of it),
+    over the last `last_commits` commits, or since the unix timestamp `since`.
+    """
+    if seq is None:
+        seq = commit_count(index)
+    counts = {}
+    for path in paths:
+        if since is not None:
+            counts[path] = index.execute(
+                "SELECT COUNT(*) FROM changes WHERE path = ? AND ts >= ? AND seq <= ?", (path, since, seq)
+            ).fetchone()[0]
+        elif last_commits is not None:
+            counts[path] = count_as_of(index, path, seq) - count_as_of(index, path, seq - last_commits)
+        else:
+            counts[path] = count_as_of(index, path, seq)
+    return counts
+
+
+def top_files(index, limit=20, last_commits=None, since=None):
+    """
+    The most frequently changed paths, optionally restricted to a window.
+    """
+    if since is not None:
+        query, params = "WHERE ts >= ?", (since,)
+    elif last_commits is not None:
+        query, params = "WHERE seq > ?", (commit_count(index) - last_commits,)
+    else:
+        query, params = "", ()
+    return index.execute(
+        f"SELECT path, COUNT(*) AS changes FROM changes {query} GROUP BY path ORDER BY changes DESC, path LIMIT ?",
+        params + (limit,),
+    ).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the persisted file-churn index.")
+    parser.add_argument("--limit", type=int, default=20)
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument("--last-commits", type=int, default=None)
+    window.add_argument("--days", type=float, default=None)
+    args = parser.parse_args()
+
+    since = time.time() - args.days * SECONDS_PER_DAY if args.days is not None else None
+    for path, changes in top_files(open_index(), args.limit, args.last_commits, since):
+        print(f"{changes:8d}  {path}")
@@ -1,136 +1,208 @@
-import pickle
-import git
-import os
-import ast
-import re
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-
-def compute_max_nesting_depth(file_content):
-    try:
-        tree = ast.parse(file_content)
-    except SyntaxError:
-        return 0
-
-    max_depth = 0
-
-    def visit_node(node, depth=0):
-        nonlocal max_depth
-        max_depth = max(max_depth, depth)
-        for child in ast.iter_child_nodes(node):
-            visit_node(child, depth + 1)
-
-    visit_node(tree)
-    return max_depth
-
-def compute_avg_nesting_depth_without_ast(code):
-    indentation_levels = []
-    
-    for line in code.splitlines():
-        stripped_line = line.lstrip()
-        
-        if not stripped_line or stripped_line.startswith("#"):
-            continue
-        
-        indentation_level = len(line) - len(stripped_line)
-        indentation_levels.append(indentation_level)
-
-    if indentation_levels:
-        avg_nesting = sum(indentation_levels) / len(indentation_levels)
-        return avg_nesting / 4
-    return 0
-
-def compute_naming_convention_ratios(code):
-    snake_case_pattern = re.compile(r'\b[a-z]+(?:_[a-z]+)+\b')
-    camel_case_pattern = re.compile(r'\b[a-z]+(?:[A-Z][a-z]*)+\b')
-    
-    snake_case_count = len(snake_case_pattern.findall(code))
-    camel_case_count = len(camel_case_pattern.findall(code))
-    
-    total_variables = snake_case_count + camel_case_count
-
-    snake_ratio = snake_case_count / total_variables if total_variables > 0 else 0
-    camel_ratio = camel_case_count / total_variables if total_variables > 0 else 0
-
-    result = {
-        "snake_case_ratio": snake_ratio,
-        "camel_case_ratio": camel_ratio
-    }
-    return result
-
-def compute_avg_indentation(file_content):
-    lines = file_content.splitlines()
-    indentation_levels = []
-
-    for line in lines:
-        stripped_line = line.lstrip()
-        if stripped_line:
-            indentation_levels.append(len(line) - len(stripped_line))
-
-    return np.mean(indentation_levels) if indentation_levels else 0
-
-def compute_variable_naming_metrics(file_content):
-    snake_case = 0
-    camel_case = 0
-    total_variables = 0
-
-    try:
-        tree = ast.parse(file_content)
-    except SyntaxError:
-        return {"snake_case_ratio": 0, "camel_case_ratio": 0}
-
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Name):
-            total_variables += 1
-            if re.match(r"^[a-z]+(_[a-z]+)+$", node.id):
-                snake_case += 1
-            elif re.match(r"^[a-z]+([A-Z][a-z]*)+$", node.id):
-                camel_case += 1
-
-    if total_variables == 0:
-        return {"snake_case_ratio": 0, "camel_case_ratio": 0}
-
-    return {
-        "snake_case_ratio": snake_case / total_variables,
-        "camel_case_ratio": camel_case / total_variables,
-    }
-
-def calculate_features(commit):
-    avg_nesting_depths = []
-    avg_indentation_levels = []
-    snake_case_ratios = []
-    camel_case_ratios = []
-
-    for file in commit["files_changed"]:
-
-        file_content = get_total_diff([file])
-        avg_nesting_depths.append(compute_avg_nesting_depth_without_ast(file_content))
-        avg_indentation_levels.append(compute_avg_indentation(file_content))
-        naming_metrics = compute_naming_convention_ratios(file_content)
-        snake_case_ratios.append(naming_metrics["snake_case_ratio"])
-        camel_case_ratios.append(naming_metrics["camel_case_ratio"])
-
-    return {
-        "avg_nesting_depth": np.mean(avg_nesting_depths) if avg_nesting_depths else 0,
-        "avg_indentation": np.mean(avg_indentation_levels) if avg_indentation_levels else 0,
-        "snake_case_ratio": np.mean(snake_case_ratios) if snake_case_ratios else 0,
-        "camel_case_ratio": np.mean(camel_case_ratios) if camel_case_ratios else 0,
-    }
-
-def get_total_diff(files_changed):
-    total_diff = ""
-    for file in files_changed:
-        total_diff += file["diff"] + "\n"
-    total_diff = total_diff.replace("\ No newline at end of file", "")
-
-    lines = total_diff.splitlines()
-    cleaned_lines = []
-
-    for line in lines:
-        if not line.strip().startswith('@@'):
-            cleaned_line = re.sub(r"^[-+]", " ", line)
-            cleaned_lines.append(cleaned_line)
-
-    total_diff =  "\n".join(cleaned_lines)
-    return total_diff
+import pickle
+import git
+import os
+import ast
+import re
+import numpy as np
+import keyword_matcher
+
+SNAKE_CASE_NAME = re.compile(r"^[a-z]+(_[a-z]+)+$")
+CAMEL_CASE_NAME = re.compile(r"^[a-z]+([A-Z][a-z]*)+$")
+
+def parse_source(file_content):
+    """
+    ast.parse, or None for sources it rejects (syntax errors, null bytes, nesting too deep for
+    the parser itself).
+    """
+    try:
+        return ast.parse(file_content)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return None
+
+def tree_metrics(tree):
+    """
+    (deepest node nesting, names, snake_case names, camelCase names) of a parsed tree, in one
+    walk. The walk keeps its own stack, so deeply nested code cannot hit the recursion limit.
+    """
+    max_depth = total_variables = snake_case = camel_case = 0
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if depth > max_depth:
+            max_depth = depth
+        if type(node) is ast.Name:
+            total_variables += 1
+            if SNAKE_CASE_NAME.match(node.id):
+                snake_case += 1
+            elif CAMEL_CASE_NAME.match(node.id):
+                camel_case += 1
+        stack.extend([(child, depth + 1) for child in ast.iter_child_nodes(node)])
+    return max_depth, total_variables, snake_case, camel_case
+
+def compute_max_nesting_depth(file_content):
+    tree = parse_source(file_content)
+    return tree_metrics(tree)[0] if tree is not None else 0
+
+def compute_avg_nesting_depth_without_ast(code):
+    indentation_levels = []
+    
+    for line in code.splitlines():
+        stripped_line = line.lstrip()
+        
+        if not stripped_line or stripped_line.startswith("#"):
+            continue
+        
+        indentation_level = len(line) - len(stripped_line)
+        indentation_levels.append(indentation_level)
+
+    if indentation_levels:
+        avg_nesting = sum(indentation_levels) / len(indentation_levels)
+        return avg_nesting / 4
+    return 0
+
+def compute_naming_convention_ratios(code):
+    snake_case_pattern = re.compile(r'\b[a-z]+(?:_[a-z]+)+\b')
+    camel_case_pattern = re.compile(r'\b[a-z]+(?:[A-Z][a-z]*)+\b')
+    
+    snake_case_count = len(snake_case_pattern.findall(code))
+    camel_case_count = len(camel_case_pattern.findall(code))
+    
+    total_variables = snake_case_count + camel_case_count
+
+    snake_ratio = snake_case_count / total_variables if total_variables > 0 else 0
+    camel_ratio = camel_case_count / total_variables if total_variables > 0 else 0
+
+    result = {
+        "snake_case_ratio": snake_ratio,
+        "camel_case_ratio": camel_ratio
+    }
+    return result
+
+def compute_avg_indentation(file_content):
+    lines = file_content.splitlines()
+    indentation_levels = []
+
+    for line in lines:
+        stripped_line = line.lstrip()
+        if stripped_line:
+            indentation_levels.append(len(line) - len(stripped_line))
+
+    return np.mean(indentation_levels) if indentation_levels else 0
+
+def compute_variable_naming_metrics(file_content):
+    tree = parse_source(file_content)
+    if tree is None:
+        return {"snake_case_ratio": 0, "camel_case_ratio": 0}
+
+    _, total_variables, snake_case, camel_case = tree_metrics(tree)
+    if total_variables == 0:
+        return {"snake_case_ratio": 0, "camel_case_ratio": 0}
+
+    return {
+        "snake_case_ratio": snake_case / total_variables,
+        "camel_case_ratio": camel_case / total_variables,
+    }
+
+NO_NEWLINE_MARKER = "\\ No newline at end of file"
+# The snake_case and camelCase patterns of compute_naming_convention_ratios in one pass. Both only
+# match whole words, so a word is either one or the other; group 1 captures "_" for snake_case.
+# Possessive quantifiers stop the per-word backtracking that dominated the old scans.
+NAMING_PATTERN = re.compile(r'\b[a-z]++(?:(_)[a-z]++(?:_[a-z]++)*+|[A-Z][a-z]*+(?:[A-Z][a-z]*+)*+)\b')
+IMPORT_PATTERN = re.compile(r"import\s+[a-zA-Z_]+")
+
+def scan_diff(diff, complexity_matcher=None, sensitive_matcher=None):
+    """
+    Single pass over one file's unified diff, with the same cleaning as get_total_diff.
+    Returns the raw counts behind both the fingerprint features and the risk metrics.
+    """
+    indented_lines = 0
+    indentation_sum = 0
+    code_lines = 0
+    code_indentation_sum = 0
+    kept_lines = []
+
+    for line in diff.splitlines():
+        if NO_NEWLINE_MARKER in line:
+            line = line.replace(NO_NEWLINE_MARKER, "")
+        stripped_line = line.lstrip()
+        if stripped_line.startswith('@@'):
+            continue
+        if line[:1] in ('+', '-'):
+            line = " " + line[1:]
+            stripped_line = line.lstrip()
+        kept_lines.append(line)
+
+        if stripped_line:
+            indentation = len(line) - len(stripped_line)
+            indented_lines += 1
+            indentation_sum += indentation
+            if not stripped_line.startswith("#"):
+                code_lines += 1
+                code_indentation_sum += indentation
+
+    text = "\n".join(kept_lines)
+    token_counts = keyword_matcher.tokenize(text) if complexity_matcher or sensitive_matcher else None
+    complexity_counts = complexity_matcher.count_tokens(token_counts, text) if complexity_matcher else {}
+    sensitive_counts = sensitive_matcher.count_tokens(token_counts, text) if sensitive_matcher else {}
+    naming_matches = NAMING_PATTERN.findall(text)
+    snake_case = naming_matches.count("_")
+    return {
+        "indented_lines": indented_lines,
+        "indentation_sum": indentation_sum,
+        "code_lines": code_lines,
+        "code_indentation_sum": code_indentation_sum,
+        "snake_case": snake_case,
+        "camel_case": len(naming_matches) - snake_case,
+        "complexity": sum(complexity_counts.values()),
+        "sensitive_keywords": sorted(sensitive_counts),
+        "imports": len(IMPORT_PATTERN.findall(text)),
+    }
+
+def features_from_scan(scan):
+    naming_total = scan["snake_case"] + scan["camel_case"]
+    return {
+        "avg_nesting_depth": scan["code_indentation_sum"] / scan["code_lines"] / 4 if scan["code_lines"] else 0,
+        "avg_indentation": scan["indentation_sum"] / scan["indented_lines"] if scan["indented_lines"] else 0,
+        "snake_case_ratio": scan["snake_case"] / naming_total if naming_total > 0 else 0,
+        "camel_case_ratio": scan["camel_case"] / naming_total if naming_total > 0 else 0,
+    }
+
+def calculate_features(commit):
+    avg_nesting_depths = []
+    avg_indentation_levels = []
+    snake_case_ratios = []
+    camel_case_ratios = []
+
+    for file in commit["files_changed"]:
+        file_features = features_from_scan(scan_diff(file["diff"]))
+        avg_nesting_depths.append(file_features["avg_nesting_depth"])
+        avg_indentation_levels.append(file_features["avg_indentation"])
+        snake_case_ratios.append(file_features["snake_case_ratio"])
+        camel_case_ratios.append(file_features["camel_case_ratio"])
+
+    features = {
+        "avg_nesting_depth": np.mean(avg_nesting_depths) if avg_nesting_depths else 0,
+        "avg_indentation": np.mean(avg_indentation_levels) if avg_indentation_levels else 0,
+        "snake_case_ratio": np.mean(snake_case_ratios) if snake_case_ratios else 0,
+        "camel_case_ratio": np.mean(camel_case_ratios) if camel_case_ratios else 0,
+    }
+    # Full-file AST metrics, attached by history.commit_records when AST_FEATURES=1 (see ast_cache).
+    features.update(commit.get("ast", {}))
+    return features
+
+def get_total_diff(files_changed):
+    total_diff = ""
+    for file in files_changed:
+        total_diff += file["diff"] + "\n"
+    total_diff = total_diff.replace("\ No newline at end of file", "")
+
+    lines = total_diff.splitlines()
+    cleaned_lines = []
+
+    for line in lines:
+        if not line.strip().startswith('@@'):
+            cleaned_line = re.sub(r"^[-+]", " ", line)
+            cleaned_lines.append(cleaned_line)
+
+    total_diff =  "\n".join(cleaned_lines)
+    return total_diff
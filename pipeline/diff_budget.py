@@ -0,0 +1,174 @@
+import fnmatch
+import json
+import math
+import os
+import random
+import re
+import zlib
+
+# Per-file budget: past either limit the rest of the diff is sampled instead of kept.
+file_max_bytes = int(os.getenv('DIFF_FILE_MAX_BYTES', str(256 * 1024)))
+file_max_lines = int(os.getenv('DIFF_FILE_MAX_LINES', '5000'))
+# Lines kept from the part of a diff past the file budget.
+sample_lines = int(os.getenv('DIFF_SAMPLE_LINES', '1000'))
+# Per-commit budget: once a commit's kept diff text reaches it, its remaining files are skipped.
+commit_max_bytes = int(os.getenv('DIFF_COMMIT_MAX_BYTES', str(1024 * 1024)))
+skip_generated = os.getenv('SKIP_GENERATED', '1') != '0'
+# Comma-separated globs of vendored or generated files, matched against the whole path.
+skip_path_globs = [glob for glob in os.getenv(
+    'SKIP_PATH_GLOBS',
+    '*_pb2.py,*_pb2_grpc.py,vendor/*,*/vendor/*,_vendor/*,*/_vendor/*,third_party/*,*/third_party/*,'
+    'site-packages/*,*/site-packages/*',
+).split(',') if glob]
+
+# Checked, case-insensitively, in the first MARKER_LINES lines of the file as of the commit, i.e.
+# only in a hunk that starts at its line 1.
+GENERATED_MARKERS = (
+    "generated by the protocol buffer compiler", "do not edit", "@generated", "code generated by",
+    "autogenerated", "auto-generated",
+)
+MARKER_LINES = 10
+# Sampled lines are cut to this many bytes, so minified code cannot blow the budget either.
+SAMPLE_LINE_BYTES = 1024
+SAMPLE_SEED = 0
+# The diffs are reversed (see extract_files_changed), so the commit's version of the file is the
+# "-" side of a hunk: "@@ -1,N +..." or "@@ -1 +..." starts at its first line.
+FIRST_LINE_HUNK = re.compile(r"@@ -1[, ]")
+
+# Reasons a file's diff was not kept in full; all but "sampled" drop the file from the features.
+SAMPLED = "sampled"
+SKIPPED_PATH = "skipped-path"
+GENERATED = "generated-marker"
+COMMIT_BUDGET = "commit-budget"
+
+
+def config_tag():
+    """
+    Short tag of the budget settings, for cache keys: records extracted under other settings differ.
+    """
+    settings = [file_max_bytes, file_max_lines, sample_lines, commit_max_bytes, skip_generated, skip_path_globs,
+                GENERATED_MARKERS, MARKER_LINES, SAMPLE_LINE_BYTES, SAMPLE_SEED]
+    return f"b{zlib.crc32(json.dumps(settings).encode('utf-8')):08x}"
+
+
+def skipped_path(path):
+    return skip_generated and any(fnmatch.fnmatchcase(path, glob) for glob in skip_path_globs)
+
+
+def generated_marker(line):
+    line = line.lower()
+    return any(marker in line for marker in GENERATED_MARKERS)
+
+
+def decode(raw_line):
+    return raw_line.decode('utf-8', errors='ignore').rstrip("\n")
+
+
+class FileSample:
+    """
+    The lines of one file's diff, kept within a byte and line budget. Lines past the budget are
+    counted, and a fixed-size uniform sample of them (reservoir sampling with a fixed seed, so
+    the same diff always gives the same sample) is kept in their original order.
+    """
+    __slots__ = ("max_bytes", "lines", "kept_bytes", "total_lines", "total_bytes", "reservoir", "rng", "weight",
+                 "next_sample", "reason", "marker_lines")
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = file_max_bytes if max_bytes is None else min(max_bytes, file_max_bytes)
+        self.lines = []
+        self.kept_bytes = 0
+        self.total_lines = 0
+        self.total_bytes = 0
+        self.reservoir = []
+        self.rng = None
+        self.weight = 1.0
+        # Total line count at which the next line enters the full reservoir.
+        self.next_sample = 0
+        self.reason = COMMIT_BUDGET if self.max_bytes <= 0 else None
+        # Lines of the file's head still to check for generated markers.
+        self.marker_lines = 0
+
+    def check_path(self, path):
+        """
+        Skip vendored and generated paths; called once the path is known, before any lines.
+        """
+        if self.reason is None and skipped_path(path):
+            self.skip(SKIPPED_PATH)
+
+    def skip(self, reason):
+        self.reason = reason
+        self.lines, self.reservoir = [], []
+
+    def add(self, raw_line):
+        """
+        Add one line of diff text, as bytes. Only kept lines are decoded.
+        """
+        self.total_lines += 1
+        self.total_bytes += len(raw_line)
+        if self.reason is not None and (self.reason != SAMPLED or self.total_lines < self.next_sample):
+            return
+        if (self.reason is None and self.kept_bytes + len(raw_line) <= self.max_bytes
+                and len(self.lines) < file_max_lines):
+            line = decode(raw_line)
+            self.lines.append(line)
+            self.kept_bytes += len(raw_line)
+            if skip_generated:
+                self.check_marker(line)
+            return
+
+        if self.reason is None:
+            self.reason = SAMPLED
+            self.rng = random.Random(SAMPLE_SEED)
+        entry = (self.total_lines, decode(raw_line[:SAMPLE_LINE_BYTES]))
+        if len(self.reservoir) < sample_lines:
+            self.reservoir.append(entry)
+            if len(self.reservoir) < sample_lines:
+                return
+        else:
+            self.reservoir[self.rng.randrange(sample_lines)] = entry
+        # Algorithm L: draw how many lines to pass over before the next replacement, so lines that
+        # do not enter the sample cost only the counters above.
+        self.weight *= math.exp(math.log(1.0 - self.rng.random()) / sample_lines)
+        skip = math.log(1.0 - self.rng.random()) / math.log1p(-self.weight) if self.weight < 1 else 0
+        self.next_sample = self.total_lines + int(skip) + 1
+
+    def check_marker(self, line):
+        """
+        Skip the file when a generated marker is among its first MARKER_LINES lines as of the commit.
+        """
+        if line.startswith("@@"):
+            self.marker_lines = MARKER_LINES if FIRST_LINE_HUNK.match(line) else 0
+        elif self.marker_lines and line[:1] in ("-", " "):
+            # "+" lines only exist in the parent.
+            self.marker_lines -= 1
+            if generated_marker(line):
+                self.skip(GENERATED)
+
+    def used_bytes(self):
+        return self.kept_bytes + sum(len(line) for _, line in self.reservoir)
+
+    def record(self, path):
+        """
+        The files_changed record: {"file_path", "diff"}, plus a "budget" entry with the reason,
+        the full size of the diff and whether the file was skipped when it was not kept in full.
+        """
+        lines = self.lines + [line for _, line in sorted(self.reservoir)]
+        while lines and not lines[-1]:
+            lines.pop()
+        record = {"file_path": path, "diff": "\n".join(lines) + "\n" if lines else ""}
+        if self.reason is not None:
+            record["budget"] = {"reason": self.reason, "skipped": self.reason != SAMPLED,
+                                "lines": self.total_lines, "bytes": self.total_bytes}
+        return record
+
+
+def is_skipped(file):
+    return file.get("budget", {}).get("skipped", False)
+
+
+def degraded_files(files_by_sha):
+    """
+    (sha, file_path, budget) for every file that was sampled or skipped.
+    """
+    return [(sha, file["file_path"], file["budget"])
+            for sha, files_changed in files_by_sha.items() for file in files_changed if "budget" in file]
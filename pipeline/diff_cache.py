@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import zlib
+
+cache_dir = os.getenv('PIPELINE_CACHE_DIR', './.pipeline_cache')
+diff_cache_enabled = os.getenv('DIFF_CACHE', '1') != '0'
+# Diffs are keyed by commit SHA, so several repositories can share one database.
+diff_cache_path = os.getenv('DIFF_CACHE_PATH', '')
+
+# Bump when the shape of the cached files_changed records changes.
+DIFF_VARIANT = "py-v3"
+SQLITE_MAX_VARIABLES = 500
+
+
+def open_cache(path=None):
+    """
+    Open (or create) the on-disk diff cache. Returns None when caching is disabled.
+    """
+    if not diff_cache_enabled:
+        return None
+    if path is None:
+        path = diff_cache_path or os.path.join(cache_dir, "diffs.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    cache = sqlite3.connect(path, timeout=60)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS commit_diffs ("
+        "sha TEXT NOT NULL, variant TEXT NOT NULL, files_changed BLOB NOT NULL, "
+        "PRIMARY KEY (sha, variant))"
+    )
+    return cache
+
+
+def encode_files_changed(files_changed):
+    return zlib.compress(json.dumps(files_changed).encode('utf-8'))
+
+
+def decode_files_changed(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def get_files_changed(cache, sha, variant=DIFF_VARIANT):
+    row = cache.execute(
+        "SELECT files_changed FROM commit_diffs WHERE sha = ? AND variant = ?",
+        (sha, variant),
+    ).fetchone()
+    return decode_files_changed(row[0]) if row else None
+
+
+def get_many(cache, shas, variant=DIFF_VARIANT):
+    """
+    Look up several commits at once. Returns {sha: files_changed} for the cached ones only.
+    """
+    found = {}
+    shas = list(shas)
+    for start in range(0, len(shas), SQLITE_MAX_VARIABLES):
+        chunk = shas[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        rows = cache.execute(
+            f"SELECT sha, files_changed FROM commit_diffs WHERE variant = ? AND sha IN ({placeholders})",
+            [variant] + chunk,
+        )
+        for sha, blob in rows:
+            found[sha] = decode_files_changed(blob)
+    return found
+
+
+def cached_shas(cache, shas, variant=DIFF_VARIANT):
+    """
+    The subset of `shas` that is cached, without decoding any records.
+    """
+    found = set()
+    shas = list(shas)
+    for start in range(0, len(shas), SQLITE_MAX_VARIABLES):
+        chunk = shas[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        rows = cache.execute(f"SELECT sha FROM commit_diffs WHERE variant = ? AND sha IN ({placeholders})",
+                             [variant] + chunk)
+        found.update(sha for sha, in rows)
+    return found
+
+
+def put_files_changed(cache, sha, files_changed, variant=DIFF_VARIANT):
+    cache.execute(
+        "INSERT OR REPLACE INTO commit_diffs (sha, variant, files_changed) VALUES (?, ?, ?)",
+        (sha, variant, encode_files_changed(files_changed)),
+    )
+
+
+def put_many(cache, items, variant=DIFF_VARIANT):
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO commit_diffs (sha, variant, files_changed) VALUES (?, ?, ?)",
+            ((sha, variant, encode_files_changed(files_changed)) for sha, files_changed in items),
+        )
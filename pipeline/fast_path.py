@@ -0,0 +1,82 @@
+import json
+import os
+
+import diff_budget
+import diff_cache
+import metrics
+import repo_manager
+
+# Cheap checks that settle a run before any history walk or sklearn import. Only the standard
+# library, GitPython (already loaded to open the repository) and single git commands are used.
+fast_path_enabled = os.getenv('FAST_PATH', '1') != '0'
+verdicts_path = os.getenv('VERDICTS_PATH', os.path.join(diff_cache.cache_dir, 'verdicts.json'))
+
+
+def changes_python(commit):
+    """
+    Whether the commit adds or modifies a selected file relative to its first parent, the same
+    files the pipelines would diff (see repo_manager.DIFF_PATHSPEC; vendored and generated paths
+    do not count, see diff_budget).
+    """
+    parents = [commit.parents[0].hexsha] if commit.parents else ["--root"]
+    changed = commit.repo.git.diff_tree("-r", "--name-only", "--no-commit-id", "--no-renames",
+                                        "--diff-filter=d", *parents, commit.hexsha, "--", *repo_manager.DIFF_PATHSPEC)
+    return any(repo_manager.selected_path(path) and not diff_budget.skipped_path(path) for path in changed.splitlines())
+
+
+def skip_commit(commit):
+    """
+    True when the commit needs no scoring: it is marked #no_anomaly or touches no Python files.
+    A skipped commit is still folded into the baseline by the next run that scores one.
+    """
+    if '#no_anomaly' in commit.message:
+        return True
+    if fast_path_enabled and not changes_python(commit):
+        metrics.count("commits_skipped")
+        print(f"Commit {commit.hexsha} changes no Python files; nothing to score.")
+        return True
+    return False
+
+
+def diff_settings():
+    """
+    The path selection and diff budget settings a verdict was computed under (the same tags as
+    history.diff_variant, without importing it).
+    """
+    return f"{repo_manager.selection_tag()}-{diff_budget.config_tag()}"
+
+
+def load_verdicts(path=None):
+    path = path or verdicts_path
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_verdict(check, sha, path=None):
+    """
+    The stored score of `check` ("fingerprint" or "risk") for a commit that was already scored,
+    or None.
+    """
+    if not fast_path_enabled:
+        return None
+    verdict = load_verdicts(path).get(check)
+    hit = bool(verdict) and verdict["sha"] == sha and verdict.get("diff_settings") == diff_settings()
+    metrics.cache_lookup("verdicts", int(hit), int(not hit))
+    return verdict if hit else None
+
+
+def store_verdict(check, sha, score, path=None):
+    """
+    Remember the latest score of a check, so a rerun on the same commit only re-reports it.
+    The threshold is applied when reporting, so a changed threshold still takes effect.
+    """
+    path = path or verdicts_path
+    verdicts = load_verdicts(path)
+    verdicts[check] = {"sha": sha, "score": score, "diff_settings": diff_settings()}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(verdicts, f)
+    os.replace(tmp_path, path)
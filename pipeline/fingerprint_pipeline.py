@@ -1,170 +1,170 @@
-import pickle
-import sys
-from sklearn.preprocessing import StandardScaler
-
-import numpy as np
-import git
-import os
-import shutil
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-import code_features
-
-vectorizer = TfidfVectorizer()
-scaling_factor = float(os.getenv('SCALING_FACTOR', '0.2'))
-complexity_weight = float(os.getenv('COMPLEXITY_WEIGHT', '1'))
-external_dependencies_weight = float(os.getenv('EXTERNAL_DEPENDENCIES_WEIGHT', '5'))
-fingerprint_threshold = float(os.getenv('FINGERPRINT_THRESHOLD', '0.088'))
-frequency_weight = float(os.getenv('FREQUENCY_WEIGHT', '20'))
-repo_path = os.getenv('REPO_PATH', './repository')
-repo_url = os.getenv('REPO_URL', 'https://github.com/GabrielOprea/ValidatePyApp')
-risk_threshold = float(os.getenv('RISK_THRESHOLD', '18'))
-sensitive_data_weight = float(os.getenv('SENSITIVE_DATA_WEIGHT', '30'))
-
-def clone_repository(remote_url, local_path):
-    if not os.path.exists(local_path):
-        print(f"Cloning repository from {remote_url} to {local_path}...")
-        repo = git.Repo.clone_from(remote_url, local_path)
-        print("Repository cloned successfully.")
-    else:
-        print(f"Repository already exists at {local_path}.")
-        repo = git.Repo(local_path)
-    return repo
-
-def get_commit_data(repo_path):
-    repo = git.Repo(repo_path)
-    commit_data = []
-    
-    for commit in list(repo.iter_commits(rev='HEAD'))[::-1]:
-        if '#no_anomaly' not in commit.message:
-            files_changed = []
-            for diff in commit.diff(commit.parents[0] if commit.parents else None, create_patch=True):
-                if diff.a_path and diff.a_path.endswith('.py'):
-                    files_changed.append({
-                        "file_path": diff.a_path,
-                        "diff": diff.diff.decode('utf-8', errors='ignore')
-                    })
-                
-            commit_data.append({
-                "hash": commit.hexsha,
-                "author": commit.author.name,
-                "message": commit.message,
-                "date": commit.committed_date,
-                "files_changed": files_changed
-            })
-    return commit_data
-
-def get_commit_data_for_commit(repo, commit):
-    files_changed = []
-    for diff in commit.diff(commit.parents[0] if commit.parents else None, create_patch=True):
-        if diff.a_path and diff.a_path.endswith('.py'):
-            files_changed.append({
-                "file_path": diff.a_path,
-                "diff": diff.diff.decode('utf-8', errors='ignore')
-            })
-    
-    return {
-        "author": commit.author.name,
-        "message": commit.message,
-        "date": commit.committed_date,
-        "files_changed": files_changed
-    }
-
-def fit_vectorizer(commit_data):
-    messages = [commit["message"] for commit in commit_data]
-    vectorizer = TfidfVectorizer()
-    vectorizer.fit(messages)
-    return vectorizer
-
-def load_old_fingerprint(old_fingerprint_path):
-    if os.path.exists(old_fingerprint_path):
-        import pickle
-        with open(old_fingerprint_path, "rb") as f:
-            old_fingerprint = pickle.load(f)
-    else:
-        old_fingerprint = None
-    return old_fingerprint
-
-def check_fingerprints(old_fingerprint_path, old_fingerprint, new_fingerprint):
-    if old_fingerprint:
-        if detect_anomalies(old_fingerprint, new_fingerprint):
-            print("Anomaly detected in the commit fingerprint.")
-            exit(1)
-        else:
-            print("No anomalies detected.")
-    else:
-        print("No stored fingerprint found. Storing the current fingerprint.")
-        with open(old_fingerprint_path, "wb") as f:
-            pickle.dump(new_fingerprint, f)
-
-def generate_fingerprint(commit_data):
-    messages = [commit["message"] for commit in commit_data]
-    tfidf_matrix = vectorizer.fit_transform(messages)
-    return {"tdidf_vectors": tfidf_matrix}
-
-def generate_fingerprint(commit, vectorizer):
-    tfidf_vector = vectorizer.transform([commit["message"]]).toarray()[0]
-    features = code_features.calculate_features(commit)
-
-    feature_min = np.array([0, 0, 0, 0])
-    feature_max = np.array([6, 21, 1, 1])
-
-    feature_values = np.array([
-        features["avg_nesting_depth"],
-        features["avg_indentation"],
-        features["snake_case_ratio"],
-        features["camel_case_ratio"]
-    ])
-
-    normalized_features = scaling_factor * (feature_values - feature_min) / (feature_max - feature_min)
-
-    combined_vector = np.append(tfidf_vector, normalized_features)
-    return combined_vector
-
-def detect_anomalies(old_fingerprint, new_fingerprint):
-    similarity = cosine_similarity([old_fingerprint], [new_fingerprint])[0][0]
-    return similarity < fingerprint_threshold
-
-def get_anomaly_score(old_fingerprint, new_fingerprint):
-    similarity = cosine_similarity([old_fingerprint], [new_fingerprint])[0][0]
-    return similarity
-
-def get_anomaly_score(old_fingerprint, new_fingerprint):
-    similarity = cosine_similarity([old_fingerprint], [new_fingerprint])[0][0]
-
-    return similarity
-
-remote_url = repo_url
-local_path = repo_path
-repo = clone_repository(remote_url, local_path)
-commit_data = get_commit_data(local_path)
-
-latest_commy = list(repo.iter_commits(rev='HEAD'))[0]
-if '#no_anomaly' in latest_commy.message:
-    sys.exit(0)
-
-vectorizer = fit_vectorizer(commit_data)
-cumulative_fingerprint = None
-anomalous_commits = []
-
-is_anomalous = False
-latest_commit = commit_data[-1]
-if '#no_anomaly' in latest_commit["message"]:
-    sys.exit(0)
-for i, commit in enumerate(commit_data[:-1]):
-    new_fingerprint = generate_fingerprint(commit, vectorizer)
-
-    if cumulative_fingerprint is None:
-        cumulative_fingerprint = new_fingerprint
-        continue
-
-    cumulative_fingerprint = np.mean([cumulative_fingerprint, new_fingerprint], axis=0)
-
-new_fingerprint = generate_fingerprint(latest_commit, vectorizer)
-score = get_anomaly_score(cumulative_fingerprint, new_fingerprint)
-if detect_anomalies(cumulative_fingerprint, new_fingerprint):
-    print(f"Anomaly detected in commit {latest_commit['hash']}: {latest_commit['message']} ({score})")
-    sys.exit(1)
-else:
-    print(f"No anomaly detect in commit  {latest_commit['hash']}: {latest_commit['message']} ({score})")
-    sys.exit(0)
\ No newline at end of file
+import os
+import sys
+
+import ast_cache
+import fast_path
+import history
+import metrics
+import repo_manager
+
+# sklearn, scipy and the baseline are imported where they are used, so runs that exit early
+# (see fast_path) never load them.
+scaling_factor = float(os.getenv('SCALING_FACTOR', '0.2'))
+complexity_weight = float(os.getenv('COMPLEXITY_WEIGHT', '1'))
+external_dependencies_weight = float(os.getenv('EXTERNAL_DEPENDENCIES_WEIGHT', '5'))
+fingerprint_threshold = float(os.getenv('FINGERPRINT_THRESHOLD', '0.088'))
+# "mean" compares a commit with the mean of the history; "knn" with its nearest stored commits.
+fingerprint_scoring = os.getenv('FINGERPRINT_SCORING', 'mean')
+knn_threshold = float(os.getenv('KNN_THRESHOLD', '0.5'))
+frequency_weight = float(os.getenv('FREQUENCY_WEIGHT', '20'))
+repo_path = os.getenv('REPO_PATH', './repository')
+repo_url = os.getenv('REPO_URL', 'https://github.com/GabrielOprea/ValidatePyApp')
+risk_threshold = float(os.getenv('RISK_THRESHOLD', '18'))
+sensitive_data_weight = float(os.getenv('SENSITIVE_DATA_WEIGHT', '30'))
+
+def clone_repository(remote_url, local_path):
+    """
+    Mirror the repository on first use and fetch new commits on every later run. Blobs are
+    prefetched by main once the fast path is ruled out.
+    """
+    return repo_manager.acquire(remote_url, local_path, prefetch_history=False)
+
+def get_commit_data(repo_path):
+    """
+    Extract commit metadata and modified file content.
+    """
+    return history.get_commit_data(repo_path)
+
+def score_new_commits(state, commit_data, workers=None):
+    """
+    Fold commit_data (oldest first, any iterable) into the baseline state and score the newest
+    commit against everything before it. Diffs and messages are loaded and dropped one history
+    window at a time, and each window's fingerprints are appended to the fingerprint store once
+    the whole window is folded, so nothing is kept per commit across windows. Returns (newest
+    commit, similarity): both None when there was nothing to fold, and the similarity is None
+    when there is nothing to compare against.
+    """
+    import baseline
+    import fingerprints
+    store = fingerprints.open_commit_store(state) if store_enabled() else None
+    folded = 0
+    latest = latest_vector = pending = unstored = None
+    for window in history.iter_windows(commit_data):
+        feature_vectors = baseline.commit_feature_vectors(window, workers)
+        term_counts = []
+        for commit, feature_vector in zip(window, feature_vectors):
+            # Each commit is folded once the next one arrives, so the newest is the one scored. The
+            # record releases its message below, so the pending one keeps it.
+            if pending is not None:
+                with metrics.stage("baseline_fold"):
+                    baseline.fold_commit(state, pending, feature_vector=latest_vector)
+            if unstored is not None:
+                store_window(store, state, *unstored)
+                unstored = None
+            latest, latest_vector = commit, feature_vector
+            pending = {"hash": commit["hash"], "message": commit["message"]}
+            if store is not None:
+                term_counts.append(baseline.term_frequencies(state, commit["message"]))
+            commit.drop_diff()
+        # The window's last commit is folded with the next window (or scored below).
+        unstored = (window, feature_vectors, term_counts)
+        folded += len(window)
+    if pending is None:
+        return None, None
+    metrics.count("commits_folded", folded)
+    with metrics.stage("baseline_fold"):
+        similarity = baseline.fold_commit(state, pending, score=True, feature_vector=latest_vector)
+    store_window(store, state, *unstored)
+    return latest, similarity
+
+def store_window(store, state, window, feature_vectors, term_counts):
+    """
+    Append a folded history window to the fingerprint store (a no-op when store is None).
+    """
+    import baseline
+    import fingerprints
+    if store is None:
+        return
+    with metrics.stage("fingerprint_store"):
+        fingerprints.store_commits(store, state, window, feature_vectors, counts=baseline.count_rows(state, term_counts))
+
+def store_enabled():
+    import fingerprints
+    return fingerprints.fingerprint_store_enabled or fingerprint_scoring == "knn"
+
+def fingerprint_check():
+    """
+    Name the verdicts of the current scoring mode are stored under (see fast_path).
+    """
+    check = "fingerprint" if fingerprint_scoring == "mean" else f"fingerprint-{fingerprint_scoring}"
+    return check + "-ast" if ast_cache.ast_features_enabled else check
+
+def similarity_threshold():
+    return knn_threshold if fingerprint_scoring == "knn" else fingerprint_threshold
+
+def knn_similarity(state, sha):
+    """
+    Mean similarity of a stored commit to its k nearest other stored commits. A single query
+    scans the store once; the scoring server keeps an LSH index for repeated queries.
+    """
+    import fingerprints
+    import neighbours
+    with metrics.stage("knn_query"):
+        return neighbours.store_similarity(fingerprints.open_commit_store(state), sha)
+
+def score_latest_commit(repo_path):
+    """
+    Fold the commits added since the stored baseline and score the newest one against the rest.
+    Returns (commit, similarity); commit is None when there is nothing new and similarity is None
+    when there is no baseline to compare against yet.
+    """
+    import baseline
+
+    # Only the commits added since the stored baseline are read; the rest of the history is
+    # already folded into it.
+    state, commit_data = baseline.new_commits(repo_path, baseline.load_state())
+    latest_commit, score = score_new_commits(state, commit_data)
+    if latest_commit is None:
+        return None, None
+
+    if fingerprint_scoring == "knn":
+        score = knn_similarity(state, latest_commit["hash"])
+    baseline.save_state(state)
+    return latest_commit, score
+
+def report_fingerprint(head_sha, latest_commit, score):
+    """
+    Print the fingerprint verdict and return the exit code.
+    """
+    if latest_commit is None:
+        print(f"Commit {head_sha} is already part of the stored baseline.")
+        return 0
+    if score is None:
+        print(f"No baseline to compare commit {latest_commit['hash']} against; storing it as the baseline.")
+        return 0
+    if score < similarity_threshold():
+        print(f"Anomaly detected in commit {latest_commit['hash']}: {latest_commit['message']} ({score})")
+        return 1
+    else:
+        print(f"No anomaly detect in commit  {latest_commit['hash']}: {latest_commit['message']} ({score})")
+        return 0
+
+def main():
+    repo = clone_repository(repo_url, repo_path)
+
+    latest_commy = repo.head.commit
+    if fast_path.skip_commit(latest_commy):
+        return 0
+    verdict = fast_path.load_verdict(fingerprint_check(), latest_commy.hexsha)
+    if verdict is not None:
+        return report_fingerprint(latest_commy.hexsha, {"hash": latest_commy.hexsha, "message": latest_commy.message},
+                                  verdict["score"])
+
+    repo_manager.prefetch(repo)
+    latest_commit, score = score_latest_commit(repo_path)
+    if latest_commit is not None and latest_commit["hash"] == latest_commy.hexsha:
+        fast_path.store_verdict(fingerprint_check(), latest_commy.hexsha, score)
+    return report_fingerprint(latest_commy.hexsha, latest_commit, score)
+
+if __name__ == "__main__":
+    sys.exit(metrics.run_main("fingerprint_pipeline", main))
@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+import diff_cache
+
+store_path = os.getenv('FINGERPRINT_STORE_PATH', os.path.join(diff_cache.cache_dir, 'fingerprint_store'))
+
+# Bump when the on-disk layout changes.
+STORE_FORMAT = 1
+HEADER_FILE = "header.json"
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.bin"
+# Derived from the two files above and rebuilt from them when missing or out of date: the L2
+# norm of every row, and the live row numbers (prefixed with the row count they were taken at).
+NORMS_FILE = "norms.f32"
+LIVE_FILE = "live.i64"
+LIVE_DTYPE = np.dtype("<i8")
+# One index record per row: the binary commit SHA and the CRC32 of the row's bytes.
+# (Raw bytes rather than "S20", which would drop a SHA's trailing zero bytes.)
+INDEX_DTYPE = np.dtype([("sha", "u1", 20), ("crc", "<u4")])
+VECTOR_DTYPE = np.dtype("<f4")
+
+
+def open_store(path=None, dims=None, vectorizer=None):
+    """
+    Open the append-only fingerprint store at `path`: a raw float32 matrix (one row per commit),
+    a parallel index of (sha, crc32) records and a JSON header with the row width and the
+    vectorizer the rows were produced with.
+
+    The store is created when missing. When `dims` or `vectorizer` are given and differ from the
+    header, the rows are not comparable with new ones and the store is emptied. A row left half
+    written by an interrupted append is dropped.
+    """
+    path = path or store_path
+    header = read_header(path)
+    if header is not None and (header.get("format") != STORE_FORMAT
+                               or (dims is not None and header["dims"] != dims)
+                               or (vectorizer is not None and header["vectorizer"] != vectorizer)):
+        print(f"Fingerprint store {path} was written for {header.get('vectorizer')} with {header.get('dims')} "
+              f"columns; starting a new one.")
+        shutil.rmtree(path)
+        header = None
+    if header is None:
+        if dims is None:
+            raise ValueError(f"No fingerprint store at {path}; dims are needed to create one.")
+        create_store(path, dims, vectorizer)
+        header = read_header(path)
+
+    store = {"path": path, "dims": header["dims"], "vectorizer": header["vectorizer"]}
+    row_bytes = store["dims"] * VECTOR_DTYPE.itemsize
+    vector_rows = os.path.getsize(os.path.join(path, VECTORS_FILE)) // row_bytes
+    index_rows = os.path.getsize(os.path.join(path, INDEX_FILE)) // INDEX_DTYPE.itemsize
+    rows = min(vector_rows, index_rows)
+    if (os.path.getsize(os.path.join(path, VECTORS_FILE)) != rows * row_bytes
+            or os.path.getsize(os.path.join(path, INDEX_FILE)) != rows * INDEX_DTYPE.itemsize):
+        print(f"Fingerprint store {path} has an incomplete last row; truncating it to {rows} rows.")
+        truncate(store, rows)
+
+    records = np.fromfile(os.path.join(path, INDEX_FILE), dtype=INDEX_DTYPE, count=rows)
+    store["rows"] = rows
+    # A SHA appended again points at its newest row; compact() drops the older ones.
+    store["index"] = {bytes(sha).hex(): row for row, sha in enumerate(records["sha"])}
+    return store
+
+
+def read_header(path):
+    header_path = os.path.join(path, HEADER_FILE)
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path, "r") as f:
+        return json.load(f)
+
+
+def create_store(path, dims, vectorizer=None):
+    os.makedirs(path, exist_ok=True)
+    for name in (VECTORS_FILE, INDEX_FILE):
+        open(os.path.join(path, name), "wb").close()
+    tmp_path = os.path.join(path, HEADER_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"format": STORE_FORMAT, "dims": dims, "dtype": VECTOR_DTYPE.str, "vectorizer": vectorizer}, f)
+    os.replace(tmp_path, os.path.join(path, HEADER_FILE))
+
+
+def truncate(store, rows):
+    with open(os.path.join(store["path"], VECTORS_FILE), "r+b") as f:
+        f.truncate(rows * store["dims"] * VECTOR_DTYPE.itemsize)
+    with open(os.path.join(store["path"], INDEX_FILE), "r+b") as f:
+        f.truncate(rows * INDEX_DTYPE.itemsize)
+    norms_path = os.path.join(store["path"], NORMS_FILE)
+    if os.path.exists(norms_path) and os.path.getsize(norms_path) > rows * VECTOR_DTYPE.itemsize:
+        with open(norms_path, "r+b") as f:
+            f.truncate(rows * VECTOR_DTYPE.itemsize)
+    remove_live(store)
+
+
+def append(store, shas, vectors):
+    """
+    Append one row per SHA. Vectors are written before their index records, so an interrupted
+    append leaves at most a row without a record, which open_store drops.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE).reshape(len(shas), store["dims"])
+    if not len(shas):
+        return
+    records = np.empty(len(shas), dtype=INDEX_DTYPE)
+    records["sha"] = np.frombuffer(b"".join(bytes.fromhex(sha) for sha in shas), dtype=np.uint8).reshape(-1, 20)
+    records["crc"] = [zlib.crc32(row.tobytes()) for row in vectors]
+    live = stored_live(store)
+    norms_current = norms_count(store) == store["rows"]
+    start = store["rows"]
+    with open(os.path.join(store["path"], VECTORS_FILE), "ab") as f:
+        f.write(vectors.tobytes())
+    with open(os.path.join(store["path"], INDEX_FILE), "ab") as f:
+        f.write(records.tobytes())
+    superseded = [store["index"][sha] for sha in shas if sha in store["index"]]
+    for row, sha in enumerate(shas, start=start):
+        store["index"][sha] = row
+    store["rows"] += len(shas)
+
+    if norms_current:
+        with open(os.path.join(store["path"], NORMS_FILE), "ab") as f:
+            f.write(np.linalg.norm(vectors, axis=1).astype(VECTOR_DTYPE).tobytes())
+    if live is None:
+        remove_live(store)
+    elif superseded or len(set(shas)) < len(shas):
+        write_live(store, np.array(sorted(store["index"].values()), dtype=LIVE_DTYPE))
+    elif not os.path.exists(os.path.join(store["path"], LIVE_FILE)):
+        write_live(store, np.arange(start, store["rows"], dtype=LIVE_DTYPE))
+    else:
+        # The usual case: new commits only, so the live rows just grow. The row count goes in
+        # last, so an interrupted append leaves a file that no longer matches the store.
+        with open(os.path.join(store["path"], LIVE_FILE), "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.write(np.arange(start, store["rows"], dtype=LIVE_DTYPE).tobytes())
+            f.seek(0)
+            f.write(np.array([store["rows"]], dtype=LIVE_DTYPE).tobytes())
+
+
+def matrix(store):
+    """
+    Every row, memory-mapped read-only; nothing is copied until it is used.
+    """
+    if store["rows"] == 0:
+        return np.empty((0, store["dims"]), dtype=VECTOR_DTYPE)
+    return np.memmap(os.path.join(store["path"], VECTORS_FILE), dtype=VECTOR_DTYPE, mode="r",
+                     shape=(store["rows"], store["dims"]))
+
+
+def norms_count(store):
+    path = os.path.join(store["path"], NORMS_FILE)
+    return os.path.getsize(path) // VECTOR_DTYPE.itemsize if os.path.exists(path) else 0
+
+
+def row_norms(store):
+    """
+    The L2 norm of every row, kept in a file next to the vectors so a scan does not have to
+    normalise the whole matrix. Rows without a norm yet (a store written before the file
+    existed) are filled in first.
+    """
+    done = norms_count(store)
+    if done < store["rows"]:
+        data = matrix(store)
+        with open(os.path.join(store["path"], NORMS_FILE), "ab") as f:
+            for start in range(done, store["rows"], 65536):
+                f.write(np.linalg.norm(data[start:start + 65536], axis=1).astype(VECTOR_DTYPE).tobytes())
+    if store["rows"] == 0:
+        return np.empty(0, dtype=VECTOR_DTYPE)
+    return np.memmap(os.path.join(store["path"], NORMS_FILE), dtype=VECTOR_DTYPE, mode="r", shape=(store["rows"],))
+
+
+def stored_live(store):
+    """
+    The persisted live rows when they are up to date with the store, else None.
+    """
+    path = os.path.join(store["path"], LIVE_FILE)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=LIVE_DTYPE) if store["rows"] == 0 else None
+    stored = np.fromfile(path, dtype=LIVE_DTYPE)
+    if not len(stored) or stored[0] != store["rows"]:
+        return None
+    return stored[1:]
+
+
+def write_live(store, live):
+    path = os.path.join(store["path"], LIVE_FILE)
+    tmp_path = path + ".tmp"
+    np.concatenate([np.array([store["rows"]], dtype=LIVE_DTYPE), live.astype(LIVE_DTYPE)]).tofile(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def remove_live(store):
+    path = os.path.join(store["path"], LIVE_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def live_rows(store):
+    """
+    The newest row of every SHA, ascending. Kept in a file next to the store and extended by
+    append, so a one-shot query does not sort the whole index.
+    """
+    live = stored_live(store)
+    if live is None:
+        live = np.array(sorted(store["index"].values()), dtype=LIVE_DTYPE)
+        write_live(store, live)
+    return live
+
+
+def shas_at(store, rows):
+    """
+    The SHAs of the given rows, read from the index file.
+    """
+    records = np.memmap(os.path.join(store["path"], INDEX_FILE), dtype=INDEX_DTYPE, mode="r", shape=(store["rows"],))
+    return [bytes(sha).hex() for sha in records["sha"][np.asarray(rows, dtype=np.int64)]]
+
+
+def vectors(store, shas):
+    """
+    The rows of the given SHAs (which must be stored), in order.
+    """
+    return matrix(store)[[store["index"][sha] for sha in shas]]
+
+
+def missing(store, shas):
+    return [sha for sha in shas if sha not in store["index"]]
+
+
+def verify(store):
+    """
+    Recompute every row's CRC32 and return the rows whose bytes no longer match their record.
+    """
+    records = np.fromfile(os.path.join(store["path"], INDEX_FILE), dtype=INDEX_DTYPE, count=store["rows"])
+    data = matrix(store)
+    return [row for row in range(store["rows"]) if zlib.crc32(data[row].tobytes()) != records["crc"][row]]
+
+
+def compact(store, keep=None):
+    """
+    Rewrite the store with only the newest row of each SHA (and only SHAs in `keep`, when given).
+    The row width never changes here: rows of another width come from another projection, so a
+    width change means rebuilding the store from source (open_store starts a new one). The new
+    store is built next to the old one and swapped in, so an interrupted compaction leaves the
+    old store intact.
+    """
+    live = sorted((row, sha) for sha, row in store["index"].items() if keep is None or sha in keep)
+    compacted = matrix(store)[[row for row, _ in live]]
+
+    new_path = store["path"] + ".compact"
+    old_path = store["path"] + ".old"
+    for leftover in (new_path, old_path):
+        if os.path.exists(leftover):
+            shutil.rmtree(leftover)
+    create_store(new_path, store["dims"], store["vectorizer"])
+    append(open_store(new_path), [sha for _, sha in live], compacted)
+    os.rename(store["path"], old_path)
+    os.rename(new_path, store["path"])
+    shutil.rmtree(old_path)
+    return open_store(store["path"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and maintain the fingerprint store.")
+    parser.add_argument("--path", default=None)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="print the header and row counts")
+    commands.add_parser("verify", help="check every row against its stored checksum")
+    commands.add_parser("compact", help="drop superseded rows (a new row width needs a rebuild from source)")
+    args = parser.parse_args()
+
+    if read_header(args.path or store_path) is None:
+        print(f"No fingerprint store at {args.path or store_path}.")
+        raise SystemExit(1)
+    store = open_store(args.path)
+    if args.command == "info":
+        print(f"{store['path']}: {store['rows']} rows ({len(store['index'])} commits) of {store['dims']} float32 "
+              f"columns, vectorizer {store['vectorizer']}")
+    elif args.command == "verify":
+        corrupt = verify(store)
+        if corrupt:
+            print(f"{len(corrupt)} of {store['rows']} rows fail their checksum (first: row {corrupt[0]}).")
+            raise SystemExit(1)
+        print(f"All {store['rows']} rows match their checksums.")
+    else:
+        before = store["rows"]
+        store = compact(store)
+        print(f"Compacted {before} rows into {store['rows']} rows of {store['dims']} columns.")
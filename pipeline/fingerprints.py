@@ -0,0 +1,204 @@
+import os
+import zlib
+
+import numpy as np
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+import ast_cache
+import baseline
+import fingerprint_store
+import history
+
+fingerprint_store_enabled = os.getenv('FINGERPRINT_STORE', '1') != '0'
+# Width of the message part of stored fingerprints, after random projection.
+projection_dims = int(os.getenv('FINGERPRINT_PROJECTION_DIMS', '256'))
+
+PROJECTION_SEED = 0x5EED
+
+
+def generate_fingerprints(message_matrix, feature_vectors):
+    """
+    Stack the code features onto a TF-IDF message matrix as extra sparse columns.
+    One row per commit; memory grows with the non-zeros, not vocabulary x commits.
+    """
+    rows = message_matrix.shape[0]
+    features = sparse.csr_matrix(np.asarray(feature_vectors, dtype=float).reshape(rows, -1))
+    return sparse.hstack([message_matrix, features], format="csr")
+
+
+def message_counts(state, commits, counts=None):
+    """
+    The count_matrix of the commits' messages, unless it was already taken (see baseline.count_rows).
+    """
+    if counts is not None:
+        return counts
+    return baseline.count_matrix(state, [commit["message"] for commit in commits])
+
+
+def fingerprint_commits(state, commits, feature_vectors=None, workers=None, counts=None):
+    """
+    Fingerprint a batch of commits against a baseline state: one transform over every message.
+    """
+    if feature_vectors is None:
+        feature_vectors = baseline.commit_feature_vectors(commits, workers)
+    message_matrix = baseline.weight_counts(state, message_counts(state, commits, counts))
+    return generate_fingerprints(message_matrix, feature_vectors)
+
+
+def fingerprint_with_vectorizer(commits, vectorizer, feature_vectors=None, workers=None):
+    """
+    Same as fingerprint_commits, for an already fitted sklearn vectorizer.
+    """
+    if feature_vectors is None:
+        feature_vectors = baseline.commit_feature_vectors(commits, workers)
+    message_matrix = vectorizer.transform([commit["message"] for commit in commits])
+    return generate_fingerprints(sparse.csr_matrix(message_matrix), feature_vectors)
+
+
+def mean_fingerprint(matrix):
+    """
+    Mean of the rows, kept sparse (1 x n_features).
+    """
+    rows = matrix.shape[0]
+    weights = sparse.csr_matrix(np.full((1, rows), 1.0 / rows))
+    return weights @ matrix
+
+
+def cosine_similarities(matrix, reference):
+    """
+    Cosine similarity of every row of `matrix` with a single reference row, without densifying.
+    """
+    return cosine_similarity(matrix, reference, dense_output=False).toarray().ravel()
+
+
+def baseline_rows(state, commits, feature_vectors, counts=None):
+    """
+    Each commit's contribution to a running baseline: L2-normalised term frequencies re-weighted
+    with the state's term weights, as fold_commit accumulates them, plus the code features.
+    """
+    counts = message_counts(state, commits, counts)
+    message_matrix = normalize(counts, norm="l2").multiply(baseline.term_weights(state)).tocsr()
+    return generate_fingerprints(message_matrix, feature_vectors)
+
+
+def prefix_similarities(matrix, contributions):
+    """
+    Cosine similarity of every row of `matrix` with the mean of all earlier rows of
+    `contributions`, in one linear pass. The running sum stays dense but only the non-zero
+    columns of each row are touched, and its squared norm is updated incrementally.
+    The first row has nothing to compare against and gets NaN.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    contributions = sparse.csr_matrix(contributions)
+    running_sum = np.zeros(matrix.shape[1])
+    running_norm_sq = 0.0
+    similarities = np.full(matrix.shape[0], np.nan)
+
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        indices, values = matrix.indices[start:end], matrix.data[start:end]
+        row_norm = np.sqrt(np.dot(values, values))
+        if row > 0:
+            denominator = np.sqrt(running_norm_sq) * row_norm
+            similarities[row] = np.dot(running_sum[indices], values) / denominator if denominator > 0 else 0.0
+
+        start, end = contributions.indptr[row], contributions.indptr[row + 1]
+        indices, values = contributions.indices[start:end], contributions.data[start:end]
+        previous = running_sum[indices]
+        running_norm_sq += np.dot(2 * previous + values, values)
+        running_sum[indices] = previous + values
+    return similarities
+
+
+def column_keys(state, columns):
+    """
+    A stable key per message column: the term's CRC32 in tfidf mode, so keys do not depend on
+    the order the vocabulary was built in, and the hashed column itself in hashing mode.
+    """
+    if state["mode"] == "hashing":
+        return np.asarray(columns, dtype=np.uint64)
+    terms = {index: term for term, index in state["vocabulary"].items()}
+    return np.array([zlib.crc32(terms[column].encode("utf-8")) for column in columns], dtype=np.uint64)
+
+
+def projection_signs(keys, dims):
+    """
+    The +1/-1 entries of a random projection for the given column keys, one row per key. Each
+    entry is a hash of (key, output column), so the projection matrix is never stored and new
+    vocabulary terms need nothing precomputed.
+    """
+    with np.errstate(over="ignore"):
+        z = (keys[:, None] << np.uint64(32)) ^ np.arange(dims, dtype=np.uint64)[None, :] ^ np.uint64(PROJECTION_SEED)
+        # splitmix64 finaliser.
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return 1.0 - 2.0 * (z >> np.uint64(63)).astype(float)
+
+
+def project_rows(state, message_matrix, dims=None):
+    """
+    Project sparse message rows to `dims` dense columns. Cosine similarities are preserved in
+    expectation, and only the columns that occur in the batch are ever materialised.
+    """
+    dims = dims or projection_dims
+    message_matrix = sparse.csr_matrix(message_matrix)
+    columns = np.unique(message_matrix.indices)
+    if not len(columns):
+        return np.zeros((message_matrix.shape[0], dims))
+    signs = projection_signs(column_keys(state, columns), dims)
+    return np.asarray(message_matrix[:, columns] @ signs) / np.sqrt(dims)
+
+
+def store_layout(state, dims=None):
+    """
+    (row width, vectorizer tag) of the stored fingerprints for a baseline state.
+    """
+    dims = dims or projection_dims
+    vectorizer = "tfidf" if state["mode"] == "tfidf" else f"hashing-{state['n_features']}"
+    if ast_cache.ast_features_enabled:
+        vectorizer += "-ast"
+    return (len(baseline.FEATURE_MIN) + dims,
+            f"{vectorizer}-rp{dims}-v{baseline.BASELINE_VERSION}-{history.diff_variant()}")
+
+
+def store_vectors(state, commits, feature_vectors, dims=None, counts=None):
+    """
+    Fixed-width dense fingerprints for the store: the code features followed by the commit's
+    baseline contribution (see baseline_rows) projected to `dims` columns.
+    """
+    counts = message_counts(state, commits, counts)
+    message_matrix = normalize(counts, norm="l2").multiply(baseline.term_weights(state)).tocsr()
+    features = np.asarray(feature_vectors, dtype=float).reshape(counts.shape[0], -1)
+    return np.hstack([features, project_rows(state, message_matrix, dims)])
+
+
+def open_commit_store(state, path=None):
+    width, vectorizer = store_layout(state)
+    return fingerprint_store.open_store(path, dims=width, vectorizer=vectorizer)
+
+
+def store_commits(store, state, commits, feature_vectors=None, workers=None, counts=None):
+    """
+    Append the fingerprints of the commits the store does not have yet. With the feature vectors
+    (and optionally the message counts, see baseline.count_rows) given, `commits` only needs
+    the hashes. Returns how many were added.
+    """
+    stored = store["index"]
+    if feature_vectors is None:
+        # The state does not change here, so appending window by window stores the same rows.
+        added = 0
+        for window in history.iter_windows(commit for commit in commits if commit["hash"] not in stored):
+            added += store_commits(store, state, window, baseline.commit_feature_vectors(window, workers))
+            for commit in window:
+                commit.drop_diff()
+        return added
+    keep = [row for row, commit in enumerate(commits) if commit["hash"] not in stored]
+    if keep:
+        fingerprint_store.append(store, [commits[row]["hash"] for row in keep],
+                                 store_vectors(state, [commits[row] for row in keep], [feature_vectors[row] for row in keep],
+                                               counts=None if counts is None else counts[keep]))
+    return len(keep)
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import git
+
+import diff_cache
+import repo_manager
+
+fleet_workers = int(os.getenv('FLEET_WORKERS', str(min(8, os.cpu_count() or 1))))
+fleet_timeout = float(os.getenv('FLEET_TIMEOUT', '900'))
+
+REPORT_FIELDS = [
+    "repo", "status", "elapsed", "head", "message", "similarity", "fingerprint_anomaly",
+    "risk_score", "risk_exceeded", "error",
+]
+
+
+def read_repo_list(paths):
+    """
+    Repositories from the command line; arguments starting with @ are files with one repository
+    per line (# starts a comment).
+    """
+    repos = []
+    for path in paths:
+        if not path.startswith("@"):
+            repos.append(path)
+            continue
+        with open(path[1:], "r") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    repos.append(line)
+    return list(dict.fromkeys(repos))
+
+
+def repo_key(repo):
+    """
+    Stable directory name for a repository's cached state.
+    """
+    name = os.path.basename(repo.rstrip("/")).removesuffix(".git") or "repo"
+    return f"{name}-{hashlib.sha1(repo.encode('utf-8')).hexdigest()[:10]}"
+
+
+def checkout_path(repo, cache_root):
+    """
+    Local paths are scanned in place; remotes (file:// or otherwise) are mirrored under the cache
+    and fetched again on later runs.
+    """
+    if "://" not in repo:
+        return repo
+    return os.path.join(cache_root, "mirrors", repo_key(repo) + ".git")
+
+
+def scan_repository(repo_url, repo_path):
+    """
+    Fingerprint and risk verdicts for the HEAD commit of one repository. Runs inside a worker
+    process whose environment points REPO_PATH and the cache at that repository; a remote is
+    mirrored or fetched there too, so the clone counts against the timeout. A HEAD the CI
+    pipelines skip (see fast_path.skip_commit) is reported as skipped, not scored.
+    """
+    import analyze_commit
+    import fast_path
+    import fingerprint_pipeline
+    import risk_score_pipeline
+
+    if repo_url != repo_path:
+        repo_path = repo_manager.acquire(repo_url, repo_path).git_dir
+    repo = git.Repo(repo_path)
+    head = repo.head.commit
+    result = {"head": head.hexsha, "message": head.message.strip().splitlines()[0] if head.message.strip() else ""}
+    if fast_path.skip_commit(head):
+        return dict(result, status="skipped", similarity=None, fingerprint_anomaly=False, risk_score=None,
+                    risk_exceeded=False)
+    analysis = analyze_commit.analyze(repo)
+
+    result_path = os.path.join(diff_cache.cache_dir, "fleet_result.json")
+    similarity = analysis["similarity"]
+    if analysis["fingerprint_commit"] is None and os.path.exists(result_path):
+        # HEAD is already folded into the baseline; reuse the similarity from the run that scored it.
+        with open(result_path, "r") as f:
+            previous = json.load(f)
+        similarity = previous["similarity"] if previous["head"] == head.hexsha else None
+    risk_score = analysis["risk"]["risk_score"] if analysis["risk"] is not None else None
+    result.update(
+        similarity=similarity,
+        fingerprint_anomaly=similarity is not None and similarity < fingerprint_pipeline.similarity_threshold(),
+        risk_score=risk_score,
+        risk_exceeded=risk_score is not None and risk_score >= risk_score_pipeline.risk_threshold,
+    )
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+    return result
+
+
+def run_scan(repo, cache_root, timeout):
+    """
+    Scan one repository in a child process, so a timeout can stop it, git commands included, and
+    module-level settings (REPO_PATH, cache paths) stay per repository.
+    """
+    started = time.perf_counter()
+    result = {"repo": repo}
+    try:
+        env = dict(
+            os.environ,
+            REPO_URL=repo,
+            REPO_PATH=checkout_path(repo, cache_root),
+            PIPELINE_CACHE_DIR=os.path.join(cache_root, "repos", repo_key(repo)),
+            DIFF_CACHE_PATH=os.path.join(cache_root, "diffs.sqlite"),
+            AST_CACHE_PATH=os.path.join(cache_root, "ast.sqlite"),
+            # The fleet already runs one process per repository.
+            FEATURE_WORKERS="1",
+        )
+        # A session of its own, so a timeout also stops the git processes it started.
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--scan-one"],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True,
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise
+        if process.returncode != 0:
+            error = stderr.strip().splitlines()
+            result.update(status="error", error=error[-1] if error else f"exit code {process.returncode}")
+        else:
+            result.update({"status": "ok", **json.loads(stdout.strip().splitlines()[-1])})
+    except subprocess.TimeoutExpired:
+        result.update(status="timeout", error=f"no result after {timeout:g}s")
+    except (git.GitCommandError, OSError, ValueError) as e:
+        result.update(status="error", error=str(e).strip().splitlines()[-1] if str(e).strip() else repr(e))
+    result["elapsed"] = round(time.perf_counter() - started, 2)
+    return result
+
+
+def scan_fleet(repos, cache_root, workers, timeout):
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_scan, repo, cache_root, timeout) for repo in repos]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            if result["status"] == "skipped":
+                verdict = "skipped (nothing to score)"
+            elif result["status"] != "ok":
+                verdict = f"{result['status']}: {result['error']}"
+            elif result["fingerprint_anomaly"] or result["risk_exceeded"]:
+                verdict = f"anomaly (similarity: {result['similarity']}, risk score: {result['risk_score']})"
+            else:
+                verdict = "ok"
+            print(f"[{done}/{len(repos)}] {result['repo']}: {verdict} ({result['elapsed']}s)", flush=True)
+            results.append(result)
+    order = {repo: position for position, repo in enumerate(repos)}
+    return sorted(results, key=lambda result: order[result["repo"]])
+
+
+def write_report(results, output_path, report_format):
+    with open(output_path, "w", newline="") as f:
+        if report_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows({field: result.get(field) for field in REPORT_FIELDS} for result in results)
+        else:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--scan-one"]:
+        print(json.dumps(scan_repository(os.environ['REPO_URL'], os.environ['REPO_PATH'])))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Scan many repositories concurrently and aggregate the verdicts.")
+    parser.add_argument("repos", nargs="+", help="local paths or remote URLs; @file reads one per line")
+    parser.add_argument("--output", default="fleet_report.json")
+    parser.add_argument("--format", choices=["json", "csv"], default=None,
+                        help="defaults to the output file extension")
+    parser.add_argument("--workers", type=int, default=fleet_workers)
+    parser.add_argument("--timeout", type=float, default=fleet_timeout, help="seconds allowed per repository")
+    parser.add_argument("--cache-dir", default=diff_cache.cache_dir)
+    args = parser.parse_args()
+
+    repos = read_repo_list(args.repos)
+    cache_root = os.path.abspath(args.cache_dir)
+    started = time.perf_counter()
+    results = scan_fleet(repos, cache_root, max(1, args.workers), args.timeout)
+    write_report(results, args.output, args.format or ("csv" if args.output.endswith(".csv") else "json"))
+
+    anomalies = [result for result in results if result["status"] == "ok"
+                 and (result["fingerprint_anomaly"] or result["risk_exceeded"])]
+    skipped = [result for result in results if result["status"] == "skipped"]
+    failures = [result for result in results if result["status"] not in ("ok", "skipped")]
+    print(f"Scanned {len(results)} repositories in {time.perf_counter() - started:.1f}s into {args.output}: "
+          f"{len(anomalies)} with anomalies, {len(skipped)} skipped, {len(failures)} failed or timed out.")
+    sys.exit(1 if anomalies or failures else 0)
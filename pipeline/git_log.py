@@ -0,0 +1,134 @@
+import subprocess
+
+import diff_budget
+
+COMMIT_MARKER = b"\x1e"
+FIELD_SEPARATOR = b"\x1f"
+LOG_FORMAT = "%x1e%H%x1f%an%x1f%ct%x1f%B%x1f"
+HEADER_FIELDS = 4
+
+# -R keeps the orientation of GitPython's commit.diff(parent): the "a" side is the commit
+# itself, so paths and hunks match what the per-commit backend produces. It also swaps the
+# statuses, so --diff-filter=a leaves out the files the commit deletes before git diffs them.
+LOG_ARGS = [
+    "-c", "core.quotepath=off",
+    "log", "--stdin", "--no-walk=unsorted", "-p", "-R", "--diff-filter=a", "--no-prefix",
+    "--diff-merges=first-parent", "--no-color", "--no-ext-diff", f"--format={LOG_FORMAT}",
+]
+
+
+def path_from_diff_header(line):
+    # "diff --git <path> <path>" (--no-prefix), only unambiguous when both sides are the same path.
+    rest = line[len("diff --git "):]
+    half = (len(rest) - 1) // 2
+    if len(rest) % 2 == 1 and rest[half] == " " and rest[:half] == rest[half + 1:]:
+        return rest[:half]
+    return None
+
+
+class FileDiff:
+    __slots__ = ("path", "deleted", "header_done", "sample")
+
+    def __init__(self, header_line, max_bytes=None):
+        self.path = path_from_diff_header(header_line)
+        self.deleted = False
+        self.header_done = False
+        # Diff lines within the file and commit budgets (see diff_budget).
+        self.sample = diff_budget.FileSample(max_bytes)
+
+    def feed_header(self, line, raw_line):
+        if line.startswith("@@") or line.startswith("Binary files "):
+            self.header_done = True
+            if self.path:
+                self.sample.check_path(self.path)
+            self.sample.add(raw_line)
+        elif line == "--- /dev/null":
+            self.deleted = True
+        elif line.startswith("--- "):
+            # git appends a tab to ---/+++ paths that contain spaces.
+            self.path = line[len("--- "):].rstrip("\t")
+        elif line.startswith("rename from ") or line.startswith("copy from "):
+            self.path = line.split(" ", 2)[2]
+
+    def record(self):
+        return self.sample.record(self.path)
+
+
+def parse_log(stream, keep_path):
+    """
+    Incrementally parse `git log -p` output. Yields (sha, files_changed) per commit. Each file
+    keeps at most its share of the commit's diff budget; lines past it are never decoded.
+    """
+    sha = None
+    header = None
+    files_changed = []
+    current = None
+    commit_bytes = 0
+
+    def finish_file():
+        nonlocal commit_bytes
+        if current is not None and not current.deleted and current.path and keep_path(current.path):
+            files_changed.append(current.record())
+            commit_bytes += current.sample.used_bytes()
+
+    for raw_line in stream:
+        if header is not None:
+            header += raw_line
+            if header.count(FIELD_SEPARATOR) < HEADER_FIELDS:
+                continue
+            sha = header[1:header.index(FIELD_SEPARATOR)].decode('ascii')
+            header = None
+            continue
+
+        if raw_line.startswith(COMMIT_MARKER):
+            finish_file()
+            current = None
+            if sha is not None:
+                yield sha, files_changed
+            files_changed = []
+            commit_bytes = 0
+            header = raw_line
+            if header.count(FIELD_SEPARATOR) >= HEADER_FIELDS:
+                sha = header[1:header.index(FIELD_SEPARATOR)].decode('ascii')
+                header = None
+            continue
+
+        if current is not None and current.header_done and not raw_line.startswith(b"diff --git "):
+            current.sample.add(raw_line)
+            continue
+
+        line = diff_budget.decode(raw_line)
+        if line.startswith("diff --git "):
+            finish_file()
+            current = FileDiff(line, diff_budget.commit_max_bytes - commit_bytes)
+        elif current is not None:
+            current.feed_header(line, raw_line)
+
+    finish_file()
+    if sha is not None:
+        yield sha, files_changed
+
+
+def iter_files_changed(git_dir, shas, keep_path=lambda path: path.endswith('.py'), paths=None,
+                       rename_args=("-M",)):
+    """
+    Diff every commit in `shas` against its first parent with a single `git log` process.
+    Yields (sha, files_changed) in the order the commits were given. With `paths`, git only diffs
+    matching files and commits that touch none of them are not yielded at all.
+    """
+    process = subprocess.Popen(
+        ["git", "--git-dir", git_dir] + LOG_ARGS + list(rename_args) + (["--"] + paths if paths else []),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    # git reads the whole revision list before it starts writing, so this cannot deadlock.
+    process.stdin.write("".join(sha + "\n" for sha in shas).encode('ascii'))
+    process.stdin.close()
+    try:
+        yield from parse_log(process.stdout, keep_path)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, "git log", stderr=stderr)
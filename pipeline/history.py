@@ -0,0 +1,318 @@
+import itertools
+import os
+import subprocess
+from collections import Counter
+
+import git
+from git.util import hex_to_bin
+
+import ast_cache
+import diff_budget
+import diff_cache
+import git_log
+import metrics
+import repo_manager
+
+# "git-log" streams every missing diff out of one git process; "gitpython" diffs commit by commit.
+history_backend = os.getenv('HISTORY_BACKEND', 'git-log')
+# Commits whose diffs the streaming walks hold at once (see iter_windows).
+history_window = int(os.getenv('HISTORY_WINDOW', '1000'))
+
+
+class CommitRecord:
+    """
+    One commit as the pipelines see it, read like the dicts it replaces (record["message"],
+    record.get("ast", {})). Records from iter_commit_records start with only the metadata and
+    the message: the diff payload, files_changed, is loaded on first use (in batches by
+    iter_windows) and drop_diff() releases it, and the message, again once the commit's features
+    are computed. Both are reloaded from git if they are needed after that; the subject line
+    always stays.
+    """
+    __slots__ = ("hash", "author", "subject", "date", "_message", "_ast", "_files_changed", "_source")
+    KEYS = ("hash", "author", "subject", "message", "date", "files_changed", "ast")
+
+    def __init__(self, sha, author, message, date, files_changed=None, ast=None, source=None):
+        self.hash = sha
+        self.author = author
+        self.subject = message.strip().splitlines()[0] if message.strip() else ""
+        self.date = date
+        self._message = message
+        self._ast = ast
+        self._files_changed = files_changed
+        # {"repo", "cache"} the diff is loaded from; None when it was given up front.
+        self._source = source
+
+    @property
+    def message(self):
+        if self._message is None:
+            self._message = git.Commit(self._source["repo"], hex_to_bin(self.hash)).message
+        return self._message
+
+    @property
+    def files_changed(self):
+        if self._files_changed is None:
+            if self._source is None:
+                raise ValueError(f"The diff of commit {self.hash} was dropped and cannot be reloaded")
+            load_diffs([self])
+        return self._files_changed
+
+    @property
+    def ast(self):
+        if self._ast is None and ast_cache.ast_features_enabled and self._source is not None:
+            load_diffs([self])
+        return self._ast
+
+    def diff_loaded(self):
+        return self._files_changed is not None
+
+    def drop_diff(self):
+        """
+        Release the diff text and the message, if they can be loaded again. The AST features are
+        small and stay.
+        """
+        if self._source is not None:
+            self._files_changed = None
+            self._message = None
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __reduce__(self):
+        # Worker processes get the loaded diff, not the repository handle.
+        return CommitRecord, (self.hash, self.author, self.message, self.date, self.files_changed, self.ast)
+
+    def __repr__(self):
+        return f"CommitRecord({self.hash[:12]}, diff {'loaded' if self.diff_loaded() else 'not loaded'})"
+
+
+def extract_files_changed(commit):
+    """
+    Diff a commit against its first parent and keep the selected files it adds or modifies (see
+    repo_manager.DIFF_PATHSPEC), within the diff budgets. Root commits are diffed against the
+    empty tree so the result only depends on the commit itself.
+    """
+    # "-M" -> M=True, "--no-renames" -> no_renames=True.
+    options = {arg.lstrip("-").replace("-", "_"): True for arg in repo_manager.rename_args()}
+    if commit.parents:
+        # The commit is the "a" side, so files it deletes have status "A" and are never diffed.
+        diffs = commit.diff(commit.parents[0], paths=repo_manager.DIFF_PATHSPEC, create_patch=True,
+                            diff_filter="a", **options)
+    else:
+        # GitPython puts the empty tree on the "a" side; -R restores the orientation used for parents.
+        diffs = commit.diff(git.NULL_TREE, paths=repo_manager.DIFF_PATHSPEC, create_patch=True, R=True, **options)
+
+    files_changed = []
+    used_bytes = 0
+    for diff in diffs:
+        # a_path is the path in the commit; it is None for files the commit deletes.
+        if diff.a_path and repo_manager.selected_path(diff.a_path):
+            sample = diff_budget.FileSample(diff_budget.commit_max_bytes - used_bytes)
+            sample.check_path(diff.a_path)
+            for raw_line in diff.diff.splitlines(keepends=True):
+                sample.add(raw_line)
+            files_changed.append(sample.record(diff.a_path))
+            used_bytes += sample.used_bytes()
+    return files_changed
+
+
+def extract_many(commits):
+    """
+    Diff several commits, preferring a single streamed `git log -p` over per-commit diffs.
+    """
+    if history_backend == 'git-log':
+        try:
+            git_dir = commits[0].repo.git_dir
+            shas = [commit.hexsha for commit in commits]
+            # git only reads and diffs the selected paths; in a partial clone they are also the
+            # only blobs that were fetched.
+            files_by_sha = dict(git_log.iter_files_changed(
+                git_dir, shas, keep_path=repo_manager.selected_path, paths=repo_manager.DIFF_PATHSPEC,
+                rename_args=repo_manager.rename_args()))
+            return {sha: files_by_sha.get(sha, []) for sha in shas}
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"git log extraction failed ({e}); falling back to per-commit diffs.")
+    return {commit.hexsha: extract_files_changed(commit) for commit in commits}
+
+
+def diff_variant():
+    """
+    Cache variant for the current settings: records extracted with other path globs, rename
+    detection or diff budgets differ, so they are cached separately.
+    """
+    return f"{diff_cache.DIFF_VARIANT}-{repo_manager.selection_tag()}-{diff_budget.config_tag()}"
+
+
+def load_files_changed(commits, cache=None):
+    """
+    Return {sha: files_changed} for the given commits, diffing only the ones missing from the cache.
+    Files the diff budgets skipped (generated, vendored, over the commit budget) are left out;
+    sampled ones stay, marked with their "budget".
+    """
+    with metrics.stage("history_extraction"):
+        shas = [commit.hexsha for commit in commits]
+        variant = diff_variant()
+        files_by_sha = diff_cache.get_many(cache, shas, variant) if cache is not None else {}
+
+        missing = [commit for commit in commits if commit.hexsha not in files_by_sha]
+        if missing:
+            files_by_sha.update(extract_many(missing))
+            extracted = [files_by_sha[commit.hexsha] for commit in missing]
+            metrics.count("commits_extracted", len(missing))
+            metrics.count("files_extracted", sum(len(files_changed) for files_changed in extracted))
+            metrics.count("diff_bytes_extracted", sum(metrics.diff_bytes(files_changed) for files_changed in extracted))
+            report_degraded({commit.hexsha: files_by_sha[commit.hexsha] for commit in missing})
+
+        if cache is not None:
+            metrics.cache_lookup("diff_cache", len(shas) - len(missing), len(missing))
+            if missing:
+                diff_cache.put_many(cache, ((commit.hexsha, files_by_sha[commit.hexsha]) for commit in missing), variant)
+        return {sha: kept_files(files_changed) for sha, files_changed in files_by_sha.items()}
+
+
+def kept_files(files_changed):
+    """
+    The files whose diffs feed the features: all but those the diff budgets skipped.
+    """
+    return [file for file in files_changed if not diff_budget.is_skipped(file)]
+
+
+def report_degraded(files_by_sha):
+    """
+    Record every newly extracted file the diff budgets sampled or skipped (see metrics).
+    """
+    degraded = diff_budget.degraded_files(files_by_sha)
+    for sha, path, budget in degraded:
+        metrics.degraded_file(sha, path, budget)
+    if degraded:
+        reasons = Counter(budget["reason"] for _, _, budget in degraded)
+        print("Diff budgets: " + ", ".join(f"{count} {reason}" for reason, count in sorted(reasons.items())) + " files.")
+
+
+def iter_shas(repo, rev='HEAD'):
+    """
+    The SHAs of the commits of rev the pipelines score, oldest first, streamed from one
+    `git rev-list --reverse`; #no_anomaly commits are left out by git. `rev` is a revision or a
+    list of them (e.g. [head, "^base"]).
+    """
+    revs = [rev] if isinstance(rev, str) else list(rev)
+    process = subprocess.Popen(
+        ["git", "--git-dir", repo.git_dir, "rev-list", "--reverse", "--invert-grep", "--fixed-strings",
+         "--grep=#no_anomaly"] + revs + ["--"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    try:
+        for line in process.stdout:
+            yield line.rstrip("\n")
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise git.GitCommandError(["git", "rev-list"] + revs, returncode, stderr)
+
+
+def iter_commits(repo, rev='HEAD'):
+    """
+    The commits of rev the pipelines score, oldest first (see iter_shas), instead of reversing a
+    list of the whole history.
+    """
+    for sha in iter_shas(repo, rev):
+        yield git.Commit(repo, hex_to_bin(sha))
+
+
+def records_for(repo, shas, cache=None):
+    """
+    A metadata-only CommitRecord (see iter_commit_records) for each SHA of a stream, as it is read.
+    """
+    source = {"repo": repo, "cache": cache if cache is not None else diff_cache.open_cache()}
+    for sha in shas:
+        commit = git.Commit(repo, hex_to_bin(sha))
+        yield CommitRecord(sha, commit.author.name, commit.message, commit.committed_date, source=source)
+
+
+def iter_commit_records(repo, rev='HEAD', cache=None):
+    """
+    A CommitRecord for every commit of iter_commits, holding only its metadata and message; the
+    diffs are loaded on demand from the diff cache (or git), see iter_windows. `repo` is a path
+    or a Repo.
+    """
+    if not isinstance(repo, git.Repo):
+        repo = git.Repo(repo)
+    return records_for(repo, iter_shas(repo, rev), cache)
+
+
+def load_diffs(records):
+    """
+    Load the diffs (and with AST_FEATURES=1 the AST features) of the records that do not have
+    them, in one batch per repository.
+    """
+    missing = [record for record in records if record._source is not None
+               and (record._files_changed is None or (record._ast is None and ast_cache.ast_features_enabled))]
+    for _, group in itertools.groupby(missing, key=lambda record: id(record._source)):
+        group = list(group)
+        source = group[0]._source
+        unloaded = [record.hash for record in group if record._files_changed is None]
+        files_by_sha = {}
+        if unloaded:
+            files_by_sha = load_files_changed([source["repo"].commit(sha) for sha in unloaded], source["cache"])
+        ast_by_sha = {}
+        if ast_cache.ast_features_enabled:
+            ast_by_sha = ast_cache.commit_deltas(source["repo"].git_dir,
+                                                 [record.hash for record in group if record._ast is None])
+        for record in group:
+            if record.hash in files_by_sha:
+                record._files_changed = files_by_sha[record.hash]
+            if record.hash in ast_by_sha:
+                record._ast = ast_by_sha[record.hash]
+    return records
+
+
+def iter_windows(records, size=None):
+    """
+    Split records (any iterable, oldest first) into lists of at most HISTORY_WINDOW commits
+    with their diffs loaded. Callers drop_diff() each record once its features are computed, so
+    only the window in flight holds diff text.
+    """
+    records = iter(records)
+    size = size or history_window
+    while True:
+        window = list(itertools.islice(records, size))
+        if not window:
+            return
+        yield load_diffs(window)
+
+
+def get_commit_data(repo_path, rev='HEAD', cache=None):
+    """
+    Extract commit metadata and modified file content, oldest commit first. The diffs of the
+    whole range are loaded; the streaming pipelines use iter_commit_records instead.
+    """
+    return load_diffs(list(iter_commit_records(repo_path, rev, cache)))
+
+
+def commit_records(commits, files_by_sha):
+    """
+    The records the pipelines work on, for already loaded diffs. With AST_FEATURES=1 each also
+    gets the AST features of its changed files under "ast".
+    """
+    ast_by_sha = {}
+    if ast_cache.ast_features_enabled and commits:
+        ast_by_sha = ast_cache.commit_deltas(commits[0].repo.git_dir, [commit.hexsha for commit in commits])
+    return [CommitRecord(commit.hexsha, commit.author.name, commit.message, commit.committed_date,
+                         files_by_sha[commit.hexsha], ast_by_sha.get(commit.hexsha))
+            for commit in commits]
@@ -0,0 +1,128 @@
+import json
+import os
+import re
+from collections import Counter
+
+keywords_path = os.getenv('RISK_KEYWORDS_PATH', '')
+
+WORD_PATTERN = re.compile(r'\w+')
+TOKEN_CACHE_LIMIT = 100000
+
+
+def tokenize(text):
+    return Counter(WORD_PATTERN.findall(text))
+
+
+class KeywordMatcher:
+    """
+    Finds a fixed set of keywords in one scan of the text, whatever the number of keywords.
+
+    The text is tokenised once into word counts. Whole-word keywords are dictionary lookups on
+    those counts. Substring keywords run through an Aho-Corasick automaton over each distinct
+    token, memoised across calls. Keywords that contain non-word characters cannot sit inside
+    a single token, so they go through one combined regex instead.
+    """
+
+    def __init__(self, keywords, whole_words=False, ignore_case=False):
+        self.whole_words = whole_words
+        self.ignore_case = ignore_case
+        keywords = dict.fromkeys(self.normalize(keyword) for keyword in keywords if keyword)
+        self.keywords = list(keywords)
+        self.word_keywords = {keyword for keyword in self.keywords if WORD_PATTERN.fullmatch(keyword)}
+        phrases = [keyword for keyword in self.keywords if keyword not in self.word_keywords]
+        self.phrase_pattern = None
+        if phrases:
+            alternatives = "|".join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True))
+            boundary = r"\b" if whole_words else ""
+            self.phrase_pattern = re.compile(f"{boundary}(?:{alternatives}){boundary}")
+        if not whole_words:
+            self.build_automaton(self.word_keywords)
+        self.token_hits = {}
+
+    def normalize(self, text):
+        return text.lower() if self.ignore_case else text
+
+    def build_automaton(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state] += (keyword,)
+
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def hits_in_token(self, token):
+        hits = self.token_hits.get(token)
+        if hits is not None:
+            return hits
+        found = Counter()
+        state = 0
+        for char in self.normalize(token):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for keyword in self.output[state]:
+                found[keyword] += 1
+        if len(self.token_hits) >= TOKEN_CACHE_LIMIT:
+            self.token_hits.clear()
+        self.token_hits[token] = found
+        return found
+
+    def count_tokens(self, token_counts, text=""):
+        """
+        Keyword occurrence counts from a tokenize() result (and the raw text, for phrase keywords).
+        """
+        counts = Counter()
+        if self.whole_words:
+            if self.ignore_case:
+                lowered_counts = Counter()
+                for token, occurrences in token_counts.items():
+                    lowered_counts[token.lower()] += occurrences
+                token_counts = lowered_counts
+            for keyword in self.word_keywords:
+                occurrences = token_counts.get(keyword, 0)
+                if occurrences:
+                    counts[keyword] += occurrences
+        elif self.word_keywords:
+            for token, occurrences in token_counts.items():
+                for keyword, hits in self.hits_in_token(token).items():
+                    counts[keyword] += hits * occurrences
+        if self.phrase_pattern is not None and text:
+            counts.update(self.phrase_pattern.findall(self.normalize(text)))
+        return counts
+
+    def count(self, text):
+        return self.count_tokens(tokenize(text), text)
+
+    def find(self, text):
+        return set(self.count(text))
+
+
+def load_keywords(path=None):
+    """
+    Extra keywords from a JSON file such as
+    {"sensitive_keywords": ["aws_secret", "BEGIN RSA PRIVATE KEY"], "complexity_indicators": ["elif"]}.
+    They are added to the built-in lists.
+    """
+    path = path or keywords_path
+    if not path:
+        return {}
+    with open(path, "r") as f:
+        config = json.load(f)
+    return {key: list(values) for key, values in config.items()}
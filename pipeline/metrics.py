@@ -0,0 +1,210 @@
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import diff_cache
+
+metrics_dir = os.getenv('METRICS_DIR', os.path.join(diff_cache.cache_dir, 'metrics'))
+profile_enabled = os.getenv('PIPELINE_PROFILE', '0') == '1'
+PROFILE_TOP = 30
+
+# Process-wide registry; every module records into it and the entry point exports it once.
+stage_seconds = Counter()
+stage_calls = Counter()
+counters = Counter()
+# Files whose diff was sampled or skipped by the diff budgets, as reported by history.
+degraded_files = []
+started_at = time.time()
+
+
+@contextmanager
+def stage(name):
+    """
+    Add the wall time of the block to the stage. Nested and repeated stages simply accumulate.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds[name] += time.perf_counter() - start
+        stage_calls[name] += 1
+
+
+def count(name, value=1):
+    counters[name] += value
+
+
+def cache_lookup(cache, hits, misses):
+    counters[f"{cache}_hits"] += hits
+    counters[f"{cache}_misses"] += misses
+
+
+def degraded_file(sha, path, budget):
+    counters["files_" + ("skipped" if budget["skipped"] else "sampled")] += 1
+    degraded_files.append({"commit": sha, "file_path": path, **budget})
+
+
+def diff_bytes(files_changed):
+    return sum(len(file["diff"]) for file in files_changed)
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process and of its finished children (worker pools, git).
+    """
+    try:
+        import resource
+    except ImportError:
+        return {}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def summary(pipeline):
+    cache_hit_rates = {}
+    for name in counters:
+        if name.endswith("_hits"):
+            cache = name[:-len("_hits")]
+            lookups = counters[name] + counters[f"{cache}_misses"]
+            cache_hit_rates[cache] = counters[name] / lookups if lookups else None
+    return {
+        "pipeline": pipeline,
+        "started_at": started_at,
+        "stages": {name: {"seconds": seconds, "calls": stage_calls[name]} for name, seconds in stage_seconds.items()},
+        "counters": dict(counters),
+        "cache_hit_rates": cache_hit_rates,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "degraded_files": degraded_files,
+    }
+
+
+def prometheus_text(result):
+    """
+    The summary in the Prometheus text exposition format, for the node_exporter textfile collector.
+    """
+    label = f'pipeline="{result["pipeline"]}"'
+    lines = [
+        "# HELP pipeline_stage_seconds Wall time spent in each pipeline stage during the last run.",
+        "# TYPE pipeline_stage_seconds gauge",
+    ]
+    lines += [f'pipeline_stage_seconds{{{label},stage="{name}"}} {values["seconds"]:.6f}'
+              for name, values in sorted(result["stages"].items())]
+    lines += [
+        "# HELP pipeline_items Items processed during the last run (commits, files, diff bytes, cache lookups).",
+        "# TYPE pipeline_items gauge",
+    ]
+    lines += [f'pipeline_items{{{label},item="{name}"}} {value}' for name, value in sorted(result["counters"].items())]
+    lines += [
+        "# HELP pipeline_cache_hit_ratio Share of cache lookups that hit during the last run.",
+        "# TYPE pipeline_cache_hit_ratio gauge",
+    ]
+    lines += [f'pipeline_cache_hit_ratio{{{label},cache="{name}"}} {ratio:.6f}'
+              for name, ratio in sorted(result["cache_hit_rates"].items()) if ratio is not None]
+    lines += [
+        "# HELP pipeline_peak_rss_bytes Peak resident set size during the last run.",
+        "# TYPE pipeline_peak_rss_bytes gauge",
+    ]
+    lines += [f'pipeline_peak_rss_bytes{{{label},process="{name}"}} {value}'
+              for name, value in sorted(result["peak_rss_bytes"].items())]
+    lines += [
+        "# HELP pipeline_last_run_timestamp_seconds Start time of the last run.",
+        "# TYPE pipeline_last_run_timestamp_seconds gauge",
+        f"pipeline_last_run_timestamp_seconds{{{label}}} {result['started_at']:.0f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_atomic(path, text):
+    # The textfile collector may read at any time, so never expose a half-written file.
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def export(pipeline, directory=None):
+    """
+    Write <pipeline>.json and <pipeline>.prom to the metrics directory.
+    """
+    directory = directory or metrics_dir
+    result = summary(pipeline)
+    write_atomic(os.path.join(directory, f"{pipeline}.json"), json.dumps(result, indent=2))
+    write_atomic(os.path.join(directory, f"{pipeline}.prom"), prometheus_text(result))
+    return result
+
+
+def print_breakdown(result):
+    total = result["stages"].get("total", {}).get("seconds")
+    for name, values in sorted(result["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        share = f" {values['seconds'] / total:6.1%}" if total else ""
+        print(f"{name:>22} {values['seconds'] * 1000:10.1f}ms{share}  ({values['calls']} calls)")
+    for name, value in sorted(result["counters"].items()):
+        print(f"{name:>22} {value}")
+    for name, value in result["peak_rss_bytes"].items():
+        print(f"{'peak rss ' + name:>22} {value / 2 ** 20:.1f} MiB")
+
+
+@contextmanager
+def profiled(prefix):
+    """
+    Run the block under cProfile and tracemalloc, then write <prefix>.prof (pstats data),
+    <prefix>.txt (top functions by cumulative time) and <prefix>.mem.txt (top allocation sites).
+    """
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(prefix + ".prof")
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(prefix + ".txt", "w") as f:
+            f.write(report.getvalue())
+        with open(prefix + ".mem.txt", "w") as f:
+            f.write(f"Peak traced memory: {peak_traced / 2 ** 20:.1f} MiB\n")
+            for statistic in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                f.write(f"{statistic}\n")
+        print(f"Profile written to {prefix}.prof, {prefix}.txt and {prefix}.mem.txt.")
+
+
+def run_main(pipeline, main):
+    """
+    Run an entry point's main(), timed as the "total" stage, and export the metrics afterwards.
+    `--profile` (removed from sys.argv before main sees it) or PIPELINE_PROFILE=1 also profiles
+    the run and prints the stage breakdown.
+    """
+    profile = profile_enabled or "--profile" in sys.argv
+    sys.argv = [arg for arg in sys.argv if arg != "--profile"]
+    exit_code = 1
+    try:
+        if profile:
+            with profiled(os.path.join(metrics_dir, f"{pipeline}.profile")), stage("total"):
+                exit_code = main()
+        else:
+            with stage("total"):
+                exit_code = main()
+    finally:
+        result = export(pipeline)
+        if profile:
+            print_breakdown(result)
+    return exit_code
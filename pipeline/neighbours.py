@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+
+import fingerprint_store
+
+knn_k = int(os.getenv('KNN_K', '10'))
+# "lsh" looks neighbours up in random-hyperplane hash buckets; "exact" compares the commit with
+# every stored fingerprint and is the reference for accuracy checks.
+knn_index = os.getenv('KNN_INDEX', 'lsh')
+lsh_tables = int(os.getenv('LSH_TABLES', '16'))
+# Hyperplanes per table; by default about log2(rows) - 1, so buckets stay small as history grows.
+lsh_bits = int(os.getenv('LSH_BITS', '0'))
+
+LSH_SEED = 7
+# Rows added after the buckets were sorted are compared exhaustively until there are this many.
+MAX_UNSORTED = 4096
+# Rows read from the memory-mapped store at a time by the exhaustive scan.
+SCAN_CHUNK = 65536
+
+
+def unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def new_index(dims, tables=None, bits=None):
+    """
+    An empty LSH index for cosine similarity: `tables` hash tables, each keyed by the signs of
+    the row against `bits` random hyperplanes. The buckets of all tables live in one sorted array
+    of (table, code) keys, so every probe of a query is answered by a single binary search.
+    """
+    tables = tables or lsh_tables
+    bits = bits or lsh_bits or 12
+    planes = np.random.default_rng(LSH_SEED).standard_normal((dims, tables * bits)).astype(np.float32)
+    return {
+        "tables": tables,
+        "bits": bits,
+        "planes": planes,
+        # Preallocated and doubled when full, so adding one row at a time stays amortised O(1);
+        # only the first len(shas) rows are in use.
+        "vectors": np.empty((1024, dims), dtype=np.float32),
+        "codes": np.empty((1024, tables), dtype=np.int64),
+        "shas": [],
+        "rows_by_sha": {},
+        # Rows below `sorted` are in the sorted bucket keys; later ones are scanned.
+        "sorted": 0,
+        "keys": np.empty(0, dtype=np.int64),
+        "order": np.empty(0, dtype=np.int64),
+    }
+
+
+def hash_codes(index, vectors):
+    """
+    One bucket key per row and table: the table number in the high bits, the hyperplane signs
+    in the low `bits` bits.
+    """
+    signs = (np.atleast_2d(vectors) @ index["planes"]) > 0
+    powers = np.left_shift(1, np.arange(index["bits"], dtype=np.int64))
+    codes = signs.reshape(-1, index["tables"], index["bits"]) @ powers
+    return codes | np.left_shift(np.arange(index["tables"], dtype=np.int64), index["bits"])
+
+
+def sort_buckets(index):
+    keys = index["codes"][:len(index["shas"])].ravel()
+    order = np.argsort(keys)
+    index["keys"] = keys[order]
+    index["order"] = order // index["tables"]
+    index["sorted"] = len(index["shas"])
+
+
+def add(index, shas, vectors):
+    """
+    Add fingerprints to the index. They are searchable at once; the buckets are re-sorted only
+    when MAX_UNSORTED rows have accumulated, so adding one commit stays cheap.
+    """
+    vectors = unit_rows(vectors).reshape(len(shas), -1)
+    start, end = len(index["shas"]), len(index["shas"]) + len(shas)
+    if end > len(index["vectors"]):
+        capacity = max(end, 2 * len(index["vectors"]))
+        for name in ("vectors", "codes"):
+            grown = np.empty((capacity,) + index[name].shape[1:], dtype=index[name].dtype)
+            grown[:start] = index[name][:start]
+            index[name] = grown
+    index["vectors"][start:end] = vectors
+    index["codes"][start:end] = hash_codes(index, vectors)
+    for row, sha in enumerate(shas, start=start):
+        index["rows_by_sha"][sha] = row
+    index["shas"].extend(shas)
+    if end - index["sorted"] > MAX_UNSORTED:
+        sort_buckets(index)
+
+
+def index_store(store, tables=None, bits=None, shas=None):
+    """
+    An index over the store's live rows (the newest row of every SHA), optionally only those of
+    the given SHAs.
+    """
+    live = sorted((row, sha) for sha, row in store["index"].items() if shas is None or sha in shas)
+    index = new_index(store["dims"], tables, bits or lsh_bits or default_bits(len(live)))
+    add(index, [sha for _, sha in live], fingerprint_store.matrix(store)[[row for row, _ in live]])
+    if index["sorted"] < len(index["shas"]):
+        sort_buckets(index)
+    return index
+
+
+def default_bits(rows):
+    return int(np.clip(np.round(np.log2(max(rows, 1))) - 1, 8, 18))
+
+
+def candidate_rows(index, vector):
+    """
+    Rows sharing a bucket with `vector` in any table, also probing the buckets one flipped bit
+    away, plus every row added since the buckets were last sorted.
+    """
+    flips = np.concatenate([[0], np.left_shift(1, np.arange(index["bits"], dtype=np.int64))])
+    probes = np.sort((hash_codes(index, vector)[0][:, None] ^ flips[None, :]).ravel())
+    starts = np.searchsorted(index["keys"], probes, side="left")
+    lengths = np.searchsorted(index["keys"], probes, side="right") - starts
+    # Positions of every bucket entry, without a Python loop over the buckets.
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    rows = np.sort(np.concatenate([index["order"][offsets], np.arange(index["sorted"], len(index["shas"]))]))
+    # Sort and drop neighbours rather than np.unique, which is several times slower on small arrays.
+    return rows[np.concatenate([[True], rows[1:] != rows[:-1]])] if len(rows) else rows
+
+
+def nearest(index, vector, k=None, exclude=None, mode=None):
+    """
+    The k most similar indexed fingerprints to `vector`, as (shas, cosine similarities), most
+    similar first. `exclude` is a SHA to leave out, usually the commit being scored. When the
+    buckets hold fewer than k candidates, every row is compared.
+    """
+    k = k or knn_k
+    vector = unit_rows(vector).ravel()
+    rows = candidate_rows(index, vector) if (mode or knn_index) == "lsh" else None
+    excluded = index["rows_by_sha"].get(exclude)
+    if rows is not None and excluded is not None:
+        rows = rows[rows != excluded]
+    if rows is None or len(rows) < k:
+        rows = np.arange(len(index["shas"]))
+        if excluded is not None:
+            rows = rows[rows != excluded]
+        similarities = (index["vectors"][:len(index["shas"])] @ vector)[rows]
+    else:
+        similarities = index["vectors"][rows] @ vector
+    top = np.argpartition(-similarities, k - 1)[:k] if len(rows) > k else np.arange(len(rows))
+    top = top[np.argsort(-similarities[top], kind="stable")]
+    return [index["shas"][row] for row in rows[top]], similarities[top]
+
+
+def similarity(index, sha, k=None, mode=None):
+    """
+    Mean cosine similarity of a stored commit to its k nearest other commits, or None when
+    nothing else is indexed.
+    """
+    if len(index["shas"]) < 2:
+        return None
+    vector = index["vectors"][index["rows_by_sha"][sha]]
+    _, similarities = nearest(index, vector, k, exclude=sha, mode=mode)
+    return float(np.mean(similarities))
+
+
+def store_nearest(store, vector, k=None, exclude=None):
+    """
+    Exact k nearest stored fingerprints, as (shas, cosine similarities), reading the store in
+    chunks. For a single query this is cheaper than building an index first: the live rows and
+    row norms are read from files kept next to the store, and only the k results are looked up.
+    """
+    k = k or knn_k
+    vector = unit_rows(vector).ravel()
+    live = fingerprint_store.live_rows(store)
+    if exclude in store["index"]:
+        live = live[live != store["index"][exclude]]
+    data = fingerprint_store.matrix(store)
+    norms = fingerprint_store.row_norms(store)
+    best_rows, best = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    for start in range(0, len(live), SCAN_CHUNK):
+        rows = live[start:start + SCAN_CHUNK]
+        # Without superseded rows the chunk is one slice of the memory map, read without a copy.
+        contiguous = rows[-1] - rows[0] + 1 == len(rows)
+        chunk = data[rows[0]:rows[-1] + 1] if contiguous else data[rows]
+        chunk_norms = norms[rows[0]:rows[-1] + 1] if contiguous else norms[rows]
+        best_rows = np.concatenate([best_rows, rows])
+        best = np.concatenate([best, (chunk @ vector) / np.where(chunk_norms > 0, chunk_norms, 1)])
+        if len(best) > k:
+            top = np.argpartition(-best, k - 1)[:k]
+            best_rows, best = best_rows[top], best[top]
+    order = np.argsort(-best, kind="stable")
+    return fingerprint_store.shas_at(store, best_rows[order]), best[order]
+
+
+def store_similarity(store, sha, k=None):
+    """
+    Same as similarity(), with an exact scan of the store instead of an index.
+    """
+    if sha not in store["index"] or len(store["index"]) < 2:
+        return None
+    vector = fingerprint_store.matrix(store)[store["index"][sha]]
+    _, similarities = store_nearest(store, vector, k, exclude=sha)
+    return float(np.mean(similarities))
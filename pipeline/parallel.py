@@ -0,0 +1,38 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+feature_workers = int(os.getenv('FEATURE_WORKERS', '0'))
+# Below this many commits the process pool costs more than it saves.
+parallel_min_commits = int(os.getenv('PARALLEL_MIN_COMMITS', '200'))
+CHUNKS_PER_WORKER = 4
+
+
+def configured_workers(argv=None):
+    """
+    Worker count from `--workers N` on the command line, then FEATURE_WORKERS, then the CPU count.
+    """
+    argv = sys.argv if argv is None else argv
+    for i, arg in enumerate(argv):
+        if arg == "--workers" and i + 1 < len(argv):
+            return max(1, int(argv[i + 1]))
+        if arg.startswith("--workers="):
+            return max(1, int(arg.split("=", 1)[1]))
+    return feature_workers if feature_workers > 0 else (os.cpu_count() or 1)
+
+
+def map_ordered(func, items, workers=None):
+    """
+    Apply func to every item, in chunks across a process pool when there are enough items.
+    Results come back in input order, so the output is the same as the serial loop.
+    func must be a module-level function so it can be pickled.
+    """
+    items = list(items)
+    if workers is None:
+        workers = configured_workers()
+    if workers <= 1 or len(items) < parallel_min_commits:
+        return [func(item) for item in items]
+
+    chunksize = max(1, len(items) // (workers * CHUNKS_PER_WORKER))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items, chunksize=chunksize))
@@ -0,0 +1,204 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import zlib
+
+import git
+
+import diff_cache
+import metrics
+
+mirror_dir = os.getenv('REPO_MIRROR_DIR', os.path.join(diff_cache.cache_dir, 'mirrors'))
+# "blob:none" clones commits and trees only; the blobs we diff are fetched afterwards in one batch.
+# Set to an empty string for full clones.
+clone_filter = os.getenv('CLONE_FILTER', 'blob:none')
+# Optional scoring window: only this many commits, or only commits after this date, are fetched.
+clone_depth = int(os.getenv('CLONE_DEPTH', '0'))
+clone_since = os.getenv('CLONE_SHALLOW_SINCE', '')
+
+# Comma-separated globs of the paths that are scored, and of paths left out of them (for example
+# "tests/*,migrations/*"). As in git pathspecs, * also matches /.
+diff_include = [glob for glob in os.getenv('DIFF_INCLUDE', '*.py').split(',') if glob]
+diff_exclude = [glob for glob in os.getenv('DIFF_EXCLUDE', '').split(',') if glob]
+# "renames" (-M), "copies" (-C, also copies from files changed in the same commit) or "off".
+rename_detection = os.getenv('DIFF_RENAMES', 'renames')
+
+# The only paths whose contents the pipelines read, passed to every git command that diffs.
+DIFF_PATHSPEC = diff_include + [f":(exclude){glob}" for glob in diff_exclude]
+RENAME_ARGS = {"renames": ["-M"], "copies": ["-M", "-C"], "off": ["--no-renames"]}
+
+
+def selected_path(path):
+    """
+    Whether a path is scored: the same selection as DIFF_PATHSPEC, for output git did not filter.
+    """
+    return (any(fnmatch.fnmatchcase(path, glob) for glob in diff_include)
+            and not any(fnmatch.fnmatchcase(path, glob) for glob in diff_exclude))
+
+
+def rename_args():
+    if rename_detection not in RENAME_ARGS:
+        raise ValueError(f"Unknown DIFF_RENAMES setting: {rename_detection}")
+    return RENAME_ARGS[rename_detection]
+
+
+def selection_tag():
+    """
+    Short tag of the path selection and rename detection, for cache keys.
+    """
+    settings = [diff_include, diff_exclude, rename_detection]
+    return f"p{zlib.crc32(json.dumps(settings).encode('utf-8')):08x}"
+
+
+def mirror_path(url):
+    """
+    Default location of the mirror for a remote, under the pipeline cache.
+    """
+    name = os.path.basename(url.rstrip("/")).removesuffix(".git") or "repo"
+    return os.path.join(mirror_dir, f"{name}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]}.git")
+
+
+def shallow_args(depth=None, since=None):
+    depth = clone_depth if depth is None else depth
+    since = clone_since if since is None else since
+    if depth:
+        return {"depth": depth}
+    if since:
+        return {"shallow_since": since}
+    return {}
+
+
+def is_partial(git_dir):
+    """
+    Whether the repository is a partial clone, so missing blobs would be fetched one at a time.
+    """
+    try:
+        value = subprocess.run(["git", "--git-dir", git_dir, "config", "--get", "remote.origin.promisor"],
+                               capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return False
+    return value == "true"
+
+
+def is_mirror(repo):
+    try:
+        return repo.git.config("--get", "remote.origin.mirror").strip() == "true"
+    except git.GitCommandError:
+        return False
+
+
+def prefetch_blobs(repo, rev="HEAD", paths=DIFF_PATHSPEC, cache=None):
+    """
+    Fetch, in one request, every blob the pipelines will diff in a partial clone: both sides of
+    each change to `paths` in the history of `rev`. With a diff cache only the commits it does
+    not hold yet are diffed, since the others are never read from git again. Blobs already
+    present are skipped by git.
+    """
+    shas = repo.git.rev_list(rev).split()
+    if cache is not None:
+        import history
+        cached = diff_cache.cached_shas(cache, shas, history.diff_variant())
+        shas = [sha for sha in shas if sha not in cached]
+    if not shas:
+        return 0
+    raw_log = subprocess.run(
+        ["git", "--git-dir", repo.git_dir, "log", "--stdin", "--no-walk=unsorted", "--format=", "--raw",
+         "--no-abbrev", "--no-renames", "--diff-merges=first-parent", "--", *paths],
+        input="".join(sha + "\n" for sha in shas), text=True, check=True, capture_output=True,
+    ).stdout
+    blobs = set()
+    for line in raw_log.splitlines():
+        if line.startswith(":"):
+            blobs.update(line.split()[2:4])
+    blobs.discard("0" * 40)
+    if not blobs:
+        return 0
+    subprocess.run(
+        ["git", "--git-dir", repo.git_dir, "-c", "fetch.negotiationAlgorithm=noop", "fetch", "--quiet",
+         "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "--stdin", "origin"],
+        input="".join(blob + "\n" for blob in sorted(blobs)), text=True, check=True, capture_output=True,
+    )
+    return len(blobs)
+
+
+def prefetch(repo, rev="HEAD"):
+    """
+    Prefetch what the pipelines will diff up to `rev` (see prefetch_blobs); a no-op unless the
+    repository is a partial clone.
+    """
+    if is_partial(repo.git_dir):
+        metrics.count("blobs_prefetched", prefetch_blobs(repo, rev, cache=diff_cache.open_cache()))
+
+
+def fast_forward(repo):
+    """
+    Move the checked-out branch of a working copy to its upstream (or origin/HEAD), which a fetch
+    alone leaves where it was. A detached HEAD is a commit picked on purpose and stays put.
+    """
+    if repo.head.is_detached:
+        print(f"{repo.working_dir} has a detached HEAD; scoring {repo.head.commit.hexsha} as it is.")
+        return
+    try:
+        target = repo.git.rev_parse("--abbrev-ref", "--symbolic-full-name", "@{upstream}")
+    except git.GitCommandError:
+        target = "origin/HEAD"
+    try:
+        repo.git.merge("--ff-only", "--quiet", target)
+    except git.GitCommandError as e:
+        print(f"Could not fast-forward {repo.active_branch.name} to {target}; scoring it as it is "
+              f"({str(e).strip().splitlines()[-1]}).")
+
+
+def acquire(url, path=None, filter=None, depth=None, since=None, prefetch_history=True):
+    """
+    A bare mirror of `url` at `path`, created on first use and fetched on every later call, so
+    only new objects cross the network. Existing non-mirror repositories at `path` are fetched
+    too, and a working copy's branch is fast-forwarded to what was fetched; if the fetch fails
+    (offline, no credentials) they are used as they are. With prefetch_history=False the blobs are
+    left for the caller to prefetch, e.g. once a fast path has ruled out a cheaper exit.
+    """
+    with metrics.stage("repo_acquire"):
+        path = path or mirror_path(url)
+        filter = clone_filter if filter is None else filter
+        shallow = shallow_args(depth, since)
+
+        if os.path.exists(path):
+            repo = git.Repo(path)
+            if "origin" in [remote.name for remote in repo.remotes]:
+                try:
+                    if repo.bare and not is_mirror(repo):
+                        # A plain bare clone has no remote-tracking refs; update its branches directly.
+                        repo.git.fetch("--prune", "origin", "+refs/heads/*:refs/heads/*", **shallow)
+                    else:
+                        repo.git.fetch("--prune", "origin", **shallow)
+                except git.GitCommandError as e:
+                    print(f"Could not fetch {url} into {path}; using it as it is ({str(e).strip().splitlines()[-1]}).")
+                else:
+                    if not repo.bare:
+                        fast_forward(repo)
+        else:
+            print(f"Mirroring {url} into {path}...")
+            options = dict(shallow, mirror=True)
+            if filter:
+                options["filter"] = filter
+            repo = git.Repo.clone_from(url, path, **options)
+
+        if prefetch_history:
+            prefetch(repo)
+        return repo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or update the bare mirror of a repository.")
+    parser.add_argument("url")
+    parser.add_argument("--path", default=None)
+    parser.add_argument("--filter", default=None, help="partial clone filter, '' for a full clone")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--since", default=None, help="only fetch commits after this date")
+    args = parser.parse_args()
+
+    repo = acquire(args.url, args.path, args.filter, args.depth, args.since)
+    print(f"{repo.git_dir} at {repo.head.commit.hexsha}.")
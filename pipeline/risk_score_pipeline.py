@@ -1,122 +1,201 @@
-import csv
-import os
-import sys
-import git
-import re
-from collections import Counter
-import code_features
-
-WEIGHTS = {
-    "complexity": 1,
-    "frequency": 20,
-    "sensitive_data": 30,
-    "external_dependencies": 5
-}
-
-SENSITIVE_KEYWORDS = ["password", "secret", "token", "api_key", "credential", "token", "api_token", "rest_key", "db_pass", "dbpass", "db_password", "dbpassword"]
-
-scaling_factor = float(os.getenv('SCALING_FACTOR', '0.2'))
-complexity_weight = float(os.getenv('COMPLEXITY_WEIGHT', '1'))
-external_dependencies_weight = float(os.getenv('EXTERNAL_DEPENDENCIES_WEIGHT', '5'))
-fingerprint_threshold = float(os.getenv('FINGERPRINT_THRESHOLD', '0.088'))
-frequency_weight = float(os.getenv('FREQUENCY_WEIGHT', '20'))
-repo_path_str = os.getenv('REPO_PATH', './repository')
-repo_url = os.getenv('REPO_URL', 'https://github.com/GabrielOprea/ValidatePyApp')
-risk_threshold = float(os.getenv('RISK_THRESHOLD', '18'))
-sensitive_data_weight = float(os.getenv('SENSITIVE_DATA_WEIGHT', '30'))
-
-
-def clone_repo(repo_url, repo_path):
-    if not os.path.exists(repo_path):
-        git.Repo.clone_from(repo_url, repo_path)
-    return git.Repo(repo_path)
-
-def get_commit_history(repo):
-    return list(reversed(list(repo.iter_commits())))
-
-def calculate_complexity_score(total_diff):
-    complexity_indicators = ["if", "for", "while", "switch", "try", "catch"]
-    return sum(total_diff.count(indicator) for indicator in complexity_indicators)
-
-def calculate_frequency_score(commit_files, all_commit_files):
-    file_change_counts = Counter(all_commit_files)
-    
-    score = 0
-    for file in commit_files:
-        if file in file_change_counts:
-            score += 1 / (file_change_counts[file] + 1)
-
-    return score / len(commit_files) if commit_files else 0
-
-def check_sensitive_data(total_diff):
-    return any(keyword in total_diff.lower() for keyword in SENSITIVE_KEYWORDS)
-
-def count_external_dependencies(total_diff):
-    dependency_patterns = [
-        r"import\s+[a-zA-Z_]+",  # Python
-    ]
-    
-    count = sum(len(re.findall(pattern, total_diff)) for pattern in dependency_patterns)
-    return count
-
-def calculate_risk_score(complexity, frequency, sensitive_data, dependencies):
-    return (
-        complexity_weight * complexity +
-        frequency_weight * frequency +
-        sensitive_data_weight * sensitive_data +
-        external_dependencies_weight * dependencies
-    )
-
-def analyze_commits(repo):
-    commits = get_commit_history(repo)
-    commit_risk_scores = []
-    all_commit_files = []
-    for commit in commits:
-        if '#no_anomaly' in commit.message:
-            continue
-        files_changed = []
-
-        for diff in commit.diff(commit.parents[0] if commit.parents else None, create_patch=True):
-            if diff.a_path and diff.a_path.endswith('.py'):
-                files_changed.append({
-                    "file_path": diff.a_path,
-                    "diff": diff.diff.decode('utf-8', errors='ignore')
-                })
-                all_commit_files.append(diff.a_path)
-        total_diff = code_features.get_total_diff(files_changed)
-        complexity_score = calculate_complexity_score(total_diff)
-        frequency_score = calculate_frequency_score([file["file_path"] for file in files_changed], all_commit_files)
-        sensitive_data_flag = 1 if check_sensitive_data(total_diff) else 0
-        dependency_score = count_external_dependencies(total_diff)
-
-        risk_score = calculate_risk_score(complexity_score, frequency_score, sensitive_data_flag, dependency_score)
-
-        commit_risk_scores.append({
-            "commit_hash": commit.hexsha,
-            "author": commit.author.name,
-            "message": commit.message,
-            "date": commit.committed_datetime,
-            "complexity_score": complexity_score,
-            "frequency_score": frequency_score,
-            "sensitive_data": sensitive_data_flag,
-            "dependency_score": dependency_score,
-            "risk_score": risk_score
-        })
-
-    return commit_risk_scores
-
-remote_url = repo_url
-
-if __name__ == "__main__":
-    repo = clone_repo(remote_url, repo_path_str)
-    results = analyze_commits(repo)
-    latest_commit_str = list(repo.iter_commits())[0]
-    if len(results) == 0 or '#no_anomaly' in latest_commit_str.message:
-        sys.exit(0)
-    score = results[-1]["risk_score"]
-    if score < risk_threshold:
-        print(f"Code does not exceed the risk threshold (score: {score})")
-        sys.exit(0)
-    else:
-        print(f"Code exceeds the risk threshold (score: {score})")
-        sys.exit(1)
\ No newline at end of file
+import os
+import sys
+import numpy as np
+import re
+from collections import Counter
+import churn_index
+import code_features
+import fast_path
+import history
+import keyword_matcher
+import metrics
+import parallel
+import repo_manager
+import risk_table
+
+WEIGHTS = {
+    "complexity": 1,
+    "frequency": 20,
+    "sensitive_data": 30,
+    "external_dependencies": 5
+}
+
+SENSITIVE_KEYWORDS = ["password", "secret", "token", "api_key", "credential", "api_token", "rest_key", "db_pass", "dbpass", "db_password", "dbpassword"]
+COMPLEXITY_INDICATORS = ["if", "for", "while", "switch", "try", "catch"]
+
+extra_keywords = keyword_matcher.load_keywords()
+# Indicators only count as whole words ("if" in "diff" is not a branch); sensitive keywords
+# match anywhere inside an identifier, case-insensitively.
+COMPLEXITY_MATCHER = keyword_matcher.KeywordMatcher(
+    COMPLEXITY_INDICATORS + extra_keywords.get("complexity_indicators", []), whole_words=True)
+SENSITIVE_MATCHER = keyword_matcher.KeywordMatcher(
+    SENSITIVE_KEYWORDS + extra_keywords.get("sensitive_keywords", []), ignore_case=True)
+
+scaling_factor = float(os.getenv('SCALING_FACTOR', '0.2'))
+complexity_weight = float(os.getenv('COMPLEXITY_WEIGHT', '1'))
+external_dependencies_weight = float(os.getenv('EXTERNAL_DEPENDENCIES_WEIGHT', '5'))
+fingerprint_threshold = float(os.getenv('FINGERPRINT_THRESHOLD', '0.088'))
+frequency_weight = float(os.getenv('FREQUENCY_WEIGHT', '20'))
+repo_path_str = os.getenv('REPO_PATH', './repository')
+repo_url = os.getenv('REPO_URL', 'https://github.com/GabrielOprea/ValidatePyApp')
+risk_threshold = float(os.getenv('RISK_THRESHOLD', '18'))
+sensitive_data_weight = float(os.getenv('SENSITIVE_DATA_WEIGHT', '30'))
+
+
+def clone_repo(repo_url, repo_path):
+    # Blobs are prefetched by main once the fast path is ruled out.
+    return repo_manager.acquire(repo_url, repo_path, prefetch_history=False)
+
+def calculate_complexity_score(total_diff):
+    return sum(COMPLEXITY_MATCHER.count(total_diff).values())
+
+def calculate_frequency_score(commit_files, all_commit_files):
+    return frequency_score_from_counts(commit_files, Counter(all_commit_files))
+
+def frequency_score_from_counts(commit_files, file_change_counts):
+    score = 0
+    for file in commit_files:
+        if file_change_counts.get(file):
+            score += 1 / (file_change_counts[file] + 1)
+
+    return score / len(commit_files) if commit_files else 0
+
+def check_sensitive_data(total_diff):
+    return bool(SENSITIVE_MATCHER.find(total_diff))
+
+def count_external_dependencies(total_diff):
+    dependency_patterns = [
+        r"import\s+[a-zA-Z_]+",  # Python
+    ]
+    
+    count = sum(len(re.findall(pattern, total_diff)) for pattern in dependency_patterns)
+    return count
+
+def calculate_risk_score(complexity, frequency, sensitive_data, dependencies):
+    return (
+        complexity_weight * complexity +
+        frequency_weight * frequency +
+        sensitive_data_weight * sensitive_data +
+        external_dependencies_weight * dependencies
+    )
+
+def component_weights():
+    """
+    The weights of calculate_risk_score as a vector, in the order of risk_table.COMPONENTS.
+    """
+    return np.array([complexity_weight, frequency_weight, sensitive_data_weight, external_dependencies_weight])
+
+def calculate_diff_metrics(files_changed):
+    """
+    The parts of the risk score that only depend on the commit's own diff.
+    """
+    complexity_score = 0
+    sensitive_data_flag = 0
+    dependency_score = 0
+    for file in files_changed:
+        scan = code_features.scan_diff(file["diff"], COMPLEXITY_MATCHER, SENSITIVE_MATCHER)
+        complexity_score += scan["complexity"]
+        sensitive_data_flag = 1 if scan["sensitive_keywords"] else sensitive_data_flag
+        dependency_score += scan["imports"]
+    return complexity_score, sensitive_data_flag, dependency_score
+
+def risk_record(commit, files_changed, diff_metrics, churn, seq):
+    """
+    Risk score of one commit record, given its diff metrics and its position in the churn index.
+    """
+    commit_files = [file["file_path"] for file in files_changed]
+    return risk_from_counts(commit, commit_files, diff_metrics, churn_index.change_counts(churn, commit_files, seq))
+
+def risk_from_counts(commit, commit_files, diff_metrics, file_change_counts):
+    """
+    Risk score of one commit record, given its diff metrics and how often each of its files has
+    changed. Only the message's subject line is kept, so a record per commit stays small.
+    """
+    complexity_score, sensitive_data_flag, dependency_score = diff_metrics
+    frequency_score = frequency_score_from_counts(commit_files, file_change_counts)
+
+    risk_score = calculate_risk_score(complexity_score, frequency_score, sensitive_data_flag, dependency_score)
+
+    message = commit["message"].strip()
+    return {
+        "commit_hash": commit["hash"],
+        "author": commit["author"],
+        "message": message.splitlines()[0] if message else "",
+        "date": commit["date"],
+        "complexity_score": complexity_score,
+        "frequency_score": frequency_score,
+        "sensitive_data": sensitive_data_flag,
+        "dependency_score": dependency_score,
+        "risk_score": risk_score
+    }
+
+def analyze_commits(repo, workers=None):
+    """
+    Risk components of every commit as a risk_table, scanning the diffs one history window at a
+    time. The weighted scores of all commits are one product away (see risk_table.scores).
+    """
+    churn = churn_index.open_index()
+    churn_index.index_commits(churn, repo)
+    commits, components, files_by_commit = [], [], []
+    for window in history.iter_windows(history.iter_commit_records(repo)):
+        with metrics.stage("risk_diff_metrics"):
+            metrics.count("commits_risk_scanned", len(window))
+            diff_metrics = parallel.map_ordered(calculate_diff_metrics, [commit["files_changed"] for commit in window], workers)
+        with metrics.stage("risk_scoring"):
+            for commit, (complexity_score, sensitive_data_flag, dependency_score) in zip(window, diff_metrics):
+                commit_files = [file["file_path"] for file in commit["files_changed"]]
+                counts = churn_index.change_counts(churn, commit_files, len(components) + 1)
+                components.append((complexity_score, frequency_score_from_counts(commit_files, counts),
+                                   sensitive_data_flag, dependency_score))
+                files_by_commit.append(commit_files)
+                commit.drop_diff()
+                commits.append(commit)
+    return risk_table.from_commits(commits, components, files_by_commit)
+
+def analyze_latest_commit(repo):
+    """
+    Risk record of the newest commit of HEAD only. The churn index still covers the whole
+    history, but only the newest commit is read and its diff scanned.
+    """
+    churn = churn_index.open_index()
+    seq = churn_index.index_commits(churn, repo)
+    if not seq:
+        return None
+    latest = next(history.records_for(repo, [churn_index.commit_sha(churn, seq)]))
+    files_changed = latest["files_changed"]
+    with metrics.stage("risk_scoring"):
+        metrics.count("commits_risk_scanned")
+        return risk_record(latest, files_changed, calculate_diff_metrics(files_changed), churn, seq)
+
+def report_risk(result):
+    """
+    Print the risk verdict and return the exit code.
+    """
+    score = result["risk_score"]
+    if score < risk_threshold:
+        print(f"Code does not exceed the risk threshold (score: {score})")
+        return 0
+    else:
+        print(f"Code exceeds the risk threshold (score: {score})")
+        return 1
+
+remote_url = repo_url
+
+def main():
+    repo = clone_repo(remote_url, repo_path_str)
+    head = repo.head.commit
+    if fast_path.skip_commit(head):
+        return 0
+    verdict = fast_path.load_verdict("risk", head.hexsha)
+    if verdict is not None:
+        return report_risk({"risk_score": verdict["score"]})
+
+    repo_manager.prefetch(repo)
+    result = analyze_latest_commit(repo)
+    if result is None:
+        return 0
+    fast_path.store_verdict("risk", head.hexsha, result["risk_score"])
+    return report_risk(result)
+
+if __name__ == "__main__":
+    sys.exit(metrics.run_main("risk_score_pipeline", main))
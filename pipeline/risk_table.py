@@ -0,0 +1,180 @@
+import argparse
+import os
+
+import numpy as np
+
+import diff_cache
+
+table_path = os.getenv('RISK_TABLE_PATH', os.path.join(diff_cache.cache_dir, 'risk_table.npz'))
+
+# Bump when the stored arrays change.
+TABLE_FORMAT = 1
+# The raw per-commit risk components, in the order of risk_score_pipeline.component_weights().
+COMPONENTS = ["complexity_score", "frequency_score", "sensitive_data", "dependency_score"]
+# Components that are counts or flags, reported as ints like the per-commit risk records.
+INTEGER_COMPONENTS = {"complexity_score", "sensitive_data", "dependency_score"}
+PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+
+
+def from_commits(commits, components, files_by_commit):
+    """
+    A columnar risk table for commit records (oldest first): one array per column, with the
+    raw components as a (len(COMPONENTS), commits) float matrix so every weighted score is a
+    single matrix-vector product (see scores). The changed paths are stored once each, with
+    per-commit offsets into a flat array of path ids.
+    """
+    paths, path_ids = {}, []
+    offsets = [0]
+    for files in files_by_commit:
+        path_ids.extend(paths.setdefault(path, len(paths)) for path in files)
+        offsets.append(len(path_ids))
+    return {
+        "hash": np.array([commit["hash"] for commit in commits], dtype="U40"),
+        "author": np.array([commit["author"] for commit in commits], dtype=str),
+        "date": np.array([commit["date"] for commit in commits], dtype=np.int64),
+        "components": np.array(components, dtype=np.float64).reshape(-1, len(COMPONENTS)).T.copy(),
+        "paths": np.array(list(paths), dtype=str),
+        "path_ids": np.array(path_ids, dtype=np.int32),
+        "path_offsets": np.array(offsets, dtype=np.int64),
+    }
+
+
+def save_table(table, path=None):
+    """
+    Write the table as one compressed .npz file, atomically.
+    """
+    path = path or table_path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, format=np.array(TABLE_FORMAT), **table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_table(path=None):
+    """
+    The stored table, or None when there is none or it was written in another format.
+    """
+    path = path or table_path
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as stored:
+        if "format" not in stored or int(stored["format"]) != TABLE_FORMAT:
+            print(f"Risk table {path} was written in another format; ignoring it.")
+            return None
+        return {name: stored[name] for name in stored.files if name != "format"}
+
+
+def scores(table, weights=None):
+    """
+    The weighted risk score of every commit, with the current weights unless given.
+    """
+    if weights is None:
+        import risk_score_pipeline
+        weights = risk_score_pipeline.component_weights()
+    return np.asarray(weights, dtype=np.float64) @ table["components"]
+
+
+def row(table, index, commit_scores=None):
+    """
+    One commit as a risk record dict (the fields of risk_score_pipeline.risk_record, without the
+    message).
+    """
+    commit_scores = scores(table) if commit_scores is None else commit_scores
+    record = {"commit_hash": str(table["hash"][index]), "author": str(table["author"][index]),
+              "date": int(table["date"][index])}
+    for name, value in zip(COMPONENTS, table["components"][:, index]):
+        record[name] = int(value) if name in INTEGER_COMPONENTS else float(value)
+    record["risk_score"] = float(commit_scores[index])
+    return record
+
+
+def top(table, limit=10, commit_scores=None):
+    """
+    Row indices of the `limit` riskiest commits, riskiest first (ties: newest first).
+    """
+    commit_scores = scores(table) if commit_scores is None else commit_scores
+    if limit < len(commit_scores):
+        candidates = np.argpartition(-commit_scores, limit)[:limit]
+    else:
+        candidates = np.arange(len(commit_scores))
+    return candidates[np.lexsort((-candidates, -commit_scores[candidates]))]
+
+
+def group_stats(groups, group_count, commit_scores, commit_exceeded):
+    """
+    Commit count, mean and max score and exceeded count per group, for a group id per score.
+    """
+    commits = np.bincount(groups, minlength=group_count)
+    total = np.bincount(groups, weights=commit_scores, minlength=group_count)
+    maximum = np.full(group_count, -np.inf)
+    np.maximum.at(maximum, groups, commit_scores)
+    return {
+        "commits": commits,
+        "mean": np.divide(total, commits, out=np.zeros(group_count), where=commits > 0),
+        "max": maximum,
+        "exceeded": np.bincount(groups, weights=commit_exceeded, minlength=group_count).astype(np.int64),
+    }
+
+
+def by_author(table, commit_scores=None, threshold=None):
+    """
+    (authors, stats): the statistics of group_stats for every author.
+    """
+    commit_scores = scores(table) if commit_scores is None else commit_scores
+    if threshold is None:
+        import risk_score_pipeline
+        threshold = risk_score_pipeline.risk_threshold
+    authors, groups = np.unique(table["author"], return_inverse=True)
+    return authors, group_stats(groups, len(authors), commit_scores, commit_scores >= threshold)
+
+
+def by_path(table, commit_scores=None, threshold=None):
+    """
+    (paths, stats): the statistics of group_stats for every path, over the commits changing it.
+    """
+    commit_scores = scores(table) if commit_scores is None else commit_scores
+    if threshold is None:
+        import risk_score_pipeline
+        threshold = risk_score_pipeline.risk_threshold
+    commit_of = np.repeat(np.arange(len(commit_scores)), np.diff(table["path_offsets"]))
+    path_scores = commit_scores[commit_of]
+    return table["paths"], group_stats(table["path_ids"], len(table["paths"]), path_scores, path_scores >= threshold)
+
+
+def percentiles(table, commit_scores=None, q=None):
+    commit_scores = scores(table) if commit_scores is None else commit_scores
+    q = PERCENTILES if q is None else q
+    if len(commit_scores) == 0:
+        return {}
+    return dict(zip(q, np.percentile(commit_scores, q)))
+
+
+def print_groups(names, stats, limit):
+    order = np.lexsort((names, -stats["max"], -stats["mean"]))[:limit]
+    print(f"{'commits':>8} {'mean':>9} {'max':>9} {'exceeded':>9}  name")
+    for i in order:
+        print(f"{stats['commits'][i]:8d} {stats['mean'][i]:9.2f} {stats['max'][i]:9.2f} {stats['exceeded'][i]:9d}  {names[i]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the stored risk table (written by backfill.py --save-risk-table).")
+    parser.add_argument("query", choices=["top", "authors", "paths", "percentiles"])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--path", default=None, help="defaults to RISK_TABLE_PATH")
+    args = parser.parse_args()
+
+    table = load_table(args.path)
+    if table is None:
+        raise SystemExit(f"No risk table at {args.path or table_path}; run backfill.py --save-risk-table first.")
+    commit_scores = scores(table)
+    if args.query == "top":
+        for index in top(table, args.limit, commit_scores):
+            print(f"{commit_scores[index]:9.2f}  {table['hash'][index]}  {table['author'][index]}")
+    elif args.query == "authors":
+        print_groups(*by_author(table, commit_scores), args.limit)
+    elif args.query == "paths":
+        print_groups(*by_path(table, commit_scores), args.limit)
+    else:
+        print(", ".join(f"p{p}={value:.4f}" for p, value in percentiles(table, commit_scores).items()))
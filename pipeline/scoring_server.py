@@ -0,0 +1,331 @@
+import argparse
+import copy
+import json
+import os
+import signal
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import git
+import numpy as np
+
+import baseline
+import churn_index
+import diff_cache
+import fingerprint_pipeline
+import fingerprint_store
+import fingerprints
+import history
+import neighbours
+import risk_score_pipeline
+
+repo_path = os.getenv('REPO_PATH', './repository')
+scoring_host = os.getenv('SCORING_HOST', '127.0.0.1')
+scoring_port = int(os.getenv('SCORING_PORT', '8765'))
+# Only ancestors of this ref are folded into the warm baseline.
+scoring_branch = os.getenv('SCORING_BRANCH', 'HEAD')
+# How many results for mainline commits are kept, so they can be asked for again once folded.
+results_kept = int(os.getenv('SCORING_RESULTS_KEPT', '1000'))
+
+
+class WarmScorer:
+    """
+    Keeps the repository handle, the fingerprint baseline, the diff cache and the churn index
+    in memory so a commit is scored without re-reading history.
+
+    Commits that are ancestors of SCORING_BRANCH are folded into the baseline and the churn index
+    as they are scored. Other commits are scored against a copy, so the mainline baseline only
+    ever contains mainline history. The results of mainline commits (and of the warm head at
+    startup) are kept, so asking for one again after it was folded returns the same result.
+
+    With FINGERPRINT_SCORING=knn the stored fingerprints are also kept in an LSH index, which
+    mainline commits are added to as they are scored.
+    """
+
+    def __init__(self, repo_path):
+        self.repo = git.Repo(repo_path)
+        self.cache = diff_cache.open_cache()
+        self.churn = churn_index.open_index()
+        self.results = {}
+        self.catch_up()
+
+    def catch_up(self):
+        """
+        Fold everything up to the scoring branch that the stored baseline and churn index have not
+        seen yet, then score the new warm head.
+        """
+        self.tip = self.repo.commit(scoring_branch).hexsha
+        self.state, commit_data = baseline.new_commits(self.repo.working_dir, baseline.load_state(), self.tip)
+        knn = fingerprint_pipeline.fingerprint_scoring == "knn"
+        self.store = fingerprints.open_commit_store(self.state) if knn else None
+        for window in history.iter_windows(commit_data):
+            feature_vectors = baseline.commit_feature_vectors(window)
+            term_counts = []
+            for commit, feature_vector in zip(window, feature_vectors):
+                if knn:
+                    term_counts.append(baseline.term_frequencies(self.state, commit["message"]))
+                baseline.fold_commit(self.state, commit, feature_vector=feature_vector)
+                commit.drop_diff()
+            # Stored as soon as the window is folded, so only one window is held at a time.
+            fingerprint_pipeline.store_window(self.store, self.state, window, feature_vectors, term_counts)
+
+        churn_index.index_commits(self.churn, self.repo, self.tip, self.cache)
+
+        self.knn = None
+        if knn:
+            missing = (sha for sha in history.iter_shas(self.repo, self.tip) if sha not in self.store["index"])
+            fingerprints.store_commits(self.store, self.state, history.records_for(self.repo, missing, self.cache))
+            self.knn = neighbours.index_store(self.store)
+        if self.tip not in self.results:
+            self.remember(self.score_tip())
+
+    def score_tip(self):
+        """
+        {sha: result} for the warm head, which catch_up folds without scoring: it is taken back out
+        of the baseline and folded again with scoring. Empty when the head is not in the baseline
+        (#no_anomaly).
+        """
+        seq = churn_index.commit_seq(self.churn, self.tip)
+        record = next(history.records_for(self.repo, [self.tip], self.cache))
+        if seq is None or '#no_anomaly' in record["message"] or not self.state["count"]:
+            return {}
+        feature_vector = baseline.code_feature_vector(record)
+        baseline.unfold_commit(self.state, record, feature_vector)
+        similarity = baseline.fold_commit(self.state, record, score=True, feature_vector=feature_vector)
+        if self.knn is not None:
+            vector = fingerprints.store_vectors(self.state, [record], [feature_vector])[0]
+            similarity = self.knn_similarity(self.tip, vector, {})
+        commit_files = [file["file_path"] for file in record["files_changed"]]
+        return {self.tip: self.result(record, similarity, churn_index.change_counts(self.churn, commit_files, seq))}
+
+    def remember(self, results):
+        self.results.update(results)
+        for sha in list(self.results)[:max(len(self.results) - results_kept, 0)]:
+            del self.results[sha]
+
+    def commits_between(self, base, head):
+        """
+        Commits reachable from head but not from base, oldest first, without #no_anomaly commits.
+        """
+        rev = [head, f"^{base}"] if base else head
+        return list(history.iter_commits(self.repo, rev))
+
+    def score(self, head, base=None):
+        """
+        Score head (or every commit in base..head) against the commits before it. Commits that
+        are ancestors of the scoring branch are folded into the warm state (the reported ones
+        after scoring) and move the warm head; all others are scored against a copy. Commits that
+        are already part of the warm state get the result kept from when they were folded; ones
+        folded before that (e.g. by an earlier server) cannot be re-scored here.
+        """
+        head = self.repo.commit(head).hexsha
+        branch_tip = self.repo.commit(scoring_branch).hexsha
+        if not baseline.is_ancestor(self.repo, self.tip, branch_tip):
+            # The branch was rewritten under the warm head.
+            self.catch_up()
+        pending = self.commits_between(self.tip, head)
+        pending_shas = {commit.hexsha for commit in pending}
+        order = [commit.hexsha for commit in self.commits_between(base, head)] if base else [head]
+        reported = set(order)
+        folded = reported - pending_shas - self.results.keys()
+        if folded:
+            raise ValueError(f"{len(folded)} of the requested commits are already part of the warm baseline "
+                             f"(head {self.tip}); score them with analyze_commit.py --range")
+
+        # Only the history shared with the branch is mainline; the rest may never be merged.
+        fork = self.repo.git.merge_base(head, branch_tip)
+        on_branch = set()
+        if baseline.is_ancestor(self.repo, self.tip, fork):
+            on_branch = set(self.repo.git.rev_list(f"{self.tip}..{fork}").split())
+        files_by_sha = history.load_files_changed(pending, self.cache)
+        results = self.fold([commit for commit in pending if commit.hexsha in on_branch],
+                            files_by_sha, reported, self.state)
+        if on_branch:
+            self.tip = fork
+        speculative = [commit for commit in pending if commit.hexsha not in on_branch]
+        if speculative:
+            results.update(self.fold(speculative, files_by_sha, reported, copy.deepcopy(self.state),
+                                     {"churn": Counter(), "vectors": {}}))
+        results.update({sha: self.results[sha] for sha in reported - pending_shas})
+        return [results[sha] for sha in order if sha in results]
+
+    def fold(self, commits, files_by_sha, reported, state, speculative=None):
+        """
+        Fold commits into state in order, scoring the reported ones; returns {sha: result}. With
+        speculative=None they are mainline and also go into the churn index and the kNN store,
+        otherwise their churn and fingerprints are only kept in the speculative dict.
+        """
+        results = {}
+        # One churn index transaction for the whole request (add_commit leaves it to the caller).
+        with self.churn:
+            for commit, record in zip(commits, history.commit_records(commits, files_by_sha)):
+                files_changed = record["files_changed"]
+                feature_vector = baseline.code_feature_vector(record)
+                similarity = baseline.fold_commit(state, record, score=commit.hexsha in reported,
+                                                  feature_vector=feature_vector)
+                if self.knn is not None:
+                    vector = fingerprints.store_vectors(state, [record], [feature_vector])[0]
+                    if commit.hexsha in reported:
+                        similarity = self.knn_similarity(commit.hexsha, vector,
+                                                         speculative["vectors"] if speculative else {})
+                    if speculative is None:
+                        fingerprint_store.append(self.store, [commit.hexsha], [vector])
+                        neighbours.add(self.knn, [commit.hexsha], vector)
+                    else:
+                        speculative["vectors"][commit.hexsha] = vector
+
+                commit_files = [file["file_path"] for file in files_changed]
+                if speculative is None:
+                    seq = churn_index.add_commit(self.churn, commit.hexsha, commit.committed_date, commit_files)
+                    counts = churn_index.change_counts(self.churn, commit_files, seq)
+                else:
+                    speculative["churn"].update(commit_files)
+                    counts = {path: count + speculative["churn"][path]
+                              for path, count in churn_index.change_counts(self.churn, commit_files).items()}
+
+                if commit.hexsha in reported:
+                    results[commit.hexsha] = self.result(record, similarity, counts)
+        if speculative is None:
+            self.remember(results)
+        return results
+
+    def knn_similarity(self, sha, vector, speculative_vectors):
+        """
+        Mean similarity to the k nearest commits among the indexed mainline and the branch
+        commits scored before this one.
+        """
+        _, similarities = neighbours.nearest(self.knn, vector, exclude=sha)
+        if speculative_vectors:
+            branch = neighbours.unit_rows(list(speculative_vectors.values())) @ neighbours.unit_rows(vector).ravel()
+            similarities = np.sort(np.concatenate([similarities, branch]))[::-1][:neighbours.knn_k]
+        return float(np.mean(similarities)) if len(similarities) else None
+
+    def result(self, record, similarity, churn_counts):
+        complexity, sensitive_data, dependencies = risk_score_pipeline.calculate_diff_metrics(record["files_changed"])
+        frequency = risk_score_pipeline.frequency_score_from_counts(
+            [file["file_path"] for file in record["files_changed"]], churn_counts)
+        risk_score = risk_score_pipeline.calculate_risk_score(complexity, frequency, sensitive_data, dependencies)
+        fingerprint_anomaly = similarity is not None and similarity < fingerprint_pipeline.similarity_threshold()
+        risk_exceeded = risk_score >= risk_score_pipeline.risk_threshold
+        return {
+            "hash": record["hash"],
+            "author": record["author"],
+            "message": record["message"].strip().splitlines()[0] if record["message"].strip() else "",
+            "similarity": similarity,
+            "fingerprint_anomaly": fingerprint_anomaly,
+            "complexity_score": complexity,
+            "frequency_score": frequency,
+            "sensitive_data": sensitive_data,
+            "dependency_score": dependencies,
+            "risk_score": risk_score,
+            "risk_exceeded": risk_exceeded,
+            "anomaly": fingerprint_anomaly or risk_exceeded,
+        }
+
+    def save(self):
+        baseline.save_state(self.state)
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """
+    GET /health, and POST /score with {"commit": "<rev>"} or {"range": "<base>..<head>"}.
+    """
+
+    scorer = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, {"head": self.scorer.tip, "baseline_commits": self.scorer.state["count"]})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        started = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if "range" in request:
+                base, head = request["range"].split("..", 1)
+                results = self.scorer.score(head or "HEAD", base)
+            else:
+                results = self.scorer.score(request.get("commit", "HEAD"))
+        except (ValueError, git.BadName, git.GitCommandError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, {
+            "results": results,
+            "anomaly": any(result["anomaly"] for result in results),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(host, port):
+    scorer = WarmScorer(repo_path)
+    ScoringHandler.scorer = scorer
+    server = HTTPServer((host, port), ScoringHandler)
+    # Let `kill` shut down cleanly so the warm baseline is stored.
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Scoring {repo_path} at http://{host}:{port} (head {scorer.tip}, {scorer.state['count']} commits in the baseline).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scorer.save()
+
+
+def request_score(host, port, target):
+    """
+    Client for hooks: score a commit or a base..head range and exit 1 if anything is anomalous.
+    """
+    payload = {"range": target} if ".." in target else {"commit": target}
+    request = urllib.request.Request(f"http://{host}:{port}/score", data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            answer = json.load(response)
+    except urllib.error.HTTPError as e:
+        print(f"Scoring failed: {json.load(e).get('error')}")
+        return 2
+    if not answer["results"]:
+        print(f"Nothing to score in {target}.")
+    for result in answer["results"]:
+        status = "Anomaly detected in" if result["anomaly"] else "No anomaly detected in"
+        print(f"{status} commit {result['hash']}: {result['message']} "
+              f"(similarity: {result['similarity']}, risk score: {result['risk_score']})")
+    return 1 if answer["anomaly"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the scoring pipelines warm behind a localhost HTTP endpoint.")
+    parser.add_argument("--host", default=scoring_host)
+    parser.add_argument("--port", type=int, default=scoring_port)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="load the repository and baseline, then answer scoring requests")
+    score_parser = commands.add_parser("score", help="ask a running server to score a commit or base..head range")
+    score_parser.add_argument("target", nargs="?", default="HEAD")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port)
+    else:
+        sys.exit(request_score(args.host, args.port, args.target))
@@ -0,0 +1,86 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+
+MESSAGE_WORDS = ["fix", "parser", "cache", "docs", "refactor", "token", "update", "test", "add", "api_key"]
+SOURCE_FILES = ["app.py", "core/parser.py", "core/cache.py", "utils/helpers.py", "api/client.py"]
+
+
+def run_git(path, *args, date=None):
+    env = dict(os.environ)
+    if date is not None:
+        env["GIT_AUTHOR_DATE"] = env["GIT_COMMITTER_DATE"] = f"{date} +0000"
+    return subprocess.run(["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+                          cwd=path, check=True, capture_output=True, text=True, env=env).stdout
+
+
+def write_commit(path, files, message, date):
+    """
+    Commit {relative path: text to append} with a fixed date, so SHAs are the same on every run.
+    """
+    for name, text in files.items():
+        target = path / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "a") as f:
+            f.write(text)
+    run_git(path, "add", "-A")
+    run_git(path, "commit", "-q", "-m", message, date=date)
+    return run_git(path, "rev-parse", "HEAD").strip()
+
+
+def python_snippet(rng, serial):
+    depth = rng.randint(1, 3)
+    lines = [f"import {rng.choice(['os', 'sys', 'json', 'requests'])}", f"def {rng.choice(['load', 'parseValue', 'save_item'])}_{serial}(value):"]
+    lines += ["    " * level + "if value:" for level in range(1, depth + 1)]
+    lines.append("    " * (depth + 1) + f"return value + {serial}")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture
+def history_repo(tmp_path):
+    """
+    A generated repository on branch main: 30 commits, each appending Python code to one to
+    three files, with seeded messages and fixed dates.
+    """
+    import git
+
+    path = tmp_path / "repo"
+    path.mkdir()
+    run_git(path, "init", "-q", "-b", "main")
+    rng = random.Random(5)
+    for serial in range(30):
+        files = {name: python_snippet(rng, serial) for name in rng.sample(SOURCE_FILES, rng.randint(1, 3))}
+        write_commit(path, files, " ".join(rng.choice(MESSAGE_WORDS) for _ in range(4)), 1700000000 + serial * 3600)
+    return git.Repo(path)
+
+
+def point_cache(monkeypatch, path):
+    """
+    Point every stored artefact (diff cache, baseline, churn index, fingerprint store, verdicts,
+    metrics) at `path`.
+    """
+    import baseline
+    import diff_cache
+    import fast_path
+    import fingerprint_store
+    import metrics
+    import risk_table
+
+    monkeypatch.setattr(diff_cache, "cache_dir", str(path))
+    monkeypatch.setattr(baseline, "baseline_path", str(path / "fingerprint_baseline.json"))
+    monkeypatch.setattr(baseline, "hashing_idf_path", str(path / "hashing_idf.npy"))
+    monkeypatch.setattr(fingerprint_store, "store_path", str(path / "fingerprint_store"))
+    monkeypatch.setattr(fast_path, "verdicts_path", str(path / "verdicts.json"))
+    monkeypatch.setattr(metrics, "metrics_dir", str(path / "metrics"))
+    monkeypatch.setattr(risk_table, "table_path", str(path / "risk_table.npz"))
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    return point_cache(monkeypatch, tmp_path / "cache")
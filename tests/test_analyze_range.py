@@ -0,0 +1,36 @@
+import pytest
+
+import analyze_commit
+import baseline
+import churn_index
+import fingerprint_pipeline
+from conftest import point_cache
+
+
+def range_scores(repo, base, head):
+    return [(result["commit"]["hash"], result["skipped"], result["similarity"], result["risk"])
+            for result in analyze_commit.analyze_range(repo, base, head)]
+
+
+@pytest.mark.parametrize("scoring, mode", [("mean", "tfidf"), ("knn", "hashing")])
+def test_stored_baseline_ahead_of_base_scores_like_a_fresh_one(monkeypatch, tmp_path, history_repo, scoring, mode):
+    monkeypatch.setattr(fingerprint_pipeline, "fingerprint_scoring", scoring)
+    monkeypatch.setattr(baseline, "fingerprint_mode", mode)
+    base, head = history_repo.commit("HEAD~8").hexsha, history_repo.commit("HEAD~3").hexsha
+
+    point_cache(monkeypatch, tmp_path / "fresh")
+    fresh = range_scores(history_repo, base, head)
+
+    # A pipeline run on HEAD leaves the stored baseline, churn index and store ahead of base.
+    point_cache(monkeypatch, tmp_path / "ahead")
+    assert analyze_commit.analyze(history_repo) is not None
+    stored_head = baseline.load_state()["head"]
+    assert stored_head == history_repo.head.commit.hexsha
+    ahead = range_scores(history_repo, base, head)
+
+    assert len(fresh) == 5
+    assert [(sha, skipped, risk) for sha, skipped, _, risk in ahead] == [(sha, skipped, risk) for sha, skipped, _, risk in fresh]
+    assert [similarity for *_, similarity, _ in ahead] == pytest.approx([similarity for *_, similarity, _ in fresh])
+    # The range is only scored in memory.
+    assert baseline.load_state()["head"] == stored_head
+    assert churn_index.commit_count(churn_index.open_index()) == 30
@@ -0,0 +1,69 @@
+import copy
+
+import numpy as np
+import pytest
+
+import baseline
+import fingerprint_pipeline
+import fingerprint_store
+import fingerprints
+import history
+from conftest import point_cache, run_git
+
+
+def assert_same_state(first, second):
+    assert (first["mode"], first["head"], first["count"]) == (second["mode"], second["head"], second["count"])
+    assert first["vocabulary"] == second["vocabulary"]
+    size = baseline.message_dimension(first)
+    for key in ("document_frequency", "message_sum"):
+        np.testing.assert_allclose(first[key][:size], second[key][:size])
+    np.testing.assert_allclose(first["feature_sum"], second["feature_sum"])
+
+
+@pytest.mark.parametrize("mode", ["tfidf", "hashing"])
+def test_incremental_runs_match_rebuild(monkeypatch, history_repo, cache_dir, mode):
+    monkeypatch.setattr(baseline, "fingerprint_mode", mode)
+    path = history_repo.working_dir
+    shas = list(history.iter_shas(history_repo))
+    # One pipeline run per push, each folding only the commits since the stored head.
+    for head in shas[4:-1:6] + shas[-1:]:
+        run_git(path, "checkout", "-q", head)
+        latest_commit, _ = fingerprint_pipeline.score_latest_commit(path)
+        assert latest_commit["hash"] == head
+    incremental = baseline.load_state()
+
+    rebuilt = baseline.rebuild(path, str(cache_dir / "rebuilt.json"))
+    assert_same_state(incremental, rebuilt)
+    assert_same_state(baseline.load_state(str(cache_dir / "rebuilt.json")), rebuilt)
+
+
+def test_incremental_score_matches_rebuilt_prefix(history_repo, cache_dir):
+    path = history_repo.working_dir
+    shas = list(history.iter_shas(history_repo))
+    run_git(path, "checkout", "-q", shas[-2])
+    fingerprint_pipeline.score_latest_commit(path)
+    run_git(path, "checkout", "-q", shas[-1])
+    latest_commit, similarity = fingerprint_pipeline.score_latest_commit(path)
+
+    prefix = baseline.rebuild(path, str(cache_dir / "prefix.json"), head=shas[-2])
+    expected = baseline.fold_commit(copy.deepcopy(prefix), latest_commit, score=True)
+    assert similarity == pytest.approx(expected)
+
+
+
+def test_store_written_per_window_matches_one_window(monkeypatch, tmp_path, history_repo):
+    monkeypatch.setattr(baseline, "fingerprint_mode", "hashing")
+    monkeypatch.setattr(fingerprints, "fingerprint_store_enabled", True)
+    shas = list(history.iter_shas(history_repo))
+    similarities, vectors = [], []
+    for window in (1000, 7):
+        monkeypatch.setattr(history, "history_window", window)
+        point_cache(monkeypatch, tmp_path / str(window))
+        latest_commit, similarity = fingerprint_pipeline.score_latest_commit(history_repo.working_dir)
+        assert latest_commit["hash"] == shas[-1]
+        store = fingerprints.open_commit_store(baseline.load_state())
+        assert store["rows"] == 30
+        similarities.append(similarity)
+        vectors.append(fingerprint_store.vectors(store, shas))
+    assert similarities[1] == pytest.approx(similarities[0])
+    np.testing.assert_allclose(vectors[1], vectors[0])
@@ -0,0 +1,49 @@
+from collections import Counter
+from pathlib import Path
+
+import churn_index
+import history
+from conftest import run_git, write_commit
+
+
+def changed_paths(repo, rev="HEAD"):
+    commits = list(history.iter_commits(repo, rev))
+    files_by_sha = history.load_files_changed(commits)
+    return commits, [[file["file_path"] for file in files_by_sha[commit.hexsha]] for commit in commits]
+
+
+def assert_counts_match_history(index, repo, rev="HEAD"):
+    commits, paths_by_commit = changed_paths(repo, rev)
+    assert churn_index.commit_count(index) == len(commits)
+    every_path = sorted({path for paths in paths_by_commit for path in paths})
+    for seq in range(1, len(commits) + 1):
+        assert churn_index.change_counts(index, every_path, seq) == {
+            path: Counter(path for paths in paths_by_commit[:seq] for path in paths)[path] for path in every_path}
+        window = Counter(path for paths in paths_by_commit[max(seq - 5, 0):seq] for path in paths)
+        assert churn_index.change_counts(index, every_path, seq, last_commits=5) == {path: window[path] for path in every_path}
+    since = commits[-8].committed_date
+    recent = Counter(path for commit, paths in zip(commits, paths_by_commit) if commit.committed_date >= since for path in paths)
+    assert churn_index.change_counts(index, every_path, since=since) == {path: recent[path] for path in every_path}
+
+
+def test_change_counts_match_counter_over_history(history_repo, cache_dir):
+    path = str(cache_dir / "churn.sqlite")
+    index = churn_index.open_index(path)
+    assert churn_index.index_commits(index, history_repo) == 30
+    index.close()
+    # Every window was committed, so a fresh connection sees the whole index.
+    assert_counts_match_history(churn_index.open_index(path), history_repo)
+
+
+def test_incremental_and_rewritten_history(history_repo, cache_dir):
+    index = churn_index.open_index(str(cache_dir / "churn.sqlite"))
+    churn_index.index_commits(index, history_repo, "HEAD~10")
+    assert churn_index.index_commits(index, history_repo) == 30
+    assert_counts_match_history(index, history_repo)
+
+    # Rewrite the last three commits: the index drops them and indexes the replacement.
+    path = Path(history_repo.working_dir)
+    run_git(path, "reset", "-q", "--hard", "HEAD~3")
+    write_commit(path, {"core/cache.py": "x = 1\n"}, "rewrite", 1800000000)
+    assert churn_index.index_commits(index, history_repo) == 28
+    assert_counts_match_history(index, history_repo)
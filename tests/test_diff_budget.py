@@ -0,0 +1,61 @@
+import diff_budget
+
+
+def sampled_record(monkeypatch, line_count):
+    monkeypatch.setattr(diff_budget, "file_max_lines", 20)
+    monkeypatch.setattr(diff_budget, "sample_lines", 8)
+    sample = diff_budget.FileSample()
+    for i in range(line_count):
+        sample.add(f"+line {i}\n".encode())
+    return sample.record("big.py")
+
+
+def test_file_sample_is_deterministic(monkeypatch):
+    first = sampled_record(monkeypatch, 5000)
+    second = sampled_record(monkeypatch, 5000)
+    assert first == second
+    assert first["budget"] == {"reason": diff_budget.SAMPLED, "skipped": False, "lines": 5000,
+                               "bytes": sum(len(f"+line {i}\n") for i in range(5000))}
+
+
+def test_file_sample_keeps_head_and_ordered_sample(monkeypatch):
+    lines = sampled_record(monkeypatch, 5000)["diff"].splitlines()
+    assert len(lines) == 20 + 8
+    assert lines[:20] == [f"+line {i}" for i in range(20)]
+    numbers = [int(line.split()[1]) for line in lines[20:]]
+    assert numbers == sorted(numbers)
+    assert all(20 <= number < 5000 for number in numbers)
+
+
+def test_file_sample_within_budget_is_kept_in_full(monkeypatch):
+    record = sampled_record(monkeypatch, 20)
+    assert "budget" not in record
+    assert record["diff"].splitlines() == [f"+line {i}" for i in range(20)]
+
+
+def file_record(path, raw_lines):
+    sample = diff_budget.FileSample()
+    sample.check_path(path)
+    for line in raw_lines:
+        sample.add(line)
+    return sample.record(path)
+
+
+def test_vendored_path_is_skipped():
+    record = file_record("vendor/lib.py", [b"-import os\n"])
+    assert record["diff"] == ""
+    assert record["budget"]["reason"] == diff_budget.SKIPPED_PATH
+    assert diff_budget.is_skipped(record)
+
+
+def test_generated_marker_in_the_commits_version_skips_the_file():
+    record = file_record("api_gen.py", [b"@@ -1,2 +0,0 @@\n", b"-# Code generated by protoc. DO NOT EDIT.\n",
+                                        b"-import os\n"])
+    assert record["budget"]["reason"] == diff_budget.GENERATED
+    assert diff_budget.is_skipped(record)
+
+
+def test_generated_marker_only_in_the_parent_is_ignored():
+    # The diffs are reversed: "+" lines are the parent's version of the file.
+    record = file_record("api.py", [b"@@ -1,1 +1,1 @@\n", b"-import os\n", b"+# Code generated by protoc. DO NOT EDIT.\n"])
+    assert "budget" not in record
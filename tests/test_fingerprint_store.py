@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+import fingerprint_store
+import neighbours
+
+DIMS = 6
+
+
+def filled_store(tmp_path, rows=20, seed=2):
+    vectors = np.random.default_rng(seed).standard_normal((rows, DIMS)).astype(np.float32)
+    shas = [f"{row:040x}" for row in range(rows)]
+    store = fingerprint_store.open_store(str(tmp_path / "store"), dims=DIMS, vectorizer="test")
+    fingerprint_store.append(store, shas, vectors)
+    return store, shas, vectors
+
+
+def test_rows_survive_reopening(tmp_path):
+    store, shas, vectors = filled_store(tmp_path)
+    reopened = fingerprint_store.open_store(store["path"])
+    assert (reopened["rows"], reopened["dims"], reopened["vectorizer"]) == (20, DIMS, "test")
+    np.testing.assert_array_equal(fingerprint_store.vectors(reopened, shas), vectors)
+    assert fingerprint_store.verify(reopened) == []
+
+
+def test_verify_reports_rows_failing_their_checksum(tmp_path):
+    store, _, _ = filled_store(tmp_path)
+    with open(os.path.join(store["path"], fingerprint_store.VECTORS_FILE), "r+b") as f:
+        f.seek(5 * DIMS * 4 + 8)
+        f.write(b"\xff\xff\xff\x7f")
+    assert fingerprint_store.verify(fingerprint_store.open_store(store["path"])) == [5]
+
+
+def test_truncated_last_row_is_dropped(tmp_path):
+    store, shas, vectors = filled_store(tmp_path)
+    vectors_path = os.path.join(store["path"], fingerprint_store.VECTORS_FILE)
+    with open(vectors_path, "r+b") as f:
+        f.truncate(os.path.getsize(vectors_path) - 3)
+    reopened = fingerprint_store.open_store(store["path"])
+    assert reopened["rows"] == 19
+    assert shas[-1] not in reopened["index"]
+    assert os.path.getsize(os.path.join(store["path"], fingerprint_store.INDEX_FILE)) == 19 * fingerprint_store.INDEX_DTYPE.itemsize
+    assert fingerprint_store.verify(reopened) == []
+    np.testing.assert_array_equal(fingerprint_store.vectors(reopened, shas[:-1]), vectors[:-1])
+
+
+def test_compact_keeps_the_newest_row_of_every_commit(tmp_path):
+    store, shas, vectors = filled_store(tmp_path)
+    replacements = vectors[[3, 8]] * -2
+    fingerprint_store.append(store, [shas[3], shas[8]], replacements)
+    vectors[[3, 8]] = replacements
+    assert store["rows"] == 22
+
+    compacted = fingerprint_store.compact(store)
+    assert compacted["rows"] == 20
+    assert (compacted["dims"], compacted["vectorizer"]) == (DIMS, "test")
+    np.testing.assert_array_equal(fingerprint_store.vectors(compacted, shas), vectors)
+    assert fingerprint_store.verify(compacted) == []
+    found, _ = neighbours.store_nearest(compacted, vectors[3], k=1)
+    assert found == [shas[3]]
+
+
+def test_compact_to_a_subset(tmp_path):
+    store, shas, vectors = filled_store(tmp_path)
+    compacted = fingerprint_store.compact(store, keep=set(shas[::2]))
+    assert sorted(compacted["index"]) == sorted(shas[::2])
+    np.testing.assert_array_equal(fingerprint_store.vectors(compacted, shas[::2]), vectors[::2])
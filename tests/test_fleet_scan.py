@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import fleet_scan
+from conftest import write_commit
+
+
+def test_fleet_skips_heads_the_pipelines_skip(history_repo, tmp_path, capsys):
+    scored = history_repo.working_dir
+    skipped = str(tmp_path / "docs-head")
+    history_repo.clone(skipped)
+    write_commit(Path(skipped), {"README.md": "Usage notes.\n"}, "docs only", 1800000000)
+
+    results = fleet_scan.scan_fleet([scored, skipped], str(tmp_path / "fleet-cache"), workers=2, timeout=120)
+    assert [result["repo"] for result in results] == [scored, skipped]
+    assert results[0]["status"] == "ok"
+    assert results[0]["head"] == history_repo.head.commit.hexsha
+    assert results[0]["risk_score"] is not None
+    assert results[1]["status"] == "skipped"
+    assert (results[1]["similarity"], results[1]["risk_score"]) == (None, None)
+    assert f"{skipped}: skipped" in capsys.readouterr().out
@@ -0,0 +1,86 @@
+"""
+The streamed `git log` backend and the per-commit GitPython backend must extract the same
+records, so the diff cache and every score are independent of HISTORY_BACKEND.
+"""
+import subprocess
+
+import git
+import pytest
+
+import history
+import repo_manager
+
+
+def run_git(path, *args):
+    subprocess.run(["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+                   cwd=path, check=True, capture_output=True)
+
+
+def write(path, name, lines):
+    target = path / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text("".join(f"{line}\n" for line in lines))
+
+
+def commit(path, message):
+    run_git(path, "add", "-A")
+    run_git(path, "commit", "-q", "-m", message)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    run_git(tmp_path, "init", "-q")
+    body = [f"def function_{i}(value):" if i % 4 == 0 else f"    value_{i} = value + {i}" for i in range(40)]
+    write(tmp_path, "app.py", body)
+    write(tmp_path, "src/module.py", body[::-1])
+    write(tmp_path, "docs/conf.py", ["project = 'test'", "release = '1.0'"])
+    write(tmp_path, "dir with space/file name.py", ["import os", "print(os.getcwd())"])
+    write(tmp_path, "notes.txt", ["not python"])
+    commit(tmp_path, "initial")
+
+    write(tmp_path, "app.py", body + ["def added():", "    return 1"])
+    write(tmp_path, "dir with space/file name.py", ["import os", "import sys", "print(os.getcwd(), sys.argv)"])
+    write(tmp_path, "docs/conf.py", ["project = 'test'", "release = '1.1'"])
+    commit(tmp_path, "modify")
+
+    (tmp_path / "src/module.py").rename(tmp_path / "src/renamed module.py")
+    write(tmp_path, "src/renamed module.py", body[::-1] + ["    extra = 1"])
+    (tmp_path / "docs/conf.py").unlink()
+    commit(tmp_path, "rename and delete")
+
+    (tmp_path / "app.py").unlink()
+    write(tmp_path, "notes.txt", ["still not python"])
+    commit(tmp_path, "delete only")
+    return git.Repo(tmp_path)
+
+
+def extract(repo):
+    commits = list(history.iter_commits(repo))
+    files_by_sha = history.extract_many(commits)
+    return [files_by_sha[commit.hexsha] for commit in commits]
+
+
+def no_fallback(commit):
+    raise AssertionError("the git-log backend fell back to per-commit diffs")
+
+
+@pytest.mark.parametrize("exclude", [[], ["docs/*"]])
+def test_backends_return_equal_records(monkeypatch, repo, exclude):
+    monkeypatch.setattr(repo_manager, "diff_exclude", exclude)
+    monkeypatch.setattr(repo_manager, "DIFF_PATHSPEC",
+                        repo_manager.diff_include + [f":(exclude){glob}" for glob in exclude])
+    with monkeypatch.context() as patch:
+        patch.setattr(history, "history_backend", "git-log")
+        patch.setattr(history, "extract_files_changed", no_fallback)
+        git_log_records = extract(repo)
+    monkeypatch.setattr(history, "history_backend", "gitpython")
+    gitpython_records = extract(repo)
+
+    assert git_log_records == gitpython_records
+    paths = [sorted(file["file_path"] for file in files_changed) for files_changed in git_log_records]
+    docs = [] if exclude else ["docs/conf.py"]
+    assert paths[0] == sorted(["app.py", "dir with space/file name.py", "src/module.py"] + docs)
+    assert paths[1] == sorted(["app.py", "dir with space/file name.py"] + docs)
+    # Deleted files are never diffed; the renamed file is kept under its new path.
+    assert paths[2] == ["src/renamed module.py"]
+    assert paths[3] == []
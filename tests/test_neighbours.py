@@ -0,0 +1,84 @@
+import numpy as np
+
+import fingerprint_store
+import neighbours
+
+
+def brute_force(vectors, query, k, exclude_row=None):
+    similarities = neighbours.unit_rows(vectors) @ neighbours.unit_rows(query).ravel()
+    rows = [row for row in np.argsort(-similarities, kind="stable") if row != exclude_row][:k]
+    return rows, similarities[rows]
+
+
+def build_index(rows=300, dims=24, seed=3):
+    vectors = np.random.default_rng(seed).standard_normal((rows, dims)).astype(np.float32)
+    shas = [f"{row:040x}" for row in range(rows)]
+    index = neighbours.new_index(dims)
+    neighbours.add(index, shas, vectors)
+    return index, shas, vectors
+
+
+def test_exact_nearest_matches_brute_force():
+    index, shas, vectors = build_index()
+    query = np.random.default_rng(4).standard_normal(vectors.shape[1])
+    found, similarities = neighbours.nearest(index, query, k=7, mode="exact")
+    rows, expected = brute_force(vectors, query, 7)
+    assert found == [shas[row] for row in rows]
+    np.testing.assert_allclose(similarities, expected, rtol=1e-5)
+
+
+def test_exact_nearest_excludes_the_scored_commit():
+    index, shas, vectors = build_index()
+    found, similarities = neighbours.nearest(index, vectors[42], k=5, exclude=shas[42], mode="exact")
+    rows, expected = brute_force(vectors, vectors[42], 5, exclude_row=42)
+    assert shas[42] not in found
+    assert found == [shas[row] for row in rows]
+    np.testing.assert_allclose(similarities, expected, rtol=1e-5)
+
+
+def test_exact_nearest_with_fewer_rows_than_k():
+    index, shas, vectors = build_index(rows=4)
+    found, similarities = neighbours.nearest(index, vectors[0], k=10, mode="exact")
+    rows, _ = brute_force(vectors, vectors[0], 10)
+    assert found == [shas[row] for row in rows]
+    assert np.all(np.diff(similarities) <= 0)
+
+
+def clustered_store(tmp_path, rows=3000, dims=32, seed=11):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((30, dims))
+    vectors = (centres[rng.integers(0, len(centres), rows)] + 0.4 * rng.standard_normal((rows, dims))).astype(np.float32)
+    shas = [f"{row:040x}" for row in range(rows)]
+    store = fingerprint_store.open_store(str(tmp_path / "store"), dims=dims)
+    fingerprint_store.append(store, shas, vectors)
+    return store, shas, vectors
+
+
+def test_store_nearest_matches_brute_force_over_live_rows(tmp_path):
+    store, shas, vectors = clustered_store(tmp_path, rows=500)
+    # A re-stored commit supersedes its old row.
+    replacement = -vectors[7]
+    fingerprint_store.append(store, [shas[7]], [replacement])
+    vectors[7] = replacement
+    found, similarities = neighbours.store_nearest(store, vectors[3], k=10, exclude=shas[3])
+    rows, expected = brute_force(vectors, vectors[3], 10, exclude_row=3)
+    assert found == [shas[row] for row in rows]
+    np.testing.assert_allclose(similarities, expected, rtol=1e-5)
+
+
+def test_lsh_nearest_recalls_the_exact_neighbours(tmp_path):
+    store, shas, vectors = clustered_store(tmp_path)
+    index = neighbours.index_store(store)
+    unit = neighbours.unit_rows(vectors)
+    recalls, errors = [], []
+    for row in range(0, len(shas), 30):
+        found, similarities = neighbours.nearest(index, vectors[row], k=10, exclude=shas[row], mode="lsh")
+        exact, exact_similarities = neighbours.store_nearest(store, vectors[row], k=10, exclude=shas[row])
+        assert shas[row] not in found
+        assert np.all(np.diff(similarities) <= 0)
+        # Candidates are approximate, their similarities are not.
+        np.testing.assert_allclose(similarities, unit[[int(sha, 16) for sha in found]] @ unit[row], rtol=1e-5)
+        recalls.append(len(set(found) & set(exact)) / len(exact))
+        errors.append(abs(np.mean(similarities) - np.mean(exact_similarities)))
+    assert np.mean(recalls) >= 0.95
+    assert max(errors) < 0.02
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import risk_score_pipeline
+import risk_table
+
+
+def test_scores_match_calculate_risk_score_per_row(history_repo, cache_dir):
+    table = risk_score_pipeline.analyze_commits(history_repo)
+    assert len(table["hash"]) == 30
+    commit_scores = risk_table.scores(table)
+    expected = [risk_score_pipeline.calculate_risk_score(*table["components"][:, index]) for index in range(30)]
+    np.testing.assert_allclose(commit_scores, expected)
+
+    # The newest row is the record the per-commit pipeline reports for HEAD.
+    latest = risk_score_pipeline.analyze_latest_commit(history_repo)
+    del latest["message"]
+    assert risk_table.row(table, 29, commit_scores) == pytest.approx(latest)
+
+
+def test_saved_table_queries(history_repo, cache_dir):
+    risk_table.save_table(risk_score_pipeline.analyze_commits(history_repo))
+    table = risk_table.load_table()
+    commit_scores = risk_table.scores(table)
+
+    order = risk_table.top(table, 5, commit_scores)
+    assert list(order) == sorted(range(30), key=lambda index: (-commit_scores[index], -index))[:5]
+
+    authors, stats = risk_table.by_author(table, commit_scores, threshold=np.median(commit_scores))
+    assert list(authors) == ["Test"]
+    assert (stats["commits"][0], stats["max"][0]) == (30, commit_scores.max())
+    assert stats["mean"][0] == pytest.approx(commit_scores.mean())
+    assert stats["exceeded"][0] == np.count_nonzero(commit_scores >= np.median(commit_scores))
+
+    paths, stats = risk_table.by_path(table, commit_scores)
+    changes = np.diff(table["path_offsets"])
+    for path_id in range(len(paths)):
+        changed_by = [index for index in range(30)
+                      if path_id in table["path_ids"][table["path_offsets"][index]:table["path_offsets"][index + 1]]]
+        assert stats["commits"][path_id] == len(changed_by)
+        assert stats["max"][path_id] == commit_scores[changed_by].max()
+    assert stats["commits"].sum() == changes.sum()
@@ -0,0 +1,44 @@
+import pytest
+
+import fingerprint_pipeline
+import risk_score_pipeline
+import scoring_server
+from conftest import point_cache, run_git
+
+
+def ci_scores(repo, revs):
+    """
+    (similarity, risk score) of each rev as the CI pipelines report it, one run per push.
+    """
+    scores = {}
+    for rev in revs:
+        run_git(repo.working_dir, "checkout", "-q", rev)
+        latest_commit, similarity = fingerprint_pipeline.score_latest_commit(repo.working_dir)
+        scores[latest_commit["hash"]] = (similarity, risk_score_pipeline.analyze_latest_commit(repo)["risk_score"])
+    return scores
+
+
+def test_warm_head_and_folded_commits_keep_their_scores(monkeypatch, tmp_path, history_repo):
+    shas = history_repo.git.rev_list("--reverse", "main").split()
+    point_cache(monkeypatch, tmp_path / "ci")
+    expected = ci_scores(history_repo, [shas[-4], shas[-3], shas[-2], shas[-1]])
+
+    point_cache(monkeypatch, tmp_path / "warm")
+    run_git(history_repo.working_dir, "checkout", "-q", shas[-4])
+    scorer = scoring_server.WarmScorer(history_repo.working_dir)
+    # The warm head was folded at startup without being asked for.
+    [head] = scorer.score("HEAD")
+    assert (head["hash"], head["similarity"], head["risk_score"]) == pytest.approx((shas[-4], *expected[shas[-4]]))
+
+    run_git(history_repo.working_dir, "checkout", "-q", "main")
+    first = scorer.score("HEAD", shas[-4])
+    assert scorer.tip == shas[-1]
+    # Asked for again once folded, the same results come back.
+    assert scorer.score("HEAD", shas[-4]) == first
+    assert scorer.score("HEAD") == first[-1:]
+    assert [(result["hash"], result["similarity"], result["risk_score"]) for result in first] == pytest.approx(
+        [(sha, *expected[sha]) for sha in shas[-3:]])
+
+    # Commits folded before the server started have no kept result.
+    with pytest.raises(ValueError, match="already part of the warm baseline"):
+        scorer.score(shas[-5])